@@ -0,0 +1,304 @@
+"""
+Archive module, index of PDF bills in pdf folder
+
+Amount due, due date, billing period and reference number are read from text of every PDF file,
+and kept in archive table of var/state.sqlite3, by SHA-256 of file content.
+Only new or changed files are read, file with the same modification time and size is skipped.
+Queries read only the index, PDF files are never opened again.
+Text is read with pypdf package, or with pdftotext program (poppler-utils), whichever is installed.
+Copies of the same bill are kept once, other file names are hard links to it.
+
+    python3 -m eracuni.archive index
+    python3 -m eracuni.archive dedupe
+    python3 -m eracuni.archive list --alias home --period 2022
+    python3 -m eracuni.archive totals --alias home
+"""
+
+
+import os
+import re
+import sys
+import shutil
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from eracuni.state import ArchivedBill, file_sha256, state_store
+
+try:
+    from pypdf import PdfReader  # type: ignore
+    from pypdf.errors import PyPdfError  # type: ignore
+except ImportError:
+    PdfReader = None
+    PyPdfError = ValueError
+
+
+ARCHIVE_DIR = 'pdf'
+
+MONTHS = {
+    'januar': 1, 'februar': 2, 'mart': 3, 'april': 4, 'maj': 5, 'jun': 6,
+    'jul': 7, 'avgust': 8, 'septembar': 9, 'oktobar': 10, 'novembar': 11, 'decembar': 12,
+}
+
+# Labels as printed on EDB and InfoStan bills, value follows the label
+AMOUNT_RE = re.compile(r'za\s+uplatu\D{0,20}?'
+                       r'(\d{1,3}(?:\.\d{3})*,\d{2}|\d+,\d{2}|\d+\.\d{2})', re.IGNORECASE)
+DUE_DATE_RE = re.compile(r'(?:rok\s+pla[ćc]anja|datum\s+dospe[ćc]a|dospeva)\D{0,20}?'
+                         r'(\d{1,2})\.\s?(\d{1,2})\.\s?(\d{4})', re.IGNORECASE)
+REFERENCE_RE = re.compile(r'poziv\s+na\s+broj[^\d]{0,30}?(\d[\d\- ]{4,}\d)', re.IGNORECASE)
+PERIOD_RE = re.compile(r'(?:obra[čc]unski\s+period|za\s+mesec|period)\D{0,20}?'
+                       r'(?:\d{1,2}\.\s?(\d{1,2})\.\s?(\d{4})|(\d{1,2})[./](\d{4})|([a-zčćšđž]+)\s+(\d{4}))',
+                       re.IGNORECASE)
+# Archive file name is {infix}_{YYYY-MM}_{original name}.pdf
+FILE_NAME_RE = re.compile(r'^(?P<infix>.+?)_(?P<month>\d{4}-\d{2})_')
+INFIX_PREFIXES = ('edb_dom_', 'edb_mg_', 'infostan_')
+# Errors of one broken or unreadable PDF file, file is skipped and index goes on
+READ_ERRORS = (OSError, ValueError, PyPdfError, subprocess.SubprocessError)
+
+
+class ArchiveError(Exception):
+    """
+    PDF text can't be read on this system
+    """
+
+
+def pdf_text(path: Path) -> str:
+    """
+    Return text of every page of PDF file
+    Raise ArchiveError if neither pypdf nor pdftotext is installed
+    """
+    if PdfReader is not None:
+        return '\n'.join(page.extract_text() or '' for page in PdfReader(str(path)).pages)
+    if shutil.which('pdftotext'):
+        return subprocess.run(['pdftotext', '-layout', str(path), '-'], capture_output=True, check=True,
+                              timeout=60).stdout.decode('utf8', 'replace')
+    raise ArchiveError('Archive index needs pypdf package or pdftotext program')
+
+
+def link_duplicate(duplicate: Path, original: Path) -> Path:
+    """
+    Replace duplicate file with hard link to original, return path that keeps the content
+    If file system has no hard links, duplicate is removed and original path is returned
+    """
+    if duplicate.exists() and os.path.samefile(duplicate, original):
+        return duplicate
+    link_path = duplicate.with_name(duplicate.name + '.link')
+    try:
+        os.link(original, link_path)
+        os.replace(link_path, duplicate)
+        return duplicate
+    except OSError:
+        if link_path.exists():
+            link_path.unlink()
+        duplicate.unlink()
+        return original
+
+
+def period_key(label: str) -> Optional[str]:
+    """
+    Return billing period as YYYY-MM, from portal label like "Maj 2022", None if it can't be read
+    """
+    words = label.strip().lower().split()
+    if len(words) == 2 and len(words[0]) >= 3 and words[1].isdigit():
+        for name, month in MONTHS.items():
+            if name.startswith(words[0][:3]):
+                return f'{words[1]}-{month:02d}'
+    return None
+
+
+def parse_bill(text: str) -> Dict[str, Optional[str]]:
+    """
+    Return amount, due date (YYYY-MM-DD), period (YYYY-MM) and reference number found in bill text
+    Missing values are None
+    """
+    fields: Dict[str, Optional[str]] = {'amount': None, 'due_date': None, 'period': None, 'reference': None}
+    found = AMOUNT_RE.search(text)
+    if found:
+        amount = found.group(1)
+        fields['amount'] = amount.replace('.', '').replace(',', '.') if ',' in amount else amount
+    found = DUE_DATE_RE.search(text)
+    if found:
+        day, month, year = (int(value) for value in found.groups())
+        fields['due_date'] = f'{year}-{month:02d}-{day:02d}'
+    found = REFERENCE_RE.search(text)
+    if found:
+        fields['reference'] = re.sub(r'\s+', '', found.group(1))
+    for found in PERIOD_RE.finditer(text):
+        if found.group(2):
+            fields['period'] = f'{found.group(2)}-{int(found.group(1)):02d}'
+        elif found.group(4):
+            fields['period'] = f'{found.group(4)}-{int(found.group(3)):02d}'
+        else:
+            fields['period'] = period_key(f'{found.group(5)} {found.group(6)}')
+        if fields['period']:
+            break
+    return fields
+
+
+def alias_of(infix: Optional[str]) -> Optional[str]:
+    """
+    Return account alias from infix, edb_dom_{alias}, edb_mg_{alias} or infostan_{alias}_{location}
+    """
+    if not infix:
+        return None
+    for prefix in INFIX_PREFIXES:
+        if infix.startswith(prefix):
+            alias = infix[len(prefix):]
+            if prefix == 'infostan_':
+                alias = re.sub(r'_\d+$', '', alias)
+            return alias
+    return infix
+
+
+class ArchiveIndex:
+    """
+    Index of PDF files in archive folder, in state store
+    read_text is PDF text reader, pdf_text by default
+    """
+    def __init__(self, archive_dir: str = ARCHIVE_DIR, read_text: Callable[[Path], str] = pdf_text) -> None:
+        self.archive_dir = Path(archive_dir)
+        self.read_text = read_text
+        self.store = state_store()
+
+    def read_bill(self, path: Path, sha256: str) -> ArchivedBill:
+        """
+        Read metadata of one PDF file
+        Account and period come from bills table when scraper downloaded the file, otherwise from file name
+        """
+        fields = parse_bill(self.read_text(path))
+        bill = self.store.bill_by_hash(sha256)
+        if bill is not None:
+            infix, period = bill.infix, period_key(bill.period)
+        else:
+            found = FILE_NAME_RE.match(path.name)
+            infix, period = (found.group('infix'), None) if found else (None, None)
+        amount = float(fields['amount']) if fields['amount'] else None
+        return ArchivedBill(sha256, infix, fields['period'] or period, amount, fields['due_date'],
+                            fields['reference'])
+
+    def update(self) -> Tuple[int, int]:
+        """
+        Index new and changed files, forget removed ones
+        Return number of files read and number of files that could not be read
+        Raise ArchiveError if PDF text can't be read at all
+        """
+        known = self.store.archive_files()
+        seen = set()
+        read, failed = 0, 0
+        for path in sorted(self.archive_dir.glob('*.pdf')):
+            key = str(path)
+            seen.add(key)
+            stat = path.stat()
+            if key in known and known[key][:2] == (stat.st_mtime, stat.st_size):
+                continue
+            sha256 = file_sha256(path)
+            bill = None
+            if not self.store.is_archived(sha256):
+                try:
+                    bill = self.read_bill(path, sha256)
+                except READ_ERRORS as e:
+                    print(f"Can't read {path}: {e}", file=sys.stderr)
+                    failed += 1
+                    continue
+                read += 1
+            self.store.record_archive(key, stat.st_mtime, stat.st_size, sha256, bill)
+        self.store.forget_archive_files([path for path in known if path not in seen])
+        return read, failed
+
+    def dedupe(self) -> Tuple[int, int]:
+        """
+        Hash every file in archive, link copies of the same content to the oldest one
+        Hash of file with unchanged modification time and size is taken from index
+        Return number of linked files and number of bytes saved
+        """
+        known = self.store.archive_files()
+        groups: Dict[str, List[Path]] = {}
+        for path in self.archive_dir.glob('*.pdf'):
+            stat = path.stat()
+            cached = known.get(str(path))
+            sha256 = cached[2] if cached and cached[:2] == (stat.st_mtime, stat.st_size) else file_sha256(path)
+            groups.setdefault(sha256, []).append(path)
+
+        linked, saved = 0, 0
+        for paths in groups.values():
+            paths.sort(key=lambda path: (path.stat().st_mtime, path.name))
+            original = paths[0]
+            for path in paths[1:]:
+                if os.path.samefile(path, original):
+                    continue
+                size = path.stat().st_size
+                kept = link_duplicate(path, original)
+                if kept != path:
+                    self.store.move_pdf_path(path, kept)
+                linked += 1
+                saved += size
+        return linked, saved
+
+    def bills(self, alias: Optional[str] = None, period: Optional[str] = None) -> List[ArchivedBill]:
+        """
+        Return indexed bills of alias, with period starting with period (YYYY or YYYY-MM)
+        """
+        return [bill for bill in self.store.archived_bills()
+                if (alias is None or alias_of(bill.infix) == alias)
+                and (period is None or (bill.period or '').startswith(period))]
+
+    def totals(self, alias: Optional[str] = None, period: Optional[str] = None) -> Dict[Tuple[str, str], float]:
+        """
+        Return sum of amounts by alias and year
+        """
+        sums: Dict[Tuple[str, str], float] = {}
+        for bill in self.bills(alias, period):
+            key = (alias_of(bill.infix) or '?', (bill.period or '?')[:4])
+            sums[key] = sums.get(key, 0.0) + (bill.amount or 0.0)
+        return sums
+
+
+def index_archive() -> None:
+    """
+    Index new bills after run, report problem to stderr without failing the run
+    """
+    try:
+        read, failed = ArchiveIndex().update()
+    except ArchiveError as e:
+        print(f'Archive is not indexed: {e}, or set archive_index: False', file=sys.stderr)
+        return
+    if failed:
+        print(f'Archive index: {read} new bills, {failed} files could not be read', file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Index and query archive of PDF bills')
+    parser.add_argument('command', choices=['index', 'dedupe', 'list', 'totals'])
+    parser.add_argument('--alias', help='account alias from config.yaml')
+    parser.add_argument('--period', help='year (YYYY) or month (YYYY-MM)', default=None)
+    parser.add_argument('--archive', default=ARCHIVE_DIR, help='archive folder, pdf by default')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    index = ArchiveIndex(args.archive)
+    if args.command == 'index':
+        try:
+            read, failed = index.update()
+        except ArchiveError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(f'{read} new bills indexed, {failed} failed')
+        if failed:
+            sys.exit(1)
+    elif args.command == 'dedupe':
+        linked, saved = index.dedupe()
+        print(f'{linked} duplicate files linked, {saved / 1024 / 1024:.1f} MB saved')
+    elif args.command == 'list':
+        for bill in index.bills(args.alias, args.period):
+            amount = f'{bill.amount:.2f}' if bill.amount is not None else '-'
+            print(f"{bill.period or '-':8} {alias_of(bill.infix) or '-':12} {amount:>10} "
+                  f"{bill.due_date or '-':10} {bill.reference or '-':24} {bill.path}")
+    else:
+        for (alias, year), total in sorted(index.totals(args.alias, args.period).items()):
+            print(f'{year:4} {alias:12} {total:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Backfill module, download every older bill that is missing from archive
+
+Scrapers list every invoice row of every account and location, and give missing ones to Backfill.
+PDF files are downloaded in parallel, at most backfill_workers at once, with session cookies of the account.
+Every finished file is recorded at once in var/state.sqlite3, so interrupted backfill resumes where it stopped.
+Backfilled bills don't change last_saved and don't send notifications.
+"""
+
+
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import requests
+from eracuni.data import Config, Storage
+from eracuni.downloads import PdfError, fetch_pdf, http_session
+
+
+class Backfill:
+    """
+    Pool of downloads of missing bills
+
+    Scraper calls queue_missing() with PDF addresses of every invoice row of storage,
+    and finish() before logout, while session cookies are still valid
+    Downloads are kept per scraper thread, so pool workers wait only for their own account
+    """
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.executor = ThreadPoolExecutor(max_workers=config.backfill_workers, thread_name_prefix='backfill')
+        self.futures: Dict[int, List[Future]] = {}
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.failed = 0
+
+    @staticmethod
+    def missing(storage: Storage, periods: List[str]) -> List[str]:
+        """
+        Return periods not yet in archive, in order of periods
+        """
+        known = storage.store.periods(storage.file_name_infix)
+        return [period for period in periods if period and period not in known]
+
+    def queue_missing(self, storage: Storage, urls: Dict[str, Optional[str]], cookies: List[Dict[str, Any]]) -> None:
+        """
+        Start download of every period missing from archive, urls maps period to PDF address
+        """
+        for period in self.missing(storage, list(urls)):
+            url = urls[period]
+            if url and url.startswith(('http://', 'https://')):
+                self.download(storage, period, url, cookies)
+            else:
+                print(f"Can't backfill {storage.file_name_infix} {period}, PDF address is unknown", file=sys.stderr)
+                with self.lock:
+                    self.failed += 1
+
+    def download(self, storage: Storage, period: str, url: str, cookies: List[Dict[str, Any]]) -> None:
+        """
+        Start download of one bill, cookies are in WebDriver get_cookies() format
+        """
+        future = self.executor.submit(self.fetch, storage, period, url, cookies)
+        with self.lock:
+            self.futures.setdefault(threading.get_ident(), []).append(future)
+
+    def fetch(self, storage: Storage, period: str, url: str, cookies: List[Dict[str, Any]]) -> None:
+        session = http_session(self.config)
+        session.cookies.clear()
+        for cookie in cookies:
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                                path=cookie.get('path', '/'))
+        # Older bills often have the same file name, period keeps them apart
+        def target(file_name: str) -> Path:
+            return storage.pdf_path(f"{period.replace(' ', '_')}_{file_name}")
+
+        try:
+            pdf_path = fetch_pdf(session, url, target, self.config.step_timeout('download'))
+        except (PdfError, requests.RequestException) as e:
+            print(f"Can't backfill {storage.file_name_infix} {period}: {e}", file=sys.stderr)
+            with self.lock:
+                self.failed += 1
+            return
+        pdf_path, sha256, _ = storage.deduplicate(pdf_path)
+        storage.store.record(storage.file_name_infix, period, pdf_path, backfilled=True, sha256=sha256)
+        print(f'Backfilled {storage.file_name_infix} {period}: {pdf_path}')
+        with self.lock:
+            self.downloaded += 1
+
+    def finish(self) -> None:
+        """
+        Wait until every download started by this thread is done
+        """
+        with self.lock:
+            futures = self.futures.pop(threading.get_ident(), [])
+        wait(futures)
+
+    def close(self) -> None:
+        """
+        Wait for all downloads and report totals
+        """
+        with self.lock:
+            futures = [future for thread_futures in self.futures.values() for future in thread_futures]
+            self.futures = {}
+        wait(futures)
+        self.executor.shutdown()
+        print(f'Backfill: {self.downloaded} bills downloaded, {self.failed} failed')
@@ -0,0 +1,92 @@
+"""
+Billing calendar module, skip accounts with no bill due
+
+Bills come roughly monthly. Next bill of every account or location is expected one usual interval
+(median of intervals between first downloads of its last bills) after the last one. Account is checked only from
+billing_window days before that date, and at least every billing_force_days days.
+Last check and last skip are kept in checks table of var/state.sqlite3, every decision is logged with its reason.
+"""
+
+
+import logging
+from datetime import datetime, timedelta
+from statistics import median
+from typing import List, Optional, Tuple
+from eracuni.data import Config
+from eracuni.state import state_store
+
+
+logger = logging.getLogger(__name__)
+
+# Number of last bills used to learn the interval
+HISTORY = 6
+# Bills downloaded less than a day apart are the same issue, like bills of old storage migration
+MIN_INTERVAL = timedelta(days=1)
+
+
+class BillingCalendar:
+    """
+    Decide if account is checked or skipped
+    Does nothing if billing_calendar is disabled in config, every account is checked
+    """
+    def __init__(self, config: Config) -> None:
+        self.enabled = config.billing_calendar
+        self.window = timedelta(days=config.billing_window)
+        self.force = timedelta(days=config.billing_force_days)
+        self.store = state_store()
+
+    def expected(self, infix: str) -> Optional[datetime]:
+        """
+        Return expected time of next bill, None if there are less than two bills to learn from
+        """
+        # Backfilled bills were downloaded all at once, long after they came
+        # Remote bills were found by another host, whenever this one learned about them
+        # Bill downloaded again keeps time it was first seen, when it really came
+        downloads = sorted(datetime.fromisoformat(bill.first_seen_at) for bill in self.store.history(infix)
+                           if not bill.backfilled and not bill.remote)[-HISTORY:]
+        intervals = [later - earlier for earlier, later in zip(downloads, downloads[1:])
+                     if later - earlier >= MIN_INTERVAL]
+        if not intervals:
+            return None
+        return downloads[-1] + median(intervals)
+
+    def due(self, key: str, infixes: List[str], label: str, now: Optional[datetime] = None) -> bool:
+        """
+        Return True if account should be checked
+        key is account key in checks table, infixes are account storage or all its known locations
+        """
+        if not self.enabled:
+            return True
+        now = now or datetime.now()
+        check, reason = self.decide(key, infixes, now)
+        logger.info('%s: %s, %s', label, 'check' if check else 'skip', reason)
+        if not check:
+            self.store.record_check(key, 'skipped', reason)
+        return check
+
+    def decide(self, key: str, infixes: List[str], now: datetime) -> Tuple[bool, str]:
+        last_check = self.store.last_check(key)
+        if last_check is None:
+            return True, 'never checked'
+        if now - datetime.fromisoformat(last_check) >= self.force:
+            return True, f'last full check {last_check}'
+        if not infixes:
+            return True, 'no bill history'
+
+        waiting = []
+        for infix in infixes:
+            expected = self.expected(infix)
+            if expected is None:
+                return True, f'not enough bill history of {infix}'
+            if now >= expected - self.window:
+                return True, f'bill of {infix} expected around {expected:%Y-%m-%d}'
+            waiting.append(expected)
+        return False, f'next bill expected around {min(waiting):%Y-%m-%d}, checking from ' \
+                      f'{min(waiting) - self.window:%Y-%m-%d}'
+
+    def checked(self, key: str) -> None:
+        """
+        Record full check of account, call when account is checked without failure
+        """
+        if self.enabled:
+            self.store.record_check(key, 'checked')
@@ -5,83 +5,682 @@ Browser module, as Selenium wrapper
 
 import os
 import sys
-from typing import List, Any
+import json
+import time
+import shutil
+import logging
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Optional
+from urllib.parse import quote
+import requests
 from selenium import webdriver  # type: ignore
 from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options  # type: ignore
-from selenium.common.exceptions import NoSuchElementException  # type: ignore
+from selenium.webdriver.remote.webelement import WebElement  # type: ignore
+from selenium.webdriver.support.ui import WebDriverWait  # type: ignore
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, \
+    WebDriverException  # type: ignore
 from eracuni.data import Config
+from eracuni.downloads import Download, DownloadTimeout, PdfError, fetch_pdf
+from eracuni.profile import clone_profile, template_ready
+from eracuni.remote import EndpointPool, RemoteError, RemoteFiles, endpoint_pool
+from eracuni.tracing import tracer
 
 
-def firefox(config: Config) -> webdriver:
+logger = logging.getLogger(__name__)
+
+
+class ScraperError(Exception):
+    """
+    Page is not as expected, check of account failed
+    """
+
+
+# Lean mode: no images, fonts, media, prefetch, telemetry or disk cache
+LEAN_PREFERENCES: Dict[str, Any] = {
+    'permissions.default.image': 2,
+    'gfx.downloadable_fonts.enabled': False,
+    'browser.display.use_document_fonts': 0,
+    'media.autoplay.default': 5,
+    'media.video_stats.enabled': False,
+    'media.peerconnection.enabled': False,
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+    'network.http.speculative-parallel-limit': 0,
+    'network.predictor.enabled': False,
+    'browser.urlbar.speculativeConnect.enabled': False,
+    'toolkit.telemetry.enabled': False,
+    'toolkit.telemetry.unified': False,
+    'toolkit.telemetry.archive.enabled': False,
+    'datareporting.healthreport.uploadEnabled': False,
+    'datareporting.policy.dataSubmissionEnabled': False,
+    'app.normandy.enabled': False,
+    'app.update.auto': False,
+    'browser.ping-centre.telemetry': False,
+    'browser.safebrowsing.malware.enabled': False,
+    'browser.safebrowsing.phishing.enabled': False,
+    'extensions.update.enabled': False,
+    'browser.cache.disk.enable': False,
+}
+
+
+# Low memory mode: one content process, small caches, no pages kept for back and forward
+LOW_MEMORY_PREFERENCES: Dict[str, Any] = {
+    'dom.ipc.processCount': 1,
+    'dom.ipc.processCount.webIsolated': 1,
+    'dom.ipc.processPrelaunch.enabled': False,
+    'fission.autostart': False,
+    'browser.tabs.remote.warmup.enabled': False,
+    'browser.cache.memory.capacity': 16384,
+    'media.memory_cache_max_size': 4096,
+    'image.mem.surfacecache.max_size_kb': 32768,
+    'browser.sessionhistory.max_total_viewers': 0,
+    'browser.sessionhistory.max_entries': 5,
+    'browser.sessionstore.max_tabs_undo': 0,
+    'browser.sessionstore.resume_from_crash': False,
+}
+
+
+class CountingFirefox(webdriver.Firefox):
+    """
+    Firefox driver that counts WebDriver commands, every command is one HTTP round trip to geckodriver
+    """
+    commands = 0
+    # Wait timeout used when caller does not give one, from config of this browser
+    default_timeout: float = 30
+    # Clone of profile template, removed when browser quits
+    profile_clone: Optional[Path] = None
+
+    def execute(self, driver_command: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        self.commands += 1
+        return super().execute(driver_command, params)
+
+    def quit(self) -> None:
+        try:
+            super().quit()
+        finally:
+            if self.profile_clone is not None:
+                shutil.rmtree(self.profile_clone, ignore_errors=True)
+                self.profile_clone = None
+
+
+class CountingRemote(webdriver.Remote):
+    """
+    Browser on remote WebDriver endpoint, counts commands like CountingFirefox
+    Endpoint is given back to its pool when browser quits
+    """
+    commands = 0
+    default_timeout: float = 30
+    endpoint = ''
+    pool: Optional[EndpointPool] = None
+
+    def execute(self, driver_command: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        self.commands += 1
+        return super().execute(driver_command, params)
+
+    def quit(self) -> None:
+        try:
+            super().quit()
+        finally:
+            if self.pool is not None:
+                self.pool.release(self.endpoint)
+                self.pool = None
+
+
+def allowlist_pac(hosts: List[str]) -> str:
+    """
+    Return proxy auto-config script, allowed hosts and their subdomains go direct
+    Every other host goes to closed local port, so request fails at once
+    """
+    return f"""function FindProxyForURL(url, host) {{
+    var allowed = {json.dumps(sorted(hosts))};
+    for (var i = 0; i < allowed.length; i++)
+        if (host == allowed[i] || dnsDomainIs(host, '.' + allowed[i]))
+            return 'DIRECT';
+    return 'PROXY 127.0.0.1:9';
+}}"""
+
+
+def preferences(config: Config, download_dir: str = 'var', tabs: bool = False) -> Dict[str, Any]:
+    """
+    Return Firefox preferences of scraper browser
+    """
+    prefs: Dict[str, Any] = {
+        'general.useragent.override': config.user_agent,
+        'browser.download.folderList': 2,
+        'browser.download.manager.showWhenStarting': False,
+        'browser.download.manager.useWindow': False,
+        'pdfjs.disabled': True,
+        'browser.download.dir': os.path.join(os.getcwd(), download_dir),
+        'browser.helperApps.neverAsk.openFile':
+            'application/octet-stream, application/pdf, application/x-www-form-urlencoded',
+        'browser.helperApps.neverAsk.saveToDisk':
+            'application/octet-stream, application/pdf, application/x-www-form-urlencoded',
+    }
+    if config.lean_mode:
+        prefs.update(LEAN_PREFERENCES)
+        prefs['network.proxy.type'] = 2
+        prefs['network.proxy.autoconfig_url'] = \
+            'data:application/x-ns-proxy-autoconfig,' + quote(allowlist_pac(config.lean_hosts()))
+    if config.low_memory:
+        prefs.update(LOW_MEMORY_PREFERENCES)
+    if tabs:
+        prefs['privacy.userContext.enabled'] = True
+    return prefs
+
+
+def firefox(config: Config, download_dir: str = 'var', tabs: bool = False,
+            profile_dir: Optional[Path] = None) -> webdriver:
     """
     Start browser with disabled "Save PDF" dialog
-    Download files to var folder
+    Download files to download_dir folder, var by default
+    In lean mode, load only what scrapers need, from portal hosts only
+    With tabs, browser is shared by accounts in container tabs, navigation does not wait for page load
+    Browser starts from clone of profile template if it is built, or in profile_dir when template is built
+    With remote_webdrivers, browser is started on remote endpoint instead
     """
     my_options = Options()
+    if tabs:
+        my_options.page_load_strategy = 'none'
+
     if config.headless:
         my_options.headless = True
         my_options.add_argument('--window-size=1920,1200')
-    my_profile = webdriver.FirefoxProfile()
-    my_profile.set_preference('general.useragent.override', config.user_agent)
-    my_profile.set_preference('browser.download.folderList', 2)
-    my_profile.set_preference('browser.download.manager.showWhenStarting', False)
-    my_profile.set_preference('browser.download.manager.useWindow', False)
-    my_profile.set_preference('pdfjs.disabled', True)
-    my_profile.set_preference('browser.download.dir',
-                              os.path.join(os.getcwd(), 'var'))
-    my_profile.set_preference('browser.helperApps.neverAsk.openFile',
-                              'application/octet-stream, application/pdf, application/x-www-form-urlencoded')
-    my_profile.set_preference('browser.helperApps.neverAsk.saveToDisk',
-                              'application/octet-stream, application/pdf, application/x-www-form-urlencoded')
-    driver = webdriver.Firefox(executable_path=config.gecko_path(), options=my_options, firefox_profile=my_profile)
-    driver.implicitly_wait(config.timeout)
+    prefs = preferences(config, download_dir, tabs)
+    if config.remote_webdrivers and profile_dir is None:
+        return remote_firefox(config, my_options, prefs)
+    clone = None
+    if profile_dir is None and template_ready(config):
+        with tracer.span('profile_clone'):
+            clone = profile_dir = clone_profile(Path(config.profile_template))
+    my_profile = None
+    if profile_dir is not None:
+        # Firefox uses profile folder as it is, nothing is zipped and sent to geckodriver
+        # Disk cache is in profile folder, it keeps static files of portals, also in lean mode
+        my_options.add_argument('-profile')
+        my_options.add_argument(str(profile_dir))
+        prefs['browser.cache.disk.enable'] = True
+        prefs['browser.cache.disk.parent_directory'] = str(profile_dir.resolve())
+        for name, value in prefs.items():
+            my_options.set_preference(name, value)
+    else:
+        my_profile = webdriver.FirefoxProfile()
+        for name, value in prefs.items():
+            my_profile.set_preference(name, value)
+    # Allow chrome context, for changing download folder while browser is running
+    os.environ.setdefault('MOZ_REMOTE_ALLOW_SYSTEM_ACCESS', '1')
+    started = time.perf_counter()
+    try:
+        with tracer.span('browser_launch'):
+            driver = CountingFirefox(executable_path=config.gecko_path(), options=my_options,
+                                     firefox_profile=my_profile)
+    except Exception:
+        if clone is not None:
+            shutil.rmtree(clone, ignore_errors=True)
+        raise
+    driver.profile_clone = clone
+    # No implicit wait, every lookup waits explicitly for its own condition, this is its default budget
+    driver.default_timeout = config.timeout
+    if config.page_metrics:
+        print(f"Browser launch: {time.perf_counter() - started:.2f} s, "
+              f"{'profile template' if clone is not None else 'new profile'}")
     return driver
 
 
-def find_first_by_id(browser: webdriver, target: str) -> webdriver:
+def remote_firefox(config: Config, options: Options, prefs: Dict[str, Any]) -> webdriver:
+    """
+    Start browser on least loaded ready endpoint of remote_webdrivers, next one is tried if it fails
+    Downloads stay in download folder of remote node, Selenium Grid keeps them for download_file
+    Raise ScraperError if browser can't be started on any endpoint
+    """
+    # Local folder means nothing on remote node
+    prefs.pop('browser.download.dir', None)
+    for name, value in prefs.items():
+        options.set_preference(name, value)
+    options.set_capability('se:downloadsEnabled', True)
+    pool = endpoint_pool(config.remote_webdrivers, config.remote_check_timeout)
+    try:
+        endpoints = pool.candidates()
+    except RemoteError as e:
+        raise ScraperError(str(e))
+    for endpoint in endpoints:
+        pool.acquire(endpoint)
+        try:
+            with tracer.span('browser_launch'):
+                driver = CountingRemote(command_executor=endpoint, options=options)
+        except WebDriverException as e:
+            pool.release(endpoint)
+            print(f"Can't start browser on {endpoint}: {e.msg}", file=sys.stderr)
+            continue
+        driver.endpoint, driver.pool = endpoint, pool
+        driver.default_timeout = config.timeout
+        return driver
+    raise ScraperError(f"Can't start browser on any of {', '.join(endpoints)}")
+
+
+def process_tree_rss(pid: Optional[int]) -> int:
+    """
+    Return resident memory of process and all its descendants, in MB, 0 without /proc
+    """
+    if pid is None or not os.path.isdir('/proc'):
+        return 0
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as fin:
+                # Process name may have spaces, ppid is second field after it
+                ppid = int(fin.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pages = 0
+    todo = [pid]
+    while todo:
+        current = todo.pop()
+        try:
+            with open(f'/proc/{current}/statm') as fin:
+                pages += int(fin.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        todo += children.get(current, [])
+    return pages * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+
+
+class LazyBrowser:
+    """
+    Browser proxy, Firefox is started on first use and can be started again after quit
+    Scrapers use it as webdriver, so accounts checked without browser never start Firefox
+    In low memory mode, browser is restarted between accounts when it grows too big
+    """
+    def __init__(self, config: Config, download_dir: str = 'var', tabs: bool = False) -> None:
+        self._config = config
+        self.download_dir = download_dir
+        self.tabs = tabs
+        self._driver = None
+        self.accounts = 0
+
+    @property
+    def started(self) -> bool:
+        return self._driver is not None
+
+    @property
+    def pid(self) -> Optional[int]:
+        """
+        Process id of geckodriver, Firefox runs as its child, None if browser is not started
+        """
+        if self._driver is None:
+            return None
+        # Remote browser has no local process
+        process = getattr(getattr(self._driver, 'service', None), 'process', None)
+        return process.pid if process is not None else None
+
+    @property
+    def default_timeout(self) -> float:
+        return self._config.timeout
+
+    def __getattr__(self, name: str) -> Any:
+        if self._driver is None:
+            self._driver = firefox(self._config, self.download_dir, self.tabs)
+        return getattr(self._driver, name)
+
+    def account_checked(self) -> None:
+        """
+        In low memory mode, sample memory of geckodriver and Firefox after account
+        Quit browser after low_memory_accounts accounts, or when it uses more than low_memory_max_rss MB,
+        next account starts a fresh one
+        """
+        if not self._config.low_memory or self._driver is None:
+            return
+        self.accounts += 1
+        rss = process_tree_rss(self.pid)
+        restart = self.accounts >= self._config.low_memory_accounts or rss > self._config.low_memory_max_rss
+        tracer.memory(rss, restart)
+        if restart:
+            logger.info('Browser restarted after %d accounts, %d MB', self.accounts, rss)
+            self.quit()
+
+    def quit(self) -> None:
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+        self.accounts = 0
+
+
+class PageMetrics:
+    """
+    Step metrics of scraper accounts
+    Duration of every step goes to run tracer, as span since previous step
+    With page_metrics in config, also report bytes transferred and page load time per step,
+    from browser Navigation and Resource Timing API, and number of WebDriver commands per account
+    Every step reports bytes transferred since previous step, or since page load on a new page
+    """
+    SCRIPT = """
+    var navigation = performance.getEntriesByType('navigation')[0];
+    var bytes = navigation ? navigation.transferSize : 0;
+    performance.getEntriesByType('resource').forEach(function (entry) { bytes += entry.transferSize || 0; });
+    return {
+        page: performance.timeOrigin,
+        bytes: bytes,
+        load_ms: navigation && navigation.loadEventEnd ? navigation.loadEventEnd - navigation.startTime : null
+    };
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.enabled = config.page_metrics
+        self.total_bytes = 0
+        self._page: Optional[float] = None
+        self._bytes = 0
+        self._commands = 0
+
+    def start_account(self, browser: webdriver, provider: str, account: str) -> None:
+        tracer.start(provider, account)
+        if self.enabled:
+            self._commands = getattr(browser, 'commands', 0)
+
+    def end_account(self, browser: webdriver, provider: str, account: str) -> None:
+        """
+        Close logout step, report number of WebDriver commands used for account, since start_account
+        """
+        tracer.mark(provider, account, 'logout')
+        if self.enabled:
+            commands = getattr(browser, 'commands', 0)
+            # Browser restarted in between counts from zero
+            print(f'{provider} ({account}): {commands - self._commands if commands >= self._commands else commands} '
+                  f'WebDriver commands')
+
+    def step(self, browser: webdriver, provider: str, account: str, name: str) -> None:
+        tracer.mark(provider, account, name)
+        if not self.enabled:
+            return
+        try:
+            metrics = browser.execute_script(self.SCRIPT)
+        except WebDriverException:
+            return
+        if metrics['page'] != self._page:
+            self._page, self._bytes = metrics['page'], 0
+        step_bytes = metrics['bytes'] - self._bytes
+        self._bytes = metrics['bytes']
+        self.total_bytes += step_bytes
+        load = f", page load {metrics['load_ms']:.0f} ms" if metrics['load_ms'] is not None else ''
+        print(f'{provider} ({account}) {name}: {step_bytes / 1024:.1f} kB{load}')
+
+
+# Wait timeout of browser that does not know its config
+DEFAULT_TIMEOUT: float = 30
+
+
+def wait_timeout(browser: Any) -> float:
+    """
+    Return wait timeout of browser, or of browser of web element, used when caller does not give one
+    Every browser has it from its own config, so workers with different configs don't share it
+    """
+    if isinstance(browser, WebElement):
+        browser = browser.parent
+    return getattr(browser, 'default_timeout', DEFAULT_TIMEOUT)
+
+
+def condition_met(by: str, target: str, condition: str, count: int) -> Callable[[Any], Any]:
+    """
+    Return check for WebDriverWait:
+        present:    first element is in DOM
+        clickable:  first element that is displayed and enabled
+        text:       first element with non-empty text
+        count:      list of elements, when there are at least count of them
+    """
+    def check(browser: webdriver) -> Any:
+        elements = browser.find_elements(by, target)
+        if condition == 'count':
+            return elements if len(elements) >= count else False
+        for element in elements:
+            if condition == 'present':
+                return element
+            if condition == 'clickable' and element.is_displayed() and element.is_enabled():
+                return element
+            if condition == 'text' and (element.get_attribute('textContent') or '').strip():
+                return element
+        return False
+    return check
+
+
+def wait_for(browser: webdriver, target: str, condition: str = 'present', timeout: Optional[float] = None,
+             by: str = By.CSS_SELECTOR, count: int = 1) -> Any:
     """
-    Locate web element by id attribute
+    Wait until condition is met for target, in browser or inside web element
+    Return element, or list of elements for count condition
+    Raise TimeoutException after timeout seconds
+    Time every wait actually took is logged, as debug
+    """
+    timeout = wait_timeout(browser) if timeout is None else timeout
+    start = time.monotonic()
+    outcome = 'timeout'
+    try:
+        result = WebDriverWait(browser, timeout, poll_frequency=0.1,
+                               ignored_exceptions=(StaleElementReferenceException,)).until(
+            condition_met(by, target, condition, count))
+        outcome = 'ok'
+        return result
+    finally:
+        logger.debug('wait %s %s: %s in %.3fs (budget %.0fs)',
+                     condition, target, outcome, time.monotonic() - start, timeout)
+
+
+EXTRACT_SCRIPT = """
+function value(node, attr) {
+    if (attr === 'element') return node;
+    if (attr === 'text') return (node.innerText || node.textContent || '').trim();
+    if (['undefined', 'object', 'function'].indexOf(typeof node[attr]) < 0) return node[attr];
+    return node.getAttribute(attr);
+}
+function run(root, spec) {
+    var out = {};
+    Object.keys(spec).forEach(function (name) {
+        var field = spec[name];
+        var read = function (node) { return field.fields ? run(node, field.fields) : value(node, field.attr || 'text'); };
+        if (field.all) {
+            out[name] = Array.prototype.map.call(root.querySelectorAll(field.css), read);
+        } else {
+            var node = field.css ? root.querySelector(field.css) : root;
+            out[name] = node ? read(node) : null;
+        }
+    });
+    return out;
+}
+return run(arguments[1] || document, arguments[0]);
+"""
+
+
+def extract(browser: webdriver, spec: Dict[str, Any], root: Any = None) -> Dict[str, Any]:
+    """
+    Read many values from page, or from inside root element, in one WebDriver call
+
+    spec is dictionary of name: field, every field is dictionary with:
+        css:    css selector, relative to root, without css field is root itself
+        attr:   text (default), element, or attribute / property name
+        all:    True for list of every matching element, otherwise first one or None
+        fields: nested spec, read for every matching element instead of attr
+
+    Example, period text and download cell of every invoice row:
+        {'rows': {'css': 'table.x2f tbody tr', 'all': True, 'fields': {
+            'period': {'css': 'td:nth-child(2)'},
+            'save_button': {'css': 'td:last-child', 'attr': 'element'}}}}
+    """
+    return browser.execute_script(EXTRACT_SCRIPT, spec, root)
+
+
+def find_first_by_id(browser: webdriver, target: str, condition: str = 'present',
+                     timeout: Optional[float] = None) -> webdriver:
+    """
+    Locate web element by id attribute, wait for condition
     Return first one
-    Catch No Such Element Exception error, report problem to stderr and quit with exit code 1
+    Raise ScraperError after timeout
     """
     try:
-        element = browser.find_element(By.ID, target)
-        return element
-    except NoSuchElementException:
-        print(f"Can't find id: {target}", file=sys.stderr)
-        browser.quit()
-        sys.exit(1)
+        return wait_for(browser, target, condition, timeout, By.ID)
+    except TimeoutException:
+        raise ScraperError(f"Can't find id: {target}")
 
 
-def find_first_by_css(browser: webdriver, target: str) -> webdriver:
+def find_first_by_css(browser: webdriver, target: str, condition: str = 'present',
+                      timeout: Optional[float] = None) -> webdriver:
     """
-    Locate web element by css selector
+    Locate web element by css selector, wait for condition
     Return first one
-    Catch No Such Element Exception error, report problem to stderr and quit with exit code 1
+    Raise ScraperError after timeout
     """
     try:
-        element = browser.find_element(By.CSS_SELECTOR, target)
-        return element
-    except NoSuchElementException:
-        print(f"Can't find CSS selector: {target}", file=sys.stderr)
-        browser.quit()
-        sys.exit(1)
+        return wait_for(browser, target, condition, timeout)
+    except TimeoutException:
+        raise ScraperError(f"Can't find CSS selector: {target}")
 
 
-def find_all_by_css(browser: webdriver, target: str) -> List[Any]:
+def find_all_by_css(browser: webdriver, target: str, ready: Optional[str] = None, count: int = 0,
+                    timeout: Optional[float] = None) -> List[Any]:
     """
     Locate all web elements by css selector
-    Return list of elements
-    Catch No Such Element Exception error, report problem to stderr and quit with exit code 1
+    Wait for ready element (container of target elements) and for at least count elements, then don't wait more
+    Return list of elements, empty list comes back as soon as ready element is there
+    Raise ScraperError after timeout
     """
     try:
-        elements = browser.find_elements(By.CSS_SELECTOR, target)
-        return elements
-    except NoSuchElementException:
-        print(f"Can't find CSS selector: {target}", file=sys.stderr)
-        browser.quit()
-        sys.exit(1)
+        if ready is not None:
+            wait_for(browser, ready, 'present', timeout)
+        if count:
+            return wait_for(browser, target, 'count', timeout, count=count)
+        return browser.find_elements(By.CSS_SELECTOR, target)
+    except TimeoutException:
+        raise ScraperError(f"Can't find CSS selector: {ready if ready is not None else target}")
+
+
+def is_present_by_css(browser: webdriver, target: str, timeout: float) -> bool:
+    """
+    Check if element with css selector shows up in timeout seconds, without reporting problem
+    """
+    try:
+        wait_for(browser, target, 'present', timeout)
+        return True
+    except TimeoutException:
+        return False
+
+
+def download_to(browser: webdriver, directory: str) -> str:
+    """
+    Point browser downloads to directory, by changing Firefox preference in chrome context
+    Return directory where browser will save files, browser start folder if preference can't be changed
+    """
+    os.makedirs(directory, exist_ok=True)
+    try:
+        with browser.context(browser.CONTEXT_CHROME):
+            browser.execute_script("Services.prefs.setStringPref('browser.download.dir', arguments[0]);",
+                                   os.path.join(os.getcwd(), directory))
+        return directory
+    except WebDriverException:
+        return getattr(browser, 'download_dir', 'var')
+
+
+def download_file(browser: webdriver, button: Any, directory: str, timeout: float) -> Path:
+    """
+    Click on download button and wait until browser saves file in directory
+    Return path of downloaded file
+    Raise ScraperError if file is not saved in timeout seconds
+    Tabs of shared browser download one at a time, download folder is setting of whole browser
+    Remote browser saves file on its node, it is fetched from there when it is complete
+    """
+    endpoint = getattr(browser, 'endpoint', None)
+    if endpoint:
+        files = RemoteFiles(endpoint, browser.session_id, timeout)
+        try:
+            known = files.names()
+            button.click()
+            return files.fetch(files.wait(known, timeout), directory)
+        except RemoteError as e:
+            raise ScraperError(str(e))
+    with getattr(browser, 'download_lock', None) or nullcontext():
+        with Download(download_to(browser, directory), timeout) as download:
+            button.click()
+            try:
+                return download.wait()
+            except DownloadTimeout as e:
+                raise ScraperError(str(e))
+
+
+PDF_URL_SCRIPT = """
+var link = document.querySelector(arguments[0]);
+if (link && link.href) return link.href;
+var viewer = document.querySelector('embed[src], iframe[src], object[data]');
+if (viewer && /pdf/i.test(viewer.src || viewer.data || viewer.type || '')) return viewer.src || viewer.data;
+var entries = performance.getEntriesByType('resource').filter(function (entry) { return /pdf/i.test(entry.name); });
+return entries.length ? entries[entries.length - 1].name : null;
+"""
+
+
+def pdf_url(browser: webdriver, target: str) -> Optional[str]:
+    """
+    Return address of PDF file: href of target link, source of PDF viewer, or last PDF request of page
+    None if page has no such address
+    """
+    try:
+        return browser.execute_script(PDF_URL_SCRIPT, target)
+    except WebDriverException:
+        return None
+
+
+def download_direct(browser: webdriver, session: requests.Session, url: Optional[str],
+                    target: Callable[[str], Path], timeout: float) -> Optional[Path]:
+    """
+    Download PDF from url with requests session, logged in with browser cookies, without browser download
+    File is streamed to path given by target(file name)
+    Return path of saved file, or None if url can't be downloaded, caller should click download button instead
+    """
+    if not url or not url.startswith(('http://', 'https://')):
+        return None
+    session.cookies.clear()
+    for cookie in browser.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                            path=cookie.get('path', '/'))
+    session.headers['Referer'] = browser.current_url
+    try:
+        return fetch_pdf(session, url, target, timeout)
+    except (PdfError, requests.RequestException) as e:
+        print(f'{e}, saving PDF with browser download', file=sys.stderr)
+        return None
+    finally:
+        session.headers.pop('Referer', None)
+
+
+def get_session_state(browser: webdriver) -> Dict[str, Any]:
+    """
+    Return cookies, local storage and address of current page
+    """
+    return {
+        'url': browser.current_url,
+        'cookies': browser.get_cookies(),
+        'local_storage': browser.execute_script(
+            'var items = {};'
+            'for (var i = 0; i < localStorage.length; i++)'
+            '    items[localStorage.key(i)] = localStorage.getItem(localStorage.key(i));'
+            'return items;'),
+    }
+
+
+def set_session_state(browser: webdriver, state: Dict[str, Any]) -> None:
+    """
+    Restore cookies and local storage, while browser is on page of the same site
+    """
+    browser.delete_all_cookies()
+    for cookie in state['cookies']:
+        browser.add_cookie({name: value for name, value in cookie.items() if name != 'sameSite'})
+    browser.execute_script('localStorage.clear();'
+                           'for (var key in arguments[0]) localStorage.setItem(key, arguments[0][key]);',
+                           state['local_storage'])
+
+
+def clear_session_state(browser: webdriver) -> None:
+    browser.delete_all_cookies()
+    browser.execute_script('localStorage.clear();')
 
 
 def remove_element_by_css(browser: webdriver, target: str) -> None:
@@ -0,0 +1,277 @@
+"""
+Daemon module, keep browser warm and check accounts on internal schedule
+
+Every provider is checked on its own interval, with random jitter, in one long running process.
+Browser stays open between checks and is recycled after number of checks or when it uses too much memory.
+config.yaml is read again when it changes, or on SIGHUP.
+Local status endpoint (127.0.0.1:status_port):
+    GET /health     200 if last check of every provider succeeded, otherwise 503
+    GET /status     state of every provider, browser memory and number of checks
+    POST /check     check every provider now
+"""
+
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Type
+from eracuni.data import Config
+from eracuni.browser import LazyBrowser, process_tree_rss
+from eracuni.edb import Domacinstva, MernaGrupa
+from eracuni.infostan import Infostan
+from eracuni.messages import Notifications
+from eracuni.provider import new_run
+from eracuni.tracing import tracer
+
+
+PROVIDERS: Dict[str, Type[Any]] = {
+    'edb_domacinstva': Domacinstva,
+    'edb_merna_grupa': MernaGrupa,
+    'infostan': Infostan,
+}
+
+
+class ProviderState:
+    """
+    Schedule and result of last check of one provider
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.next_due = 0.0
+        self.last_check: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_ok: Optional[bool] = None
+        self.checks = 0
+        self.failures = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        def timestamp(value: Optional[float]) -> Optional[str]:
+            return datetime.fromtimestamp(value).isoformat(timespec='seconds') if value else None
+        return {'next_due': timestamp(self.next_due), 'last_check': timestamp(self.last_check),
+                'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+                'last_ok': self.last_ok, 'checks': self.checks, 'failures': self.failures}
+
+
+class Daemon:
+    """
+    Check providers with warm browser, when they are due, until SIGTERM or SIGINT
+    Every check is one run: notifications are sent and run report is written after it
+    """
+    def __init__(self, config: Config, config_path: str = 'config.yaml',
+                 providers: Optional[Dict[str, Type[Any]]] = None) -> None:
+        self.config = config
+        self.config_path = config_path
+        self.config_mtime = self.mtime()
+        self.providers = PROVIDERS if providers is None else providers
+        self.states = {name: ProviderState(name) for name in self.providers}
+        self.browser = LazyBrowser(config)
+        self.browser_checks = 0
+        self.recycles = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.reload_requested = False
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
+
+    def interval(self, provider: str) -> float:
+        return float(self.config.daemon_intervals.get(provider, self.config.daemon_interval))
+
+    def plan(self, state: ProviderState, now: float) -> None:
+        """
+        Set next check of provider, one interval from now plus random jitter, so checks don't run in lockstep
+        """
+        state.next_due = now + self.interval(state.name) + random.uniform(0, self.config.daemon_jitter)
+
+    def check(self, name: str) -> bool:
+        """
+        Check all accounts of provider, send notifications and write run report
+        Return False if any account failed, scraper has already reset browser, next check starts a new one
+        Unexpected error fails the check, not the daemon
+        """
+        state = self.states[name]
+        notifications = Notifications(self.config)
+        tracer.reset()
+        new_run()
+        start = time.monotonic()
+        try:
+            failed = self.providers[name](self.browser, self.config, notifications).failed
+        except Exception as e:
+            print(f'{name} check failed: {type(e).__name__}: {e}', file=sys.stderr)
+            self.browser.quit()
+            failed = []
+            ok = False
+        else:
+            ok = not failed
+        if failed:
+            print(f"{name} check failed: {', '.join(failed)}", file=sys.stderr)
+        with tracer.span('notification_send'):
+            notifications.send()
+        if self.config.run_report:
+            tracer.write_json(self.config.run_report)
+        if self.config.metrics_textfile:
+            tracer.write_prometheus(self.config.metrics_textfile)
+
+        with self.lock:
+            state.last_check = time.time()
+            state.last_duration = time.monotonic() - start
+            state.last_ok = ok
+            state.checks += 1
+            state.failures += 0 if ok else 1
+            self.plan(state, time.time())
+        self.browser_checks = self.browser_checks + 1 if self.browser.started else 0
+        return ok
+
+    def recycle_browser(self) -> None:
+        """
+        Quit browser after daemon_recycle_checks checks, or when it uses more than daemon_max_rss MB
+        Next check starts a fresh one
+        """
+        if not self.browser.started:
+            return
+        rss = process_tree_rss(self.browser.pid)
+        if self.browser_checks >= self.config.daemon_recycle_checks or rss > self.config.daemon_max_rss:
+            print(f'Browser recycled after {self.browser_checks} checks, {rss} MB', file=sys.stderr)
+            self.browser.quit()
+            self.browser_checks = 0
+            self.recycles += 1
+
+    def reload_config(self) -> None:
+        """
+        Read config.yaml again if it changed, keep old config if new one can't be read
+        Browser is restarted, its options may have changed, and status server when its port changed
+        """
+        mtime = self.mtime()
+        if mtime == self.config_mtime and not self.reload_requested:
+            return
+        self.config_mtime = mtime
+        self.reload_requested = False
+        try:
+            config = Config()
+        except Exception as e:
+            print(f"Can't reload config.yaml, keeping old configuration: {e}", file=sys.stderr)
+            return
+        self.browser.quit()
+        self.browser_checks = 0
+        port_changed = config.status_port != self.config.status_port
+        if port_changed:
+            self.stop_server()
+        with self.lock:
+            self.config = config
+            self.browser = LazyBrowser(config)
+            now = time.time()
+            for state in self.states.values():
+                # New interval may be shorter than time left
+                state.next_due = min(state.next_due, now + self.interval(state.name))
+        if port_changed:
+            try:
+                self.start_server()
+            except OSError as e:
+                print(f"Can't start status server on port {config.status_port}: {e}", file=sys.stderr)
+        print('Configuration reloaded', file=sys.stderr)
+
+    def check_now(self) -> None:
+        with self.lock:
+            for state in self.states.values():
+                state.next_due = 0.0
+        self.wakeup.set()
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            providers = {name: state.as_dict() for name, state in self.states.items()}
+        return {
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'healthy': all(state['last_ok'] is not False for state in providers.values()),
+            'providers': providers,
+            'browser': {'started': self.browser.started, 'rss_mb': process_tree_rss(self.browser.pid),
+                        'checks': self.browser_checks, 'recycles': self.recycles},
+        }
+
+    def start_server(self) -> None:
+        if not self.config.status_port:
+            return
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.config.status_port), status_handler(self))
+        threading.Thread(target=self.server.serve_forever, name='status', daemon=True).start()
+
+    def stop_server(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stop(self, *args: Any) -> None:
+        self.stopping = True
+        self.wakeup.set()
+
+    def request_reload(self, *args: Any) -> None:
+        self.reload_requested = True
+        self.wakeup.set()
+
+    def run(self) -> None:
+        """
+        Check due providers, one at a time, then sleep until next one is due
+        Config file is looked at every few seconds while sleeping
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+        self.start_server()
+        try:
+            while not self.stopping:
+                self.reload_config()
+                with self.lock:
+                    due = sorted((state.next_due, name) for name, state in self.states.items())
+                next_due, name = due[0]
+                if next_due <= time.time():
+                    self.check(name)
+                    self.recycle_browser()
+                    continue
+                self.wakeup.wait(min(next_due - time.time(), 5))
+                self.wakeup.clear()
+        finally:
+            self.stop_server()
+            self.browser.quit()
+
+
+def status_handler(daemon: Daemon) -> Type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def send_json(self, status: int, value: Dict[str, Any]) -> None:
+            body = json.dumps(value, ensure_ascii=False, indent=2).encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            status = daemon.status()
+            if self.path == '/health':
+                self.send_json(200 if status['healthy'] else 503, {'healthy': status['healthy']})
+            elif self.path == '/status':
+                self.send_json(200, status)
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self) -> None:
+            if self.path == '/check':
+                daemon.check_now()
+                self.send_json(202, {'check': 'started'})
+            else:
+                self.send_json(404, {'error': 'not found'})
+    return Handler
@@ -3,14 +3,16 @@ Data module for configuration, data storage and file manipulation
 """
 
 
-import os
 import sys
 import yaml
 import platform
 import shutil
 from datetime import date
 from pathlib import Path
-from typing import List, Dict, Any
+from urllib.parse import urlsplit
+from typing import List, Dict, Any, Optional, Tuple
+from eracuni.archive import link_duplicate
+from eracuni.state import file_sha256, state_store
 
 
 class Account:
@@ -70,7 +72,54 @@ class Config:
     InfoStan_address:           InfoStan Login page address
     headless:                   To start without GUI or not, True or False
     user_agent:                 Browser identifier string
-    timeout:                    Selenium timeout
+    timeout:                    Selenium timeout, for every step without its own timeout
+    step_timeouts:              Timeouts of scraper steps, in seconds: login, menu, invoices, locations, bills, pdf,
+                                download, logout
+    workers:                    Number of parallel browser sessions, 1 checks accounts one by one
+    engine:                     EDB engine, selenium (default) or http, http falls back to selenium on error
+    session_cache:              Keep logged in sessions between runs instead of logout, True or False
+    session_key:                Fernet key for encrypting saved sessions, empty to use var/session.key
+    session_check_timeout:      Seconds to wait for restored session to show logged in page
+    direct_download:            Download PDF with browser cookies over HTTP, without browser download, True or False
+    backfill_workers:           Number of parallel downloads of older bills, with --backfill
+    tabs:                       Check workers accounts at once in tabs of one Firefox, instead of one Firefox
+                                per worker, True or False
+    remote_webdrivers:          List of remote WebDriver addresses, Selenium Grid or geckodriver servers, browsers
+                                are started there instead of local geckodriver, empty for local browser
+    remote_check_timeout:       Seconds to wait for /status of remote WebDriver, endpoint that is late is skipped
+    queue:                      Take account jobs from queue shared with other hosts, True or False
+    queue_backend:              Queue backend, sqlite (queue_path on shared folder) or http (queue_url)
+    queue_path:                 SQLite database of queue, on folder shared by all hosts
+    queue_url:                  Address of queue server, python3 -m eracuni.jobs serve
+    queue_lease:                Seconds job is kept by host, renewed while account is checked
+    queue_round:                Seconds of one round, every account is checked once per round, by one of hosts
+    retries:                    Number of retries of failed account, with fresh browser
+    retry_backoff:              Seconds before first retry, doubled for every next one
+    retry_budget:               Number of retries for all accounts of one provider, in one run
+    circuit_failures:           Number of failed accounts of provider in a row, after which provider is skipped
+    circuit_cooldown:           Seconds provider is skipped after circuit_failures failed accounts
+    archive_index:              Read amount, due date, period and reference of new PDF bills after run, True or False
+                                Needs pypdf (archive extra) or pdftotext, False by default
+    lean_mode:                  Browser without images, fonts, media, prefetch, telemetry and disk cache, True or False
+    lean_allowlist:             List of extra hosts browser may load from in lean mode, portal hosts are always allowed
+    low_memory:                 Browser with one content process and small caches, memory is sampled after every
+                                account and browser is restarted when it grows, True or False
+    low_memory_max_rss:         Restart browser in low memory mode when it uses more memory, in MB
+    low_memory_accounts:        Restart browser in low memory mode after this many accounts
+    page_metrics:               Report bytes transferred and page load time per step, True or False, on in lean mode
+    profile_template:           Folder of Firefox profile template (python3 -m eracuni.profile), every browser starts
+                                from its clone if template is built, empty to always start with new profile
+    run_report:                 JSON file with timed steps of last run, empty to skip
+    metrics_textfile:           Prometheus textfile collector file with step durations of last run, empty to skip
+    billing_calendar:           Skip accounts whose next bill is not expected yet, learned from bill history, True or False
+    billing_window:             Days before expected bill, from which account is checked on every run
+    billing_force_days:         Check every account at least once in this many days, even with no bill expected
+    daemon_interval:            Seconds between checks of every provider in daemon mode (--daemon)
+    daemon_intervals:           Intervals of single providers, in seconds: edb_domacinstva, edb_merna_grupa, infostan
+    daemon_jitter:              Up to this many seconds are added at random to every interval
+    daemon_recycle_checks:      Restart browser after this many checks in daemon mode
+    daemon_max_rss:             Restart browser when it uses more memory, in MB
+    status_port:                Local port of daemon health and status endpoint, 0 to disable
 
     email_enabled:      To send emails or not, True of False
     email_address:      Sender email address
@@ -83,6 +132,10 @@ class Config:
     telegram_bot_token: Telegram bot API token, in format: 1234567890:xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
     telegram_chat_id:   Telegram group Chat ID, in format: -11111111111
 
+    notify_immediately: Send every new bill as soon as it is found, instead of all of them at the end, True or False
+    notify_retries:     Number of retries of failed message, before it is kept in outbox for next run
+    notify_backoff:     Seconds to wait before first retry, doubled after every retry
+
     Accounts with empty user_id are ignored
     If alias is empty, user_id will be used as alias
     There is no limit for how many accounts config file can have
@@ -106,6 +159,48 @@ class Config:
         self.headless: bool = self.yaml_cfg['headless']
         self.user_agent: str = self.yaml_cfg['user_agent']
         self.timeout: float = self.yaml_cfg['timeout']
+        self.step_timeouts: Dict[str, float] = self.yaml_cfg.get('step_timeouts') or {}
+        self.workers: int = int(self.yaml_cfg.get('workers', 1))
+        self.engine: str = self.yaml_cfg.get('engine', 'selenium')
+        self.session_cache: bool = self.yaml_cfg.get('session_cache', False)
+        self.session_key: str = self.yaml_cfg.get('session_key') or ''
+        self.session_check_timeout: float = self.yaml_cfg.get('session_check_timeout', 5)
+        self.direct_download: bool = self.yaml_cfg.get('direct_download', True)
+        self.backfill_workers: int = self.yaml_cfg.get('backfill_workers', 4)
+        self.tabs: bool = self.yaml_cfg.get('tabs', False)
+        self.remote_webdrivers: List[str] = self.yaml_cfg.get('remote_webdrivers') or []
+        self.remote_check_timeout: float = float(self.yaml_cfg.get('remote_check_timeout', 3))
+        self.queue: bool = self.yaml_cfg.get('queue', False)
+        self.queue_backend: str = self.yaml_cfg.get('queue_backend', 'sqlite')
+        self.queue_path: str = self.yaml_cfg.get('queue_path', 'var/queue.sqlite3')
+        self.queue_url: str = self.yaml_cfg.get('queue_url', 'http://127.0.0.1:8632')
+        self.queue_lease: float = float(self.yaml_cfg.get('queue_lease', 300))
+        self.queue_round: float = float(self.yaml_cfg.get('queue_round', 3600))
+        self.retries: int = self.yaml_cfg.get('retries', 2)
+        self.retry_backoff: float = self.yaml_cfg.get('retry_backoff', 5)
+        self.retry_budget: int = self.yaml_cfg.get('retry_budget', 4)
+        self.circuit_failures: int = self.yaml_cfg.get('circuit_failures', 3)
+        self.circuit_cooldown: float = self.yaml_cfg.get('circuit_cooldown', 900)
+        self.archive_index: bool = self.yaml_cfg.get('archive_index', False)
+        self.lean_mode: bool = self.yaml_cfg.get('lean_mode', False)
+        self.lean_allowlist: List[str] = self.yaml_cfg.get('lean_allowlist') or []
+        self.low_memory: bool = self.yaml_cfg.get('low_memory', False)
+        self.low_memory_max_rss: int = int(self.yaml_cfg.get('low_memory_max_rss', 400))
+        self.low_memory_accounts: int = int(self.yaml_cfg.get('low_memory_accounts', 10))
+        page_metrics = self.yaml_cfg.get('page_metrics')
+        self.page_metrics: bool = self.lean_mode if page_metrics is None else page_metrics
+        self.profile_template: str = self.yaml_cfg.get('profile_template', 'var/firefox_profile') or ''
+        self.run_report: str = self.yaml_cfg.get('run_report', 'var/run_report.json') or ''
+        self.metrics_textfile: str = self.yaml_cfg.get('metrics_textfile', 'var/eracuni.prom') or ''
+        self.billing_calendar: bool = self.yaml_cfg.get('billing_calendar', False)
+        self.billing_window: float = float(self.yaml_cfg.get('billing_window', 5))
+        self.billing_force_days: float = float(self.yaml_cfg.get('billing_force_days', 7))
+        self.daemon_interval: float = float(self.yaml_cfg.get('daemon_interval', 21600))
+        self.daemon_intervals: Dict[str, float] = self.yaml_cfg.get('daemon_intervals') or {}
+        self.daemon_jitter: float = float(self.yaml_cfg.get('daemon_jitter', 600))
+        self.daemon_recycle_checks: int = int(self.yaml_cfg.get('daemon_recycle_checks', 20))
+        self.daemon_max_rss: int = int(self.yaml_cfg.get('daemon_max_rss', 1024))
+        self.status_port: int = int(self.yaml_cfg.get('status_port') or 0)
 
         self.email_enabled: bool = self.yaml_cfg['email_enabled']
         self.email_address: str = self.yaml_cfg['email_address']
@@ -118,6 +213,10 @@ class Config:
         self.telegram_bot_token: str = self.yaml_cfg['telegram_bot_token']
         self.telegram_chat_id: str = str(self.yaml_cfg['telegram_chat_id'])
 
+        self.notify_immediately: bool = self.yaml_cfg.get('notify_immediately', False)
+        self.notify_retries: int = int(self.yaml_cfg.get('notify_retries', 3))
+        self.notify_backoff: float = float(self.yaml_cfg.get('notify_backoff', 2))
+
     def setup_edb_domacinstva_accounts(self) -> None:
         # Get all EDB accounts
         for user in self.yaml_cfg['EDB_Domacinstva_Accounts']:
@@ -151,6 +250,20 @@ class Config:
                     alias = user_id
                 self.infostan_accounts.append(Account(user_id, password, alias))
 
+    def step_timeout(self, step: str) -> float:
+        """
+        Return wait budget of scraper step, timeout if step has no budget of its own
+        """
+        return float(self.step_timeouts.get(step, self.timeout))
+
+    def lean_hosts(self) -> List[str]:
+        """
+        Return hosts of portal addresses and lean_allowlist, browser may load only from them in lean mode
+        """
+        hosts = {urlsplit(url).hostname for url in (self.edb_domacinstva_url, self.edb_merna_grupa_url,
+                                                     self.infostan_url)}
+        return sorted({host for host in hosts if host} | set(self.lean_allowlist))
+
     @staticmethod
     def gecko_path() -> str:
         """
@@ -180,25 +293,29 @@ class Config:
         return exe_path
 
 
+def is_location_infix(infix: str, key: str) -> bool:
+    """
+    Return True if infix is storage of location of account key, key_{location id}, location id has no underscore
+    """
+    return infix.startswith(f'{key}_') and '_' not in infix[len(key) + 1:] and len(infix) > len(key) + 1
+
+
 class Storage:
     """
     Remember what was the last saved PDF bill, by last_saved id string
-    Read and write var/storage_{file_name_infix}.yaml files, every user_id have separate one
-    Use last_saved property as setter/getter
+    Every file_name_infix (account or location) has its own rows in var/state.sqlite3 database
+    Use last_saved property as getter, save() to record new bill
+    Browser downloads for this account go to var/downloads/{file_name_infix} folder
     """
     def __init__(self, file_name_infix: str) -> None:
         """
-        Read last_saved from var/storage_{file_name_infix}.yaml
-        If file does not exist, last_saved is "none"
+        Read last_saved from state store
+        If there is no saved bill, last_saved is "none"
         """
         self.file_name_infix = file_name_infix
-        self.yaml_path = f'var/storage_{self.file_name_infix}.yaml'
-        if os.path.isfile(self.yaml_path):
-            with open(self.yaml_path, encoding='utf8') as fin:
-                my_storage = yaml.full_load(fin)
-            self.__last_saved = my_storage['last_saved'].strip()
-        else:
-            self.__last_saved = 'none'
+        self.download_dir = f'var/downloads/{self.file_name_infix}'
+        self.store = state_store()
+        self.__last_saved = self.store.last_saved(self.file_name_infix) or 'none'
 
     @property
     def last_saved(self) -> str:
@@ -207,21 +324,55 @@ class Storage:
     @last_saved.setter
     def last_saved(self, period: str) -> None:
         """
-        Write var/{file_name_infix}.yaml
+        Record period without PDF file
+        """
+        self.save(period)
+
+    def save(self, period: str, pdf_file: Optional[Path] = None) -> bool:
+        """
+        Record new period, with archived PDF file, in one transaction
+        Return False if PDF file is a copy of already archived bill, no notification is needed for it
         """
-        # TODO Fix UTF-8 characters in filenames
         self.__last_saved = period.strip()
-        my_storage = {'last_saved': self.__last_saved}
-        with open(self.yaml_path, 'w') as fout:
-            # Dump my_storage with unicode characters to
-            yaml.dump(my_storage, fout, encoding='utf8')
+        new_bill = True
+        sha256 = None
+        if pdf_file is not None:
+            pdf_file, sha256, new_bill = self.deduplicate(pdf_file)
+        self.store.record(self.file_name_infix, self.__last_saved, pdf_file, sha256=sha256)
+        return new_bill
 
-    def move_pdf(self) -> None:
+    def deduplicate(self, pdf_file: Path) -> Tuple[Path, str, bool]:
+        """
+        Hash archived PDF file, replace it with hard link if the same content is already archived
+        Return path of file, its hash, and True if content is new
+        """
+        sha256 = file_sha256(pdf_file)
+        original = self.store.archived_path(sha256, exclude=pdf_file)
+        if original is None:
+            return pdf_file, sha256, True
+        print(f'{pdf_file} is the same as {original}, linked', file=sys.stderr)
+        return link_duplicate(pdf_file, original), sha256, False
+
+    def move_pdf(self, download_dir: str = 'var') -> None:
+        """
+        Move every PDF file from download_dir to pdf subfolder
+        """
+        for pdf_file in Path(download_dir).glob('**/*.pdf'):
+            self.archive_pdf(pdf_file)
+
+    def pdf_path(self, file_name: str) -> Path:
+        """
+        Return archive path of PDF file, pdf/{file_name_infix}_{YYYY-MM}_{original name}.pdf
+        """
+        today = date.today().strftime('%Y-%m')
+        return Path(f'pdf/{self.file_name_infix}_{today}_{Path(file_name).stem}.pdf')
+
+    def archive_pdf(self, pdf_file: Path) -> Path:
         """
         Rename saved PDF file as {file_name_infix}_{YYYY-MM}_{original name}.pdf
         and move it to pdf subfolder
+        Return new path
         """
-        today = date.today().strftime('%Y-%m')
-        for pdf_file in Path('var').glob('**/*.pdf'):
-            new_path = f'pdf/{self.file_name_infix}_{today}_{pdf_file.stem}.pdf'
-            shutil.move(str(pdf_file), new_path)
+        new_path = self.pdf_path(pdf_file.name)
+        shutil.move(str(pdf_file), str(new_path))
+        return new_path
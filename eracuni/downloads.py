@@ -0,0 +1,284 @@
+"""
+Downloads module, wait for browser to finish saving a file, or fetch file directly over HTTP
+
+Firefox first writes {name}.part and renames it to {name} when download is finished.
+Download folder is watched with inotify on Linux, other systems poll it.
+Direct download streams PDF with pooled requests session, the same way: {name}.part is renamed when it is complete.
+Complete PDF ends with %%EOF trailer. Saved file is never overwritten, file with the same name gets number suffix.
+"""
+
+
+import os
+import re
+import sys
+import time
+import ctypes
+import select
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+import requests
+from requests.adapters import HTTPAdapter
+from eracuni.data import Config
+
+
+class DownloadTimeout(Exception):
+    """
+    Browser did not finish download in time
+    """
+
+
+class PdfError(Exception):
+    """
+    Response is not complete PDF file
+    """
+
+
+class Inotify:
+    """
+    Minimal inotify watch of one folder, through libc
+    """
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+
+    def __init__(self, directory: str) -> None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def wait(self, timeout: float) -> None:
+        """
+        Return on first change in folder, or after timeout seconds
+        """
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Polling:
+    """
+    Fallback watch, check folder every interval seconds
+    """
+    def __init__(self, interval: float = 0.1) -> None:
+        self.interval = interval
+
+    def wait(self, timeout: float) -> None:
+        time.sleep(max(min(timeout, self.interval), 0))
+
+    def close(self) -> None:
+        pass
+
+
+def watch(directory: str) -> Union[Inotify, Polling]:
+    """
+    Return inotify watch if system supports it, polling otherwise
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return Inotify(directory)
+        except (OSError, AttributeError):
+            pass
+    return Polling()
+
+
+class Download:
+    """
+    Expect one new PDF file in download folder
+
+    Use as context manager around click on download button:
+
+        with Download('var/downloads/edb_dom_home', config.timeout) as download:
+            save_button.click()
+            pdf_file = download.wait()
+
+    Files already present when context is entered are ignored, so leftovers are never picked up.
+    File is finished when there is no {name}.part next to it and its size did not change for stable_time seconds.
+    """
+    def __init__(self, directory: str, timeout: float, stable_time: float = 0.3) -> None:
+        self.directory = directory
+        self.timeout = timeout
+        self.stable_time = stable_time
+        self.before: Dict[str, float] = {}
+        self.watcher: Union[Inotify, Polling, None] = None
+
+    def __enter__(self) -> 'Download':
+        os.makedirs(self.directory, exist_ok=True)
+        self.before = self.snapshot()
+        self.watcher = watch(self.directory)
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def snapshot(self) -> Dict[str, float]:
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            try:
+                snapshot[entry.name] = entry.stat().st_mtime
+            except FileNotFoundError:
+                pass
+        return snapshot
+
+    def finished(self) -> Optional[Path]:
+        """
+        Return newest new PDF file without .part companion, or None
+        """
+        current = self.snapshot()
+        candidates = [name for name, mtime in current.items()
+                      if name.lower().endswith('.pdf') and self.before.get(name) != mtime
+                      and name + '.part' not in current]
+        for name in sorted(candidates, key=lambda name: current[name], reverse=True):
+            path = Path(self.directory) / name
+            try:
+                if path.stat().st_size > 0:
+                    return path
+            except FileNotFoundError:
+                pass
+        return None
+
+    def wait(self) -> Path:
+        """
+        Block until download is finished, return path of downloaded file
+        Raise DownloadTimeout after timeout seconds
+        """
+        assert self.watcher is not None, 'Download.wait() must be called inside with block'
+        deadline = time.monotonic() + self.timeout
+        candidate: Optional[Path] = None
+        size = -1
+        since = 0.0
+        while True:
+            now = time.monotonic()
+            finished = self.finished()
+            if finished is not None:
+                try:
+                    finished_size = finished.stat().st_size
+                except FileNotFoundError:
+                    finished_size = -1
+                if finished == candidate and finished_size == size:
+                    if now - since >= self.stable_time:
+                        return finished
+                else:
+                    candidate, size, since = finished, finished_size, now
+            else:
+                candidate = None
+            if now >= deadline:
+                raise DownloadTimeout(f'No finished PDF file in {self.directory} after {self.timeout}s')
+            if candidate is not None:
+                self.watcher.wait(min(deadline - now, since + self.stable_time - now))
+            else:
+                self.watcher.wait(deadline - now)
+
+
+_local = threading.local()
+
+
+def http_session(config: Config) -> requests.Session:
+    """
+    Return requests session for current thread, with pooled keep-alive connections
+    Session is reused for every account checked in the same thread, cookies are cleared by caller
+    """
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(4, config.workers))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['User-Agent'] = config.user_agent
+        _local.session = session
+    return session
+
+
+def response_file_name(response: requests.Response) -> str:
+    """
+    Return file name from Content-Disposition header, or from URL, always with .pdf extension
+    """
+    match = re.search(r'filename="?([^";]+)"?', response.headers.get('Content-Disposition', ''))
+    if match:
+        file_name = os.path.basename(match.group(1))
+    else:
+        file_name = os.path.basename(response.url.split('?')[0]) or 'racun'
+    if not file_name.lower().endswith('.pdf'):
+        file_name += '.pdf'
+    return file_name
+
+
+def save_new(part_path: Path, path: Path) -> Path:
+    """
+    Rename part_path to path, or to {stem}_2.pdf, {stem}_3.pdf... when path exists, return new path
+    Hard link claims the name atomically, so parallel downloads of files with the same name keep both
+    """
+    candidate, number = path, 1
+    while True:
+        try:
+            os.link(part_path, candidate)
+            part_path.unlink()
+            return candidate
+        except FileExistsError:
+            pass
+        except OSError:
+            # File system without hard links
+            if not candidate.exists():
+                os.replace(part_path, candidate)
+                return candidate
+        number += 1
+        candidate = path.with_name(f'{path.stem}_{number}{path.suffix}')
+
+
+def has_trailer(path: Path) -> bool:
+    """
+    Return True if %%EOF marker is in last kilobyte of file, like PDF readers expect it
+    """
+    with open(path, 'rb') as fin:
+        fin.seek(max(path.stat().st_size - 1024, 0))
+        return b'%%EOF' in fin.read()
+
+
+def fetch_pdf(session: requests.Session, url: str, target: Callable[[str], Path], timeout: float,
+              chunk_size: int = 1 << 16) -> Path:
+    """
+    Stream PDF from url to path given by target(file name), in chunks
+    File is written as {path}.part and renamed when %PDF header, Content-Length and %%EOF trailer are verified
+    Existing file is kept, new one is saved with number suffix
+    Return path of saved file
+    Raise PdfError if response is not complete PDF, requests.RequestException on network error
+    """
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        path = target(response_file_name(response))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + '.part')
+        size = 0
+        try:
+            with open(part_path, 'wb') as fout:
+                for chunk in response.iter_content(chunk_size):
+                    if size == 0 and not chunk.startswith(b'%PDF'):
+                        raise PdfError(f'Not a PDF file: {url}')
+                    fout.write(chunk)
+                    size += len(chunk)
+            expected = response.headers.get('Content-Length')
+            if size == 0 or (expected is not None and 'Content-Encoding' not in response.headers
+                             and int(expected) != size):
+                raise PdfError(f'Incomplete PDF file, {size} of {expected} bytes: {url}')
+            if not has_trailer(part_path):
+                raise PdfError(f'Incomplete PDF file, no %%EOF after {size} bytes: {url}')
+            return save_new(part_path, path)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
@@ -0,0 +1,220 @@
+"""
+EPS (Beograd) Scraper without browser, as plain HTTP client
+
+Login form is posted directly, invoices table is parsed from HTML and PDF is downloaded with the same session
+"""
+
+
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+import requests
+from eracuni.backfill import Backfill
+from eracuni.data import Account, Config, Storage
+from eracuni.downloads import PdfError, fetch_pdf, http_session
+from eracuni.messages import Notifications
+from eracuni.tracing import tracer
+
+
+class EdbHttpError(Exception):
+    """
+    Page is not as expected, caller should fall back to browser
+    """
+
+
+class Form:
+    """
+    Helper class for PageParser
+
+    Form:
+        action: form action URL, as written in page
+        method: get or post
+        fields: names and values of input and button elements
+        buttons: names of submit buttons
+    """
+    def __init__(self, action: str, method: str) -> None:
+        self.action = action
+        self.method = method
+        self.fields: Dict[str, str] = {}
+        self.buttons: List[str] = []
+
+
+class Cell:
+    """
+    Helper class for PageParser, table cell text and first link in it
+    """
+    def __init__(self) -> None:
+        self.text = ''
+        self.href: Optional[str] = None
+
+
+class PageParser(HTMLParser):
+    """
+    Collect forms, links with title attribute and rows of invoices table (table.x2f) from EDB page
+    """
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.forms: List[Form] = []
+        self.links: Dict[str, str] = {}
+        self.rows: List[List[Cell]] = []
+        self._form: Optional[Form] = None
+        self._table_depth = 0
+        self._in_tbody = False
+        self._cell: Optional[Cell] = None
+
+    def handle_starttag(self, tag: str, attrs_list: List[Tuple[str, Optional[str]]]) -> None:
+        attrs = {name: value or '' for name, value in attrs_list}
+        if tag == 'form':
+            self._form = Form(attrs.get('action', ''), attrs.get('method', 'get').lower())
+            self.forms.append(self._form)
+        elif tag in ('input', 'button') and self._form is not None and attrs.get('name'):
+            kind = attrs.get('type', 'submit' if tag == 'button' else 'text').lower()
+            if kind == 'submit':
+                self._form.buttons.append(attrs['name'])
+            if kind not in ('checkbox', 'radio') or 'checked' in attrs:
+                self._form.fields[attrs['name']] = attrs.get('value', '')
+        elif tag == 'a':
+            if attrs.get('title') and attrs.get('href'):
+                self.links[attrs['title']] = attrs['href']
+            if self._cell is not None and self._cell.href is None and attrs.get('href'):
+                self._cell.href = attrs['href']
+        elif tag == 'table':
+            if self._table_depth or 'x2f' in attrs.get('class', '').split():
+                self._table_depth += 1
+        elif self._table_depth == 1:
+            if tag == 'tbody':
+                self._in_tbody = True
+            elif tag == 'tr' and self._in_tbody:
+                self.rows.append([])
+            elif tag in ('td', 'th') and self._in_tbody and self.rows:
+                self._cell = Cell()
+                self.rows[-1].append(self._cell)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'form':
+            self._form = None
+        elif tag == 'table' and self._table_depth:
+            self._table_depth -= 1
+        elif self._table_depth == 1:
+            if tag == 'tbody':
+                self._in_tbody = False
+            elif tag in ('td', 'th'):
+                self._cell = None
+
+    def handle_data(self, data: str) -> None:
+        if self._cell is not None:
+            self._cell.text += data
+
+
+def parse_page(html: str) -> PageParser:
+    parser = PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+class EdbHttp:
+    """
+    Check EDB account with HTTP requests only
+    Same steps as browser scraper: login, Pregled računa, last invoice in table.x2f, save PDF, logout
+    Raise EdbHttpError if any page is not as expected
+    """
+    def __init__(self, config: Config, notifications: Notifications) -> None:
+        self.config = config
+        self.notifications = notifications
+        self.session = http_session(config)
+
+    def get(self, url: str) -> requests.Response:
+        try:
+            response = self.session.get(url, timeout=self.config.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise EdbHttpError(f'Error loading page {url}: {e}')
+        return response
+
+    def login(self, url: str, account: Account) -> requests.Response:
+        """
+        Post login form with j_username and j_password, as click on cbPrihvati button
+        """
+        login_page = self.get(url)
+        forms = [form for form in parse_page(login_page.text).forms if 'j_username' in form.fields]
+        if not forms:
+            raise EdbHttpError("Can't find login form")
+        form = forms[0]
+
+        fields = {name: value for name, value in form.fields.items() if name not in form.buttons}
+        fields['j_username'] = account.user_id
+        fields['j_password'] = account.password
+        fields['cbPrihvati'] = form.fields.get('cbPrihvati', '')
+        if 'event' in fields:
+            # ADF Faces forms submit button id as event
+            fields['event'] = 'cbPrihvati'
+
+        action = urljoin(login_page.url, form.action or login_page.url)
+        try:
+            if form.method == 'post':
+                response = self.session.post(action, data=fields, timeout=self.config.timeout)
+            else:
+                response = self.session.get(action, params=fields, timeout=self.config.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise EdbHttpError(f'Error posting login form: {e}')
+        return response
+
+    def check(self, account: Account, url: str, storage: Storage, label: str, provider: str,
+              backfill: Optional[Backfill] = None) -> None:
+        """
+        Check last invoice of one account and save PDF if it is new
+        With backfill, every older invoice missing from archive is downloaded too
+        Steps are traced as provider spans
+        """
+        tracer.start(provider, account.alias)
+        self.session.cookies.clear()
+        home = self.login(url, account)
+        home_links = parse_page(home.text).links
+        if 'Pregled računa' not in home_links:
+            raise EdbHttpError("Can't find Pregled računa link, login failed")
+        tracer.mark(provider, account.alias, 'login')
+
+        # Find Invoices table
+        invoices_page = self.get(urljoin(home.url, home_links['Pregled računa']))
+        page = parse_page(invoices_page.text)
+        # Skip first row [0] as header
+        # Last period is in second cell of second row [1]
+        if len(page.rows) < 2 or len(page.rows[1]) < 2:
+            raise EdbHttpError("Can't find table with invoices")
+        last_invoice = page.rows[1]
+        period = last_invoice[1].text.strip()
+        tracer.mark(provider, account.alias, 'table_read')
+
+        # Backfill: start download of every older invoice missing from archive
+        if backfill is not None:
+            cookies = [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path}
+                       for cookie in self.session.cookies]
+            backfill.queue_missing(storage, {row[1].text.strip(): urljoin(invoices_page.url, row[-1].href)
+                                             if row[-1].href else None
+                                             for row in page.rows[1:] if len(row) > 1
+                                             and row[1].text.strip() != period}, cookies)
+
+        # Anything new?
+        if period != storage.last_saved:
+            if not last_invoice[-1].href:
+                raise EdbHttpError("Can't find PDF link in last cell")
+            # Stream PDF straight to pdf folder
+            try:
+                archived_pdf = fetch_pdf(self.session, urljoin(invoices_page.url, last_invoice[-1].href),
+                                         storage.pdf_path, self.config.timeout)
+            except (PdfError, requests.RequestException) as e:
+                raise EdbHttpError(f'Error downloading PDF: {e}')
+            tracer.mark(provider, account.alias, 'download')
+            # Remember new last_saved, with archived PDF, in var/state.sqlite3
+            if storage.save(period, archived_pdf):
+                # Add notification, copy of archived bill is not a new bill
+                self.notifications.add(f'{label} ({account.alias}) za {period.lower()}')
+
+        # Logout, after older invoices are downloaded with this session
+        if backfill is not None:
+            backfill.finish()
+        if 'Odjavljivanje sa sistema' in page.links:
+            self.get(urljoin(invoices_page.url, page.links['Odjavljivanje sa sistema']))
+        tracer.mark(provider, account.alias, 'logout')
@@ -3,103 +3,55 @@ InfoStan Scraper
 """
 
 
-import sys
-import time
-from eracuni.data import Storage, Config
-from eracuni.browser import find_first_by_id, find_first_by_css, find_all_by_css, remove_element_by_css, webdriver
-from eracuni.messages import Notifications
-from selenium.webdriver.common.by import By  # type: ignore
-from selenium.webdriver.support.ui import WebDriverWait  # type: ignore
-from selenium.webdriver.support import expected_conditions  # type: ignore
-
-
-class Infostan:
-    def __init__(self, driver: webdriver, config: Config, notifications: Notifications) -> None:
-        self.driver = driver
-        self.config = config
-        self.notifications = notifications
-
-        for account in self.config.infostan_accounts:
-
-            # Load main page
-            try:
-                self.driver.get(self.config.infostan_url)
-            except Exception:
-                print('Error loading page', file=sys.stderr)
-                self.driver.quit()
-                sys.exit(1)
-
-            # Login
-            login_name = find_first_by_css(self.driver, "input[formcontrolname='username']")
-            login_name.send_keys(account.user_id)
-            login_password = find_first_by_css(self.driver, "input[formcontrolname='password']")
-            login_password.send_keys(account.password)
-            login_button = find_first_by_css(self.driver, '.btn-blue')
-            # Hack, to remove deepLinkingModal div, it hides login button in headless mode
-            remove_element_by_css(driver, '.deepLinkingModal')
-            login_button.click()
-
-            # Choose Infostan icon
-            icon_infostan = find_first_by_id(self.driver, '1_ЈКП Инфостан Технологије')
-            icon_infostan.click()
-
-            # Find number of locations and iterate through them, as i -> (1..n)
-            number_of_locations = len(find_all_by_css(self.driver, 'div.row-item'))
-            for i in range(1, number_of_locations + 1):
-                # Every location will have unique filename for storage
-                storage = Storage(f'infostan_{account.alias}_{i}')
-
-                # Choose location, i-th row in location table
-                row_i = find_first_by_css(
-                    self.driver, f'.container-page > div:nth-child(4) > div:nth-child({i}) > div:nth-child(1)')
-                row_i.click()
-
-                # Find top row, with last bill
-                last_row = find_first_by_css(self.driver, 'div.table-row')
-                last_bill_date = find_first_by_css(last_row, '.rowItemName > a').get_attribute('text').strip()
-
-                # Anything new?
-                if last_bill_date == storage.last_saved:
-                    # Nothing new, click on Back button
-                    back_button = find_first_by_css(driver, 'div.icon-back')
-                    back_button.click()
-                else:
-                    # New bill!
-                    # Add notification
-                    self.notifications.add(f'InfoStan ({account.alias} {i}) za {last_bill_date.lower()}')
-                    # Click on top row, for right side menu
-                    last_row.click()
-                    # Click on "Pregled računa" button
-                    pregled_racuna_button = find_first_by_id(driver, 'step5')
-                    pregled_racuna_button.click()
-
-                    # Wait until page load
-                    WebDriverWait(driver, self.config.timeout).until(
-                        expected_conditions.presence_of_element_located(
-                            (By.CSS_SELECTOR, 'div.page[data-loaded="true"')))
-
-                    # Click Download icon
-                    save_button = find_first_by_id(driver, 'download')
-                    save_button.click()
-                    time.sleep(1)
-
-                    # Click (X) - Close button
-                    close_button = find_first_by_css(driver, 'div.pdfCloseBtn>span.close-btn')
-                    close_button.click()
-
-                    # Click Back button
-                    back_button = find_first_by_css(driver, 'div.icon-back')
-                    back_button.click()
-
-                    # Move saved PDF file from var to pdf folder
-                    storage.move_pdf()
-
-                    # Remember new last_saved in var/storage.yaml
-                    storage.last_saved = last_bill_date
-                    time.sleep(1)
-
-            # Logout and confirm
-            logout_button = find_first_by_css(driver, 'div.mainBtnsHolder>div:nth-child(7)')
-            logout_button.click()
-            confirm_button = find_first_by_css(driver, 'div.modal-delete-action > button:nth-child(1)')
-            confirm_button.click()
+from eracuni.provider import Recipe, Scraper
+
+
+# Infostan icon is shown only to logged in user
+INFOSTAN_ICON_CSS = '[id="1_ЈКП Инфостан Технологије"]'
+
+RECIPE = Recipe({
+    'name': 'infostan',
+    'label': 'InfoStan',
+    'prefix': 'infostan',
+    'url': 'infostan_url',
+    'accounts': 'infostan_accounts',
+    'login': [
+        {'type': "input[formcontrolname='username']", 'value': 'user_id', 'timeout': 'login'},
+        {'type': "input[formcontrolname='password']", 'value': 'password', 'timeout': 'login'},
+        {'wait': '.btn-blue', 'timeout': 'login'},
+        # Hack, to remove deepLinkingModal div, it hides login button in headless mode
+        {'remove': '.deepLinkingModal'},
+        {'click': '.btn-blue', 'timeout': 'login'},
+    ],
+    'logged_in': INFOSTAN_ICON_CSS,
+    # Choose Infostan icon
+    'menu': [{'click': INFOSTAN_ICON_CSS, 'timeout': 'menu'}],
+    # Every location row, its name is click target, with address of its bills in onclick
+    # List does not show date of last bill, so every location is opened, directly by its address
+    'locations': {'rows': 'div.row-item', 'ready': '.container-page', 'button': ':scope > div:first-child',
+                  'route': ':scope > div:first-child'},
+    # Every bill row, newest first, wait for date of top row
+    'bills': {'ready': 'div.table-row .rowItemName > a', 'condition': 'text', 'timeout': 'bills',
+              'rows': 'div.table-row', 'period': '.rowItemName > a'},
+    # Click on row, for right side menu, then on "Pregled računa" button, PDF address is known when
+    # Download icon is clickable, before viewer renders the bill
+    'open_bill': [
+        {'row': True},
+        {'click': '#step5', 'timeout': 'pdf'},
+        {'wait': '#download', 'condition': 'clickable', 'timeout': 'pdf'},
+    ],
+    'viewer': {'pdf_link': '#download', 'rendered': 'div.page[data-loaded="true"]', 'save_button': '#download'},
+    # Click (X) - Close button
+    'close_bill': [{'click': 'div.pdfCloseBtn>span.close-btn'}],
+    # Click Back button, to location list, when location has no route
+    'leave_location': [{'click': 'div.icon-back'}],
+    # Logout and confirm
+    'logout': [
+        {'click': 'div.mainBtnsHolder>div:nth-child(7)', 'timeout': 'logout'},
+        {'click': 'div.modal-delete-action > button:nth-child(1)', 'timeout': 'logout'},
+    ],
+})
+
+
+class Infostan(Scraper):
+    recipe = RECIPE
@@ -0,0 +1,477 @@
+"""
+Jobs module, shared queue of account jobs, so many hosts split one account list
+
+With --queue, every host fills the queue with jobs of all configured accounts, for current round
+(queue_round seconds, like one hour of cron runs), and claims jobs until none is left.
+Job of a round is added once, whichever host adds it first, so every account is checked once per round.
+Claimed job has a lease of queue_lease seconds, renewed by heartbeat while scraper runs.
+Job of host that stopped is claimed again by another host after its lease expires.
+Result is accepted only from the host that still holds the lease, once, with new periods of every storage
+of the account. Other hosts read these periods before they check the account, so bill found by one host
+is neither downloaded nor notified by another one. Notifications of rejected result are dropped.
+
+Backends:
+    sqlite: database on shared path (queue_path), default
+    http:   queue server on one host (queue_url), for hosts without shared folder
+
+    python3 -m eracuni.jobs serve
+    python3 -m eracuni.jobs status
+
+Queue server has no authentication, it listens only on host of queue_url, 127.0.0.1 by default.
+Set queue_url to address of server in trusted local network, or give --host, to serve other hosts.
+Host that can't reach the queue reports it and stops taking jobs, jobs it leased are taken over after lease.
+"""
+
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type
+from urllib.parse import urlsplit
+import requests
+from eracuni.archive import period_key
+from eracuni.backfill import Backfill
+from eracuni.data import Config, is_location_infix
+from eracuni.messages import Notifications
+from eracuni.pool import Job, Pool, account_jobs
+from eracuni.state import state_store
+
+
+# Job claimed this many times, by hosts that stopped before they finished it, is given up
+MAX_ATTEMPTS = 3
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    round INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    token TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished_at TEXT,
+    UNIQUE (round, key)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (round, state, lease_until);
+CREATE TABLE IF NOT EXISTS periods (
+    infix TEXT PRIMARY KEY,
+    period TEXT NOT NULL,
+    job_id INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+"""
+
+
+class Lease:
+    """
+    Claimed job
+
+    Lease:
+        job_id:     id of job in queue
+        key:        job key, storage infix of account, like edb_dom_home
+        token:      proof of lease, result and heartbeat with old token are rejected
+        periods:    last known period of every storage of account, infix: period
+    """
+    def __init__(self, job_id: int, key: str, token: str, periods: Dict[str, str]) -> None:
+        self.job_id = job_id
+        self.key = key
+        self.token = token
+        self.periods = periods
+
+
+class JobQueue(ABC):
+    """
+    Base class of queue backend
+    """
+    @abstractmethod
+    def fill(self, round_id: int, keys: List[str]) -> None:
+        """
+        Add jobs of round that are not in queue yet
+        """
+
+    @abstractmethod
+    def claim(self, round_id: int, owner: str, lease: float) -> Optional[Lease]:
+        """
+        Lease next free job of round, None when every job is done or leased
+        """
+
+    @abstractmethod
+    def heartbeat(self, lease: Lease, seconds: float) -> bool:
+        """
+        Extend lease, return False if lease is lost
+        """
+
+    @abstractmethod
+    def complete(self, lease: Lease, failed: bool, periods: Dict[str, str]) -> bool:
+        """
+        Finish job with new periods, return False if lease is lost and result is rejected
+        """
+
+    @abstractmethod
+    def status(self, round_id: int) -> List[Dict[str, Any]]:
+        """
+        Return key, state, owner, attempts and finish time of every job of round
+        """
+
+
+def account_periods(periods: Dict[str, str], key: str) -> Dict[str, str]:
+    """
+    Return periods of account storage and storages of its locations, key_{location id}
+    """
+    return {infix: period for infix, period in periods.items() if infix == key or is_location_infix(infix, key)}
+
+
+def newer_period(period: str, last_saved: Optional[str], known: Set[str]) -> bool:
+    """
+    Return True if period from queue is newer than last saved period of this host
+    Periods are compared as months when both can be read, otherwise period is newer if this host never saw it
+    """
+    if last_saved is None:
+        return True
+    if period == last_saved:
+        return False
+    month, last_month = period_key(period), period_key(last_saved)
+    if month is not None and last_month is not None:
+        return month > last_month
+    return period not in known
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Queue in SQLite database, on path shared by all hosts
+    Every call is one short transaction with its own connection, without WAL, it needs shared memory of one host
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.executescript(QUEUE_SCHEMA)
+        finally:
+            connection.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def fill(self, round_id: int, keys: List[str]) -> None:
+        with self.transaction() as connection:
+            connection.executemany('INSERT OR IGNORE INTO jobs (round, key) VALUES (?, ?)',
+                                   [(round_id, key) for key in keys])
+
+    def claim(self, round_id: int, owner: str, lease: float) -> Optional[Lease]:
+        now = time.time()
+        with self.transaction() as connection:
+            while True:
+                row = connection.execute(
+                    "SELECT id, key, attempts FROM jobs WHERE round = ? AND (state = 'pending' OR "
+                    "(state = 'leased' AND lease_until < ?)) ORDER BY id LIMIT 1", (round_id, now)).fetchone()
+                if row is None:
+                    return None
+                job_id, key, attempts = row
+                if attempts >= MAX_ATTEMPTS:
+                    connection.execute("UPDATE jobs SET state = 'failed', token = NULL, finished_at = ? WHERE id = ?",
+                                       (datetime.now().isoformat(timespec='seconds'), job_id))
+                    continue
+                token = uuid.uuid4().hex
+                connection.execute("UPDATE jobs SET state = 'leased', owner = ?, token = ?, lease_until = ?, "
+                                   "attempts = attempts + 1 WHERE id = ?", (owner, token, now + lease, job_id))
+                periods = dict(connection.execute(
+                    'SELECT infix, period FROM periods WHERE infix = ? OR substr(infix, 1, ?) = ?',
+                    (key, len(key) + 1, f'{key}_')).fetchall())
+                return Lease(job_id, key, token, account_periods(periods, key))
+
+    def heartbeat(self, lease: Lease, seconds: float) -> bool:
+        with self.transaction() as connection:
+            cursor = connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND token = ? "
+                                        "AND state = 'leased'", (time.time() + seconds, lease.job_id, lease.token))
+            return cursor.rowcount == 1
+
+    def complete(self, lease: Lease, failed: bool, periods: Dict[str, str]) -> bool:
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.transaction() as connection:
+            cursor = connection.execute("UPDATE jobs SET state = ?, lease_until = NULL, finished_at = ? "
+                                        "WHERE id = ? AND token = ? AND state = 'leased'",
+                                        ('failed' if failed else 'done', now, lease.job_id, lease.token))
+            if cursor.rowcount != 1:
+                return False
+            connection.executemany(
+                'INSERT INTO periods (infix, period, job_id, recorded_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (infix) DO UPDATE SET period = excluded.period, job_id = excluded.job_id, '
+                'recorded_at = excluded.recorded_at',
+                [(infix, period, lease.job_id, now) for infix, period in periods.items()])
+            return True
+
+    def status(self, round_id: int) -> List[Dict[str, Any]]:
+        with self.transaction() as connection:
+            rows = connection.execute('SELECT key, state, owner, attempts, finished_at FROM jobs WHERE round = ? '
+                                      'ORDER BY id', (round_id,)).fetchall()
+        return [{'key': key, 'state': state, 'owner': owner, 'attempts': attempts, 'finished_at': finished_at}
+                for key, state, owner, attempts, finished_at in rows]
+
+
+class HttpJobQueue(JobQueue):
+    """
+    Client of queue server, started on one host with python3 -m eracuni.jobs serve
+    """
+    def __init__(self, url: str, timeout: float = 30) -> None:
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def call(self, name: str, **values: Any) -> Any:
+        response = self.session.post(f'{self.url}/{name}', json=values, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['result']
+
+    def fill(self, round_id: int, keys: List[str]) -> None:
+        self.call('fill', round_id=round_id, keys=keys)
+
+    def claim(self, round_id: int, owner: str, lease: float) -> Optional[Lease]:
+        result = self.call('claim', round_id=round_id, owner=owner, lease=lease)
+        return Lease(**result) if result is not None else None
+
+    def heartbeat(self, lease: Lease, seconds: float) -> bool:
+        return self.call('heartbeat', lease=vars(lease), seconds=seconds)
+
+    def complete(self, lease: Lease, failed: bool, periods: Dict[str, str]) -> bool:
+        return self.call('complete', lease=vars(lease), failed=failed, periods=periods)
+
+    def status(self, round_id: int) -> List[Dict[str, Any]]:
+        return self.call('status', round_id=round_id)
+
+
+def queue_handler(queue: JobQueue) -> Type[BaseHTTPRequestHandler]:
+    """
+    Return request handler of queue server, every POST /{method} calls method of queue with JSON arguments
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def send_json(self, status: int, value: Dict[str, Any]) -> None:
+            body = json.dumps(value, ensure_ascii=False).encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            name = self.path.strip('/')
+            if name not in ('fill', 'claim', 'heartbeat', 'complete', 'status'):
+                self.send_json(404, {'error': 'not found'})
+                return
+            values = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if 'lease' in values and isinstance(values['lease'], dict):
+                values['lease'] = Lease(**values['lease'])
+            result = getattr(queue, name)(**values)
+            self.send_json(200, {'result': vars(result) if isinstance(result, Lease) else result})
+    return Handler
+
+
+def job_queue(config: Config) -> JobQueue:
+    """
+    Return queue backend from config
+    """
+    if config.queue_backend == 'http':
+        return HttpJobQueue(config.queue_url, config.timeout)
+    if config.queue_backend != 'sqlite':
+        raise ValueError(f'Unknown queue_backend: {config.queue_backend}, use sqlite or http')
+    return SqliteJobQueue(config.queue_path)
+
+
+def job_key(job: Job) -> str:
+    return f'{job.scraper.recipe.prefix}_{job.account.alias}'
+
+
+class QueuePool(Pool):
+    """
+    Pool that takes jobs from shared queue, with other hosts
+    Periods found by other hosts are recorded in local state before account is checked,
+    notifications of job are kept only if queue accepts its result
+    """
+    def __init__(self, config: Config, notifications: Notifications, workers: int, queue: JobQueue,
+                 backfill: Optional[Backfill] = None, tabs: bool = False) -> None:
+        super().__init__(config, notifications, workers, backfill, tabs)
+        self.queue = queue
+        self.round_id = 0
+        self.by_key: Dict[str, Job] = {}
+        self.leases: Dict[int, Lease] = {}
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopped = False
+
+    def queue_error(self, action: str, error: Exception) -> None:
+        """
+        Report queue that can't be reached, host takes no more jobs and run fails
+        """
+        with self.lock:
+            print(f"Job queue can't {action}, no more jobs are taken: {error}", file=sys.stderr)
+            if not self.stopped:
+                self.stopped = True
+                self.failed.append('Job queue')
+
+    def run(self, jobs: List[Job]) -> List[str]:
+        self.round_id = int(time.time() // self.config.queue_round)
+        self.by_key = {job_key(job): job for job in jobs}
+        try:
+            self.queue.fill(self.round_id, list(self.by_key))
+        except (sqlite3.Error, requests.RequestException) as e:
+            self.queue_error('add jobs', e)
+            return self.failed
+
+        threads = [threading.Thread(target=self.worker, args=(number,), name=f'worker_{number}')
+                   for number in range(1, min(self.workers, len(jobs)) + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.tabs is not None:
+            self.tabs.quit()
+        return self.failed
+
+    def next_job(self) -> Optional[Tuple[int, Job]]:
+        while not self.stopped:
+            try:
+                lease = self.queue.claim(self.round_id, f'{self.owner}:{threading.current_thread().name}',
+                                         self.config.queue_lease)
+            except (sqlite3.Error, requests.RequestException) as e:
+                self.queue_error('lease job', e)
+                return None
+            if lease is None:
+                return None
+            job = self.by_key.get(lease.key)
+            if job is None:
+                # Account is not in config of this host
+                print(f'Job {lease.key} is not in config.yaml, skipped', file=sys.stderr)
+                try:
+                    self.queue.complete(lease, True, {})
+                except (sqlite3.Error, requests.RequestException) as e:
+                    self.queue_error('finish job', e)
+                continue
+            with self.lock:
+                self.leases[lease.job_id] = lease
+            return lease.job_id, job
+        return None
+
+    def run_job(self, browser: Any, index: int, job: Job) -> None:
+        with self.lock:
+            lease = self.leases.pop(index)
+        store = state_store()
+        # Bills found by other hosts are not new, they are recorded as remote, without PDF
+        # Period older than the one this host has, from host that was behind, is ignored
+        for infix, period in lease.periods.items():
+            if newer_period(period, store.last_saved(infix), store.periods(infix)):
+                store.record(infix, period, remote=True)
+        before = self.last_periods(lease.key)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self.heartbeat, args=(lease, stop), daemon=True)
+        heartbeat.start()
+        job_notifications = Notifications(self.config, self.notifications.delivery, deferred=True)
+        try:
+            failed = self.scrape(browser, job, job_notifications)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        after = self.last_periods(lease.key)
+        periods = {infix: period for infix, period in after.items() if before.get(infix) != period}
+        try:
+            accepted = self.queue.complete(lease, bool(failed), periods)
+        except (sqlite3.Error, requests.RequestException) as e:
+            # Job is taken over after its lease, by host that reports its result
+            self.queue_error(f'finish job {job_key(job)}', e)
+            return
+        if not accepted:
+            print(f'{job_key(job)}: lease expired, result is left to host that took the job over', file=sys.stderr)
+            return
+        with self.lock:
+            self.failed += failed
+            self.notifications.merge(job_notifications)
+
+    def heartbeat(self, lease: Lease, stop: threading.Event) -> None:
+        """
+        Renew lease every third of its length, until job is done
+        """
+        while not stop.wait(self.config.queue_lease / 3):
+            try:
+                if not self.queue.heartbeat(lease, self.config.queue_lease):
+                    print(f'{lease.key}: lease lost', file=sys.stderr)
+                    return
+            except (sqlite3.Error, requests.RequestException) as e:
+                print(f'{lease.key}: heartbeat failed: {e}', file=sys.stderr)
+
+    @staticmethod
+    def last_periods(key: str) -> Dict[str, str]:
+        """
+        Return last saved period of account storage, or of storage of every location
+        """
+        store = state_store()
+        infixes = [key] + store.infixes(f'{key}_')
+        periods = {infix: store.last_saved(infix) for infix in infixes}
+        return account_periods({infix: period for infix, period in periods.items() if period}, key)
+
+
+def run_queue(config: Config, notifications: Notifications, workers: int,
+              backfill: Optional[Backfill] = None) -> List[str]:
+    """
+    Check accounts from shared queue, with other hosts
+    Return failed accounts, as "label (alias)", of jobs checked by this host
+    """
+    tabs = config.tabs and not config.remote_webdrivers
+    return QueuePool(config, notifications, workers, job_queue(config), backfill, tabs).run(
+        account_jobs(config))
+
+
+def serve(config: Config, host: str, port: int) -> None:
+    """
+    Run queue server, with SQLite queue in queue_path
+    """
+    server = ThreadingHTTPServer((host, port), queue_handler(SqliteJobQueue(config.queue_path)))
+    print(f'Job queue on {host}:{port}, {config.queue_path}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Shared queue of account jobs')
+    parser.add_argument('command', choices=['serve', 'status'])
+    parser.add_argument('--host', default=None,
+                        help='address queue server listens on, host of queue_url by default')
+    parser.add_argument('--port', type=int, default=None, help='port of queue server, port of queue_url by default')
+    args = parser.parse_args()
+    config = Config()
+    if args.command == 'serve':
+        url = urlsplit(config.queue_url)
+        serve(config, args.host or url.hostname or '127.0.0.1', args.port or url.port or 8632)
+        return
+    for job in job_queue(config).status(int(time.time() // config.queue_round)):
+        print(f"{job['key']:32} {job['state']:8} {job['attempts']} {job['owner'] or '-':40} {job['finished_at'] or '-'}")
+
+
+if __name__ == '__main__':
+    main()
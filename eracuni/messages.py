@@ -1,22 +1,199 @@
 """
 Notifications module, send messages to console stdout, eMail and Telegram
+
+Messages go through outbox in var/state.sqlite3: every enabled channel gets its own copy,
+channels are delivered concurrently, with retries and backoff, over one connection per channel.
+Message that still can't be delivered stays in outbox and is sent again on next run.
 """
 
 
 import smtplib
 import ssl
-import requests
 import sys
+import time
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from email.message import EmailMessage
+from typing import List, Optional
+import requests
 from eracuni.data import Config
+from eracuni.state import state_store
+
+
+class Channel(ABC):
+    """
+    Base class for delivery channel, subclasses implement deliver() and may change compose()
+    Messages of one channel are delivered one at a time, in order
+    """
+    name = ''
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.lock = threading.Lock()
+
+    def compose(self, text: str) -> str:
+        """
+        Return message body for text, as saved in outbox
+        """
+        return text
+
+    @abstractmethod
+    def deliver(self, body: str) -> None:
+        """
+        Send one message, raise exception on failure
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class EmailChannel(Channel):
+    """
+    Send email over SMTP SSL, connection is opened on first message and kept for the rest of the run
+    """
+    name = 'email'
+
+    def __init__(self, config: Config) -> None:
+        super().__init__(config)
+        self.server: Optional[smtplib.SMTP_SSL] = None
+
+    def deliver(self, body: str) -> None:
+        message = EmailMessage()
+        message['From'] = self.config.email_address
+        message['To'] = self.config.receiver_email
+        message['Subject'] = 'Novi računi'
+        message.set_content(body)
+        try:
+            if self.server is None:
+                context = ssl.create_default_context()
+                self.server = smtplib.SMTP_SSL(self.config.smtp_server, self.config.ssl_port,
+                                               timeout=self.config.timeout, context=context)
+                self.server.login(self.config.email_address, self.config.email_password)
+            self.server.send_message(message)
+        except Exception:
+            # Connection may be broken, next attempt opens a new one
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+
+class TelegramChannel(Channel):
+    """
+    Send Telegram message with Bot API, text is posted as form field, so it needs no escaping
+    Keep-alive connection to api.telegram.org is reused for every message
+    """
+    name = 'telegram'
+
+    def __init__(self, config: Config) -> None:
+        super().__init__(config)
+        self.session = requests.Session()
+
+    def compose(self, text: str) -> str:
+        return f'Novi računi:\n\n{text}'
+
+    def deliver(self, body: str) -> None:
+        url = f'https://api.telegram.org/bot{self.config.telegram_bot_token}/sendMessage'
+        response = self.session.post(url, data={'chat_id': self.config.telegram_chat_id, 'text': body},
+                                     timeout=self.config.timeout)
+        result = response.json()
+        if not result.get('ok'):
+            raise RuntimeError(result.get('description', f'HTTP status {response.status_code}'))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class Delivery:
+    """
+    Queue messages in outbox and deliver them over every enabled channel, in background threads
+    Failed message is retried notify_retries times, waiting notify_backoff seconds, doubled after every retry
+    """
+    def __init__(self, config: Config, channels: Optional[List[Channel]] = None) -> None:
+        self.config = config
+        if channels is None:
+            channels = []
+            if config.email_enabled:
+                channels.append(EmailChannel(config))
+            if config.telegram_enabled:
+                channels.append(TelegramChannel(config))
+        self.channels = channels
+        self.store = state_store()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(channels)), thread_name_prefix='notify')
+        self.futures: List[Future] = []
+
+    def queue(self, text: str) -> None:
+        """
+        Save message for every enabled channel in outbox
+        """
+        for channel in self.channels:
+            self.store.queue_message(channel.name, channel.compose(text))
+
+    def flush(self) -> None:
+        """
+        Start delivery of all pending messages, every channel in its own thread, don't wait for it
+        """
+        self.futures += [self.executor.submit(self.flush_channel, channel) for channel in self.channels]
+
+    def flush_channel(self, channel: Channel) -> None:
+        """
+        Deliver pending messages of one channel, oldest first
+        Stop at first message that fails after all retries, the rest waits for next run in the same order
+        """
+        with channel.lock:
+            for message_id, body in self.store.pending_messages(channel.name):
+                attempts = 0
+                while True:
+                    attempts += 1
+                    try:
+                        channel.deliver(body)
+                        self.store.mark_sent(message_id)
+                        break
+                    except Exception as e:
+                        if attempts > self.config.notify_retries:
+                            self.store.mark_failed(message_id, attempts, str(e))
+                            print(f"Can't send {channel.name}: {e}, message is kept for next run", file=sys.stderr)
+                            return
+                        time.sleep(self.config.notify_backoff * 2 ** (attempts - 1))
+
+    def close(self) -> None:
+        """
+        Wait for every started delivery and close connections
+        """
+        wait(self.futures)
+        self.futures = []
+        self.executor.shutdown()
+        for channel in self.channels:
+            channel.close()
 
 
 class Notifications:
     """
     Send notifications over console stdout, eMail and Telegram
+    With notify_immediately, every bill is sent as soon as it is found, otherwise all of them at the end of run
+    Deferred notifications only collect message body, their owner decides if it is sent
     """
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, delivery: Optional[Delivery] = None, deferred: bool = False) -> None:
         self.config = config
         self.message_body = ''
+        self._delivery = delivery
+        self.deferred = deferred
+
+    @property
+    def delivery(self) -> Delivery:
+        """
+        Delivery is made on first use, notifications of pool jobs share delivery of main notifications
+        """
+        if self._delivery is None:
+            self._delivery = Delivery(self.config)
+        return self._delivery
 
     def add(self, text: str) -> None:
         """
@@ -25,44 +202,26 @@ class Notifications:
         self.message_body = self.message_body + text + '\n'
         # Report also to console stdout
         print(text)
+        if self.config.notify_immediately and not self.deferred:
+            self.delivery.queue(text + '\n')
+            self.delivery.flush()
 
-    def send(self) -> None:
+    def merge(self, other: 'Notifications') -> None:
         """
-        Send message
+        Append message body of other notifications, without reporting to stdout again
+        Body of deferred notifications is sent now, with notify_immediately
         """
-        self.send_email()
-        self.send_telegram()
+        self.message_body = self.message_body + other.message_body
+        if other.deferred and other.message_body and self.config.notify_immediately:
+            self.delivery.queue(other.message_body)
+            self.delivery.flush()
 
-    def send_email(self) -> None:
+    def send(self) -> None:
         """
-        Send email, UTF-8 encoded text
+        Send message, with messages left in outbox from previous runs
+        Wait until every channel is done
         """
-        if self.config.email_enabled and self.message_body != '':
-            message = f"""\
-From: {self.config.email_address}
-To: {self.config.receiver_email}
-Subject: Novi računi
-
-{self.message_body}
-"""
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(self.config.smtp_server, self.config.ssl_port, context=context) as server:
-                try:
-                    server.login(self.config.email_address, self.config.email_password)
-                    res = server.sendmail(
-                        self.config.email_address, self.config.receiver_email, message.encode('utf8'))
-                except:
-                    print("Can't send email", file=sys.stderr)
-
-    def send_telegram(self) -> None:
-        """
-        Send Telegram
-        """
-        if self.config.telegram_enabled and self.message_body != '':
-            message = f'Novi računi:\n\n{self.message_body}'
-            token = self.config.telegram_bot_token
-            chat_id = self.config.telegram_chat_id
-            url_req = f'https://api.telegram.org/bot{token}/sendMessage?chat_id={chat_id}&text={message}'
-            results = requests.get(url_req)
-            if not results.json()['ok']:
-                print("Can't send Telegram", file=sys.stderr)
+        if self.message_body != '' and not self.config.notify_immediately:
+            self.delivery.queue(self.message_body)
+        self.delivery.flush()
+        self.delivery.close()
@@ -0,0 +1,146 @@
+"""
+Worker pool module, check accounts concurrently in independent browser sessions
+With tabs, workers share one Firefox, every worker uses its own container tab
+"""
+
+
+import os
+import sys
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple, Type, Any
+from eracuni.backfill import Backfill
+from eracuni.data import Account, Config
+from eracuni.browser import LazyBrowser
+from eracuni.edb import Domacinstva, MernaGrupa
+from eracuni.infostan import Infostan
+from eracuni.messages import Notifications
+from eracuni.tabs import TabBrowser
+
+
+class Job:
+    """
+    One account, checked by one scraper class
+
+    Job:
+        scraper: Domacinstva, MernaGrupa or Infostan class
+        account: Account from Config
+    """
+    def __init__(self, scraper: Type[Any], account: Account) -> None:
+        self.scraper = scraper
+        self.account = account
+
+
+def account_jobs(config: Config) -> List[Job]:
+    """
+    Return list of jobs for every configured account, in the same order as serial run
+    """
+    jobs = [Job(Domacinstva, account) for account in config.edb_domacinstva_accounts]
+    jobs += [Job(MernaGrupa, account) for account in config.edb_merna_grupa_accounts]
+    jobs += [Job(Infostan, account) for account in config.infostan_accounts]
+    return jobs
+
+
+class Pool:
+    """
+    Spread account jobs over number of workers, every worker has own browser and own download folder
+    Results of all jobs are merged into one Notifications, in job order
+    With backfill, every job downloads older bills too
+    With tabs, all workers use one browser, in tabs with separate cookies
+    """
+    def __init__(self, config: Config, notifications: Notifications, workers: int,
+                 backfill: Optional[Backfill] = None, tabs: bool = False) -> None:
+        self.config = config
+        self.notifications = notifications
+        self.workers = workers
+        self.backfill = backfill
+        self.tabs = TabBrowser(config) if tabs else None
+        self.jobs: 'queue.Queue[Any]' = queue.Queue()
+        self.results: Dict[int, Notifications] = {}
+        self.failed: List[str] = []
+        self.lock = threading.Lock()
+
+    def run(self, jobs: List[Job]) -> List[str]:
+        """
+        Check all jobs, wait for workers to finish
+        Return failed accounts, as "label (alias)"
+        """
+        for index, job in enumerate(jobs):
+            self.jobs.put((index, job))
+
+        threads = [threading.Thread(target=self.worker, args=(number,), name=f'worker_{number}')
+                   for number in range(1, min(self.workers, len(jobs)) + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.tabs is not None:
+            self.tabs.quit()
+
+        for index in sorted(self.results):
+            self.notifications.merge(self.results[index])
+        return self.failed
+
+    def worker(self, number: int) -> None:
+        """
+        Take jobs from queue until it is empty
+        Browser is started on first use and restarted after failed account
+        Tab is closed after every job, next account starts with empty cookies
+        """
+        download_dir = os.path.join('var', f'worker_{number}')
+        os.makedirs(download_dir, exist_ok=True)
+        browser: Any = LazyBrowser(self.config, download_dir) if self.tabs is None else \
+            self.tabs.open_tab(download_dir)
+        try:
+            while True:
+                item = self.next_job()
+                if item is None:
+                    break
+                index, job = item
+                self.run_job(browser, index, job)
+                if self.tabs is not None:
+                    browser.quit()
+        finally:
+            browser.quit()
+
+    def next_job(self) -> Optional[Tuple[int, Job]]:
+        """
+        Return index and next job, None when there are no more jobs
+        """
+        try:
+            return self.jobs.get_nowait()
+        except queue.Empty:
+            return None
+
+    def run_job(self, browser: Any, index: int, job: Job) -> None:
+        job_notifications = Notifications(self.config, self.notifications.delivery)
+        failed = self.scrape(browser, job, job_notifications)
+        with self.lock:
+            self.failed += failed
+            self.results[index] = job_notifications
+
+    def scrape(self, browser: Any, job: Job, notifications: Notifications) -> List[str]:
+        """
+        Check account of job, return failed accounts
+        Scraper reports problems to stderr and resets browser after failed account
+        Unexpected error, of recipe or storage, fails only this account, browser is reset too
+        """
+        try:
+            return job.scraper(browser, self.config, notifications, accounts=[job.account],
+                               backfill=self.backfill).failed
+        except Exception as e:
+            label = f'{job.scraper.recipe.label} ({job.account.alias})'
+            print(f'{label} failed: {type(e).__name__}: {e}', file=sys.stderr)
+            browser.quit()
+            return [label]
+
+
+def run_pool(config: Config, notifications: Notifications, workers: int,
+             backfill: Optional[Backfill] = None) -> List[str]:
+    """
+    Check all configured accounts with number of parallel browsers, or tabs of one browser
+    Return failed accounts, as "label (alias)"
+    """
+    # Container tabs are made in chrome context of local Firefox
+    tabs = config.tabs and not config.remote_webdrivers
+    return Pool(config, notifications, workers, backfill, tabs).run(account_jobs(config))
@@ -0,0 +1,117 @@
+"""
+Profile module, prebuilt Firefox profile template, for fast browser start
+
+Template is built once, into profile_template folder (var/firefox_profile by default):
+
+    python3 -m eracuni.profile
+
+Firefox is started with empty profile and opens login page of every portal, so profile is initialized
+and static files of portals are in its disk cache. Cookies and other site data are removed from template.
+Every browser then starts from its own clone of template, next to it, removed when browser quits.
+Clone is copy on write (cp --reflink=auto) where file system has it, otherwise plain copy.
+Files are never hard linked, Firefox writes profile files in place.
+Preferences are given on every start, not kept in template, so config changes need no rebuild.
+Build template again after Firefox upgrade, while eracuni is not running.
+"""
+
+
+import sys
+import json
+import shutil
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from eracuni.data import Config
+
+
+# Written last, folder without it is not a finished template
+MARKER = 'eracuni_template.json'
+
+# Site data, logins and state of last Firefox session, not kept in template
+SITE_DATA = (
+    'cookies.sqlite', 'cookies.sqlite-wal', 'cookies.sqlite-shm', 'webappsstore.sqlite', 'storage',
+    'sessionstore.jsonlz4', 'sessionstore-backups', 'sessionCheckpoints.json', 'formhistory.sqlite',
+    'permissions.sqlite', 'prefs.js', 'user.js', 'lock', '.parentlock', 'parent.lock',
+    'minidumps', 'crashes', 'datareporting', 'saved-telemetry-pings',
+)
+
+
+def template_ready(config: Config) -> bool:
+    """
+    Return True if profile template is enabled in config and built
+    """
+    return bool(config.profile_template) and (Path(config.profile_template) / MARKER).exists()
+
+
+def clone_profile(template: Path) -> Path:
+    """
+    Return new clone of template, in folder next to it, so copy on write works on the same file system
+    """
+    clone = Path(tempfile.mkdtemp(prefix=f'{template.name}-', dir=template.parent))
+    try:
+        subprocess.run(['cp', '-a', '--reflink=auto', f'{template}/.', str(clone)], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        # No GNU cp, like on Windows and macOS
+        shutil.copytree(template, clone, symlinks=True, dirs_exist_ok=True)
+    return clone
+
+
+def remove_site_data(profile: Path) -> None:
+    for name in SITE_DATA:
+        path = profile / name
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.exists() or path.is_symlink():
+            path.unlink()
+
+
+def build_template(config: Config) -> Path:
+    """
+    Build profile template, replace old one only when new one is finished
+    Clones left by interrupted runs are removed too
+    """
+    # Imported here, browser module imports this one
+    from eracuni.browser import firefox
+    from selenium.common.exceptions import WebDriverException  # type: ignore
+
+    template = Path(config.profile_template)
+    template.parent.mkdir(parents=True, exist_ok=True)
+    building = template.with_name(template.name + '.new')
+    shutil.rmtree(building, ignore_errors=True)
+    building.mkdir()
+
+    driver = firefox(config, profile_dir=building)
+    try:
+        for url in (config.edb_domacinstva_url, config.edb_merna_grupa_url, config.infostan_url):
+            try:
+                driver.get(url)
+            except WebDriverException as e:
+                print(f"Can't open {url}: {e.msg}", file=sys.stderr)
+    finally:
+        driver.quit()
+
+    remove_site_data(building)
+    (building / MARKER).write_text(json.dumps({'built': datetime.now().isoformat(timespec='seconds'),
+                                               'machine': platform.machine()}))
+    for clone in template.parent.glob(f'{template.name}-*'):
+        shutil.rmtree(clone, ignore_errors=True)
+    shutil.rmtree(template, ignore_errors=True)
+    building.rename(template)
+    return template
+
+
+def main() -> None:
+    config = Config()
+    if not config.profile_template:
+        print('profile_template is empty in config.yaml', file=sys.stderr)
+        sys.exit(1)
+    template = build_template(config)
+    size = sum(path.stat().st_size for path in template.rglob('*') if path.is_file())
+    print(f'Profile template built in {template}, {size / 1024 / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
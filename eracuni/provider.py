@@ -0,0 +1,510 @@
+"""
+Provider module, one scraper for every utility portal, driven by recipes
+
+Recipe is plain dictionary in provider module (edb.py, infostan.py): login fields, navigation steps,
+invoice list, how to open and download a bill, and locations when account has more of them.
+Recipes are compiled once, at import, into Recipe objects, so unknown step or missing key fails at startup.
+Scraper runs any recipe, waits, batching and retries are added here, for every provider at once.
+
+Failed account does not stop the run. Browser is reset and account is tried again after backoff,
+while provider has retries left in this run. When many accounts of a provider fail in a row,
+portal is taken as down and its accounts are skipped for a while (circuit breaker).
+
+Step is dictionary with one action:
+    click:  css selector of element to click, waits until it is clickable
+    wait:   css selector to wait for, with condition: present (default), clickable or text
+    type:   css selector of input field, value is account field: user_id or password
+    remove: css selector of element to remove from page, like modal that covers login button
+    row:    True, click row of the bill
+and optional timeout, name of step budget from config step_timeouts
+
+Locations are read from list in one call: rows and ready css selectors, with optional button (click target
+in row, row itself by default), route (element with address of bills of location, in its href
+or in location.href of its onclick) and last_bill (element with period of newest bill, when list shows it).
+Location whose last bill is already saved is not opened at all. Location with route is opened directly,
+without going back to the list, others are clicked on the list.
+Storage of location is keyed by last part of its route, so it stays with the location when list changes,
+location without route is keyed by its position. Storage kept by position before is moved to route key once.
+"""
+
+
+import re
+import sys
+import time
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+from selenium.common.exceptions import WebDriverException  # type: ignore
+from eracuni.data import Account, Storage, Config, is_location_infix
+from eracuni.backfill import Backfill
+from eracuni.billing import BillingCalendar
+from eracuni.browser import find_first_by_css, find_all_by_css, remove_element_by_css, extract, download_file, \
+    download_direct, pdf_url, PageMetrics, ScraperError, webdriver
+from eracuni.downloads import http_session
+from eracuni.edb_http import EdbHttp, EdbHttpError
+from eracuni.messages import Notifications
+from eracuni.sessions import SessionCache
+from eracuni.tracing import tracer
+
+
+ACTIONS = ('click', 'wait', 'type', 'remove', 'row')
+ACCOUNT_FIELDS = ('user_id', 'password')
+RECIPE_KEYS = ('name', 'label', 'prefix', 'url', 'accounts', 'login', 'logged_in', 'menu', 'bills', 'logout')
+
+# Address in onclick handler, like: location.href = '/infostan/1'
+ONCLICK_ROUTE = re.compile(r"""location\.href\s*=\s*['"]([^'"]+)['"]""")
+
+
+class Step:
+    """
+    One compiled step of recipe
+    """
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        actions = [action for action in ACTIONS if action in spec]
+        if len(actions) != 1:
+            raise ValueError(f'Step needs exactly one of {", ".join(ACTIONS)}: {spec}')
+        self.action = actions[0]
+        self.target = spec[self.action]
+        self.condition = spec.get('condition', 'clickable' if self.action == 'click' else 'present')
+        self.timeout: Optional[str] = spec.get('timeout')
+        self.value: Optional[str] = spec.get('value')
+        if self.action == 'type' and self.value not in ACCOUNT_FIELDS:
+            raise ValueError(f'Step type needs value {" or ".join(ACCOUNT_FIELDS)}: {spec}')
+
+
+class Recipe:
+    """
+    Compiled recipe of one provider
+    Extract spec of bills table is built here, once
+    """
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        missing = [key for key in RECIPE_KEYS if key not in spec]
+        if missing:
+            raise ValueError(f'Recipe {spec.get("name")} has no {", ".join(missing)}')
+        self.name: str = spec['name']
+        self.label: str = spec['label']
+        self.prefix: str = spec['prefix']
+        self.url: str = spec['url']
+        self.accounts: str = spec['accounts']
+        self.http: bool = spec.get('http', False)
+        self.login = self.steps(spec['login'])
+        self.logged_in: str = spec['logged_in']
+        self.menu = self.steps(spec['menu'])
+        self.locations: Optional[Dict[str, str]] = spec.get('locations')
+        self.location_rows: Optional[Dict[str, Any]] = None
+        if self.locations is not None:
+            # Row itself is click target if there is no button, route and last bill are optional
+            location_fields: Dict[str, Any] = {'button': {'attr': 'element'}}
+            if 'button' in self.locations:
+                location_fields['button']['css'] = self.locations['button']
+            if 'route' in self.locations:
+                location_fields['route'] = {'css': self.locations['route'],
+                                            'fields': {'href': {'attr': 'href'}, 'onclick': {'attr': 'onclick'}}}
+            if 'last_bill' in self.locations:
+                location_fields['last_bill'] = {'css': self.locations['last_bill']}
+            self.location_rows = {'rows': {'css': self.locations['rows'], 'all': True, 'fields': location_fields}}
+        self.open_bill = self.steps(spec.get('open_bill', []))
+        self.viewer: Dict[str, str] = spec.get('viewer', {})
+        self.close_bill = self.steps(spec.get('close_bill', []))
+        self.leave_location = self.steps(spec.get('leave_location', []))
+        self.pause: float = spec.get('pause', 0)
+        self.logout = self.steps(spec['logout'])
+
+        bills = spec['bills']
+        self.bills_ready: str = bills['ready']
+        self.bills_condition: str = bills.get('condition', 'present')
+        self.bills_timeout: str = bills.get('timeout', 'bills')
+        self.header_rows: int = bills.get('header', 0)
+        fields: Dict[str, Any] = {'row': {'attr': 'element'}, 'period': {'css': bills['period']}}
+        if 'pdf_url' in bills:
+            fields['pdf_url'] = {'css': bills['pdf_url'], 'attr': 'href'}
+        if 'save_button' in bills:
+            fields['save_button'] = {'css': bills['save_button'], 'attr': 'element'}
+        if 'pdf_url' not in bills and 'pdf_link' not in self.viewer:
+            raise ValueError(f'Recipe {self.name} has no PDF address, in bills pdf_url or viewer pdf_link')
+        self.bill_rows = {'rows': {'css': bills['rows'], 'all': True, 'fields': fields}}
+
+    @staticmethod
+    def steps(specs: List[Dict[str, Any]]) -> List[Step]:
+        return [Step(spec) for spec in specs]
+
+
+class ProviderHealth:
+    """
+    Retry budget and circuit breaker of one provider, shared by all its scrapers in process
+    After circuit_failures failed accounts in a row, circuit is open and accounts are skipped
+    for circuit_cooldown seconds, then next account is tried again and success closes circuit
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0.0
+        self.retries = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            return time.time() >= self.open_until
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.open_until = 0.0
+
+    def failure(self, config: Config) -> bool:
+        """
+        Count failed account, return True if circuit is open now
+        """
+        with self.lock:
+            self.failures += 1
+            if self.failures >= config.circuit_failures:
+                self.open_until = time.time() + config.circuit_cooldown
+                return True
+            return False
+
+    def take_retry(self, config: Config) -> bool:
+        """
+        Take one retry from budget of this run, return False if there is none left
+        """
+        with self.lock:
+            if self.retries >= config.retry_budget:
+                return False
+            self.retries += 1
+            return True
+
+
+_health: Dict[str, ProviderHealth] = {}
+_health_lock = threading.Lock()
+
+
+def location_route(route: Optional[Dict[str, Optional[str]]], base_url: str) -> Optional[str]:
+    """
+    Return address of location bills, from href of route element or from location.href in its onclick
+    None if row has no route
+    """
+    if not route:
+        return None
+    address = route.get('href')
+    if not address:
+        match = ONCLICK_ROUTE.search(route.get('onclick') or '')
+        address = match.group(1) if match else None
+    return urljoin(base_url, address) if address else None
+
+
+def location_id(route: Optional[str]) -> Optional[str]:
+    """
+    Return stable id of location, last part of path of its route, safe for file names and without underscore
+    None if location has no route
+    """
+    if not route:
+        return None
+    part = urlsplit(route).path.rstrip('/').rsplit('/', 1)[-1]
+    return re.sub(r'[^0-9A-Za-z-]+', '-', part).strip('-') or None
+
+
+def provider_health(name: str) -> ProviderHealth:
+    with _health_lock:
+        return _health.setdefault(name, ProviderHealth())
+
+
+def new_run() -> None:
+    """
+    Give every provider full retry budget, open circuits stay open until their cooldown ends
+    """
+    with _health_lock:
+        for health in _health.values():
+            with health.lock:
+                health.retries = 0
+
+
+class Scraper:
+    """
+    Check every account of provider, described by recipe of subclass
+    Account has one bill list, or one for every location when recipe has locations
+    Accounts that failed after all retries are in failed list, as "label (alias)"
+    """
+    recipe: Recipe
+
+    def __init__(self, driver: webdriver, config: Config, notifications: Notifications,
+                 accounts: Optional[List[Account]] = None, backfill: Optional[Backfill] = None) -> None:
+        self.driver = driver
+        self.config = config
+        self.notifications = notifications
+        self.backfill = backfill
+        self.sessions = SessionCache(self.config)
+        self.metrics = PageMetrics(self.config)
+        self.calendar = BillingCalendar(self.config)
+        self.health = provider_health(self.recipe.name)
+        self.failed: List[str] = []
+        # Step of account in progress, failed step of account is traced with its name
+        self.step = 'login'
+
+        if accounts is None:
+            accounts = getattr(self.config, self.recipe.accounts)
+
+        for account in accounts:
+            if not self.check_with_retries(account):
+                self.failed.append(f'{self.recipe.label} ({account.alias})')
+            # Low memory mode samples browser memory, and may restart browser before next account
+            account_checked = getattr(self.driver, 'account_checked', None)
+            if account_checked is not None:
+                account_checked()
+
+    def check_with_retries(self, account: Account) -> bool:
+        """
+        Check account, try again after backoff with fresh browser, while retry budget and circuit allow it
+        Return False if account failed
+        """
+        label = f'{self.recipe.label} ({account.alias})'
+        attempt = 0
+        while True:
+            if not self.health.allow():
+                print(f'{label} skipped, portal looks down', file=sys.stderr)
+                tracer.fail(self.recipe.name, account.alias, 'circuit_open')
+                return False
+            try:
+                self.check(account)
+                self.health.success()
+                return True
+            except (ScraperError, WebDriverException) as e:
+                print(f'{label} failed in {self.step}: {str(e).strip()}', file=sys.stderr)
+                tracer.fail(self.recipe.name, account.alias, self.step)
+            # Session may be broken, next attempt starts with fresh browser
+            self.driver.quit()
+            if self.backfill is not None:
+                self.backfill.finish()
+            if attempt < self.config.retries and self.health.take_retry(self.config):
+                time.sleep(self.config.retry_backoff * 2 ** attempt)
+                attempt += 1
+                continue
+            if self.health.failure(self.config):
+                print(f'{self.recipe.label}: {self.config.circuit_failures} accounts failed in a row, '
+                      f'skipped for {self.config.circuit_cooldown} seconds', file=sys.stderr)
+            return False
+
+    def check(self, account: Account) -> None:
+        recipe = self.recipe
+        key = f'{recipe.prefix}_{account.alias}'
+        self.step = 'login'
+
+        # Skip account if bill of none of its known locations is expected yet, backfill checks every account
+        if recipe.locations:
+            infixes = [infix for infix in self.calendar.store.infixes(f'{key}_') if is_location_infix(infix, key)]
+        else:
+            infixes = [key]
+        if self.backfill is None and not self.calendar.due(key, infixes, f'{recipe.label} ({account.alias})'):
+            return
+
+        # Try without browser first, fall back to browser if page is not as expected
+        if recipe.http and self.config.engine == 'http':
+            try:
+                EdbHttp(self.config, self.notifications).check(
+                    account, getattr(self.config, recipe.url), Storage(key), recipe.label, recipe.name, self.backfill)
+                self.calendar.checked(key)
+                return
+            except EdbHttpError as e:
+                print(f'{e}, {recipe.label} ({account.alias}) falls back to browser', file=sys.stderr)
+
+        self.metrics.start_account(self.driver, recipe.name, account.alias)
+
+        # Restore session from last run, or login
+        url = getattr(self.config, recipe.url)
+        if not self.sessions.restore(self.driver, key, url, recipe.logged_in):
+            # Load main page, session cache has already loaded it
+            if not self.sessions.enabled:
+                try:
+                    with tracer.span('page_load', recipe.name, account.alias):
+                        self.driver.get(url)
+                except WebDriverException as e:
+                    raise ScraperError(f'Error loading page: {str(e).strip()}')
+            self.run(recipe.login, account)
+
+        # Page with menu, next run with saved session starts here
+        find_first_by_css(self.driver, recipe.logged_in, 'clickable', timeout=self.config.step_timeout('menu'))
+        home_url = self.driver.current_url
+        self.metrics.step(self.driver, recipe.name, account.alias, 'login')
+        self.step = 'table_read'
+        self.run(recipe.menu, account)
+
+        if recipe.locations:
+            # Read every location, with its route and last bill, in one pass over the list
+            # Account without locations comes back at once, without waiting for rows
+            list_url = self.driver.current_url
+            locations = self.read_locations()
+            self.metrics.step(self.driver, recipe.name, account.alias, 'table_read')
+            on_list, fresh = True, True
+            for i, location in enumerate(locations, 1):
+                # Every location has its own storage
+                route = location_route(location.get('route'), list_url)
+                storage = self.location_storage(key, i, location_id(route))
+                last_bill = (location.get('last_bill') or '').strip()
+                if last_bill and last_bill == storage.last_saved and self.backfill is None:
+                    # Nothing new, location is not opened at all
+                    continue
+                if route:
+                    self.driver.get(route)
+                    self.check_bills(account, storage, f'{account.alias} {i}', leave=False)
+                    on_list, fresh = False, False
+                    continue
+                # No route, click i-th row of location list, list is read again after leaving location
+                if not on_list:
+                    self.driver.get(list_url)
+                if not fresh:
+                    rows = self.read_locations(count=i)
+                    if len(rows) < i:
+                        raise ScraperError(f"Can't find location {i}, list has {len(rows)} of them")
+                    location = rows[i - 1]
+                if location.get('button') is None:
+                    raise ScraperError(f"Can't find CSS selector: {recipe.locations.get('button')} in location {i}")
+                location['button'].click()
+                self.check_bills(account, storage, f'{account.alias} {i}')
+                on_list, fresh = True, False
+        else:
+            self.check_bills(account, Storage(key), account.alias)
+
+        # Older bills are downloaded with this session, wait for them before logout
+        if self.backfill is not None:
+            self.backfill.finish()
+
+        # Keep session for next run, or logout
+        self.step = 'logout'
+        if not self.sessions.save(self.driver, key, home_url):
+            self.run(recipe.logout, account)
+        self.metrics.end_account(self.driver, recipe.name, account.alias)
+        self.calendar.checked(key)
+
+    def location_storage(self, key: str, position: int, location: Optional[str]) -> Storage:
+        """
+        Return storage of location, by its id, or by its position when it has no id
+        Storage of location kept by position, by older version, is moved to its id first time it is seen
+        """
+        if location is None:
+            return Storage(f'{key}_{position}')
+        infix = f'{key}_{location}'
+        self.calendar.store.move_infix(f'{key}_{position}', infix)
+        return Storage(infix)
+
+    def check_bills(self, account: Account, storage: Storage, name: str, leave: bool = True) -> None:
+        """
+        Read bill list, download last bill if it is new, then leave bill list
+        Location opened by its route is left by navigation to the next one, leave is False
+        """
+        recipe = self.recipe
+        rows = self.read_bills()
+        self.metrics.step(self.driver, recipe.name, account.alias, 'table_read')
+        last_bill = rows[0]
+        period = last_bill['period'].strip()
+
+        # Backfill: start download of every older bill missing from archive
+        if self.backfill is not None:
+            self.backfill_bills(storage, rows[1:])
+            if recipe.open_bill:
+                # Viewer may draw bill list again
+                last_bill = self.read_bills()[0]
+
+        # Anything new?
+        if period != storage.last_saved:
+            self.step = 'download'
+            self.run(recipe.open_bill, account, last_bill['row'])
+            archived_pdf = self.download(storage, last_bill)
+            self.metrics.step(self.driver, recipe.name, account.alias, 'download')
+            self.step = 'table_read'
+            # Remember new last_saved, with archived PDF, in var/state.sqlite3
+            if storage.save(period, archived_pdf):
+                # Add notification, copy of archived bill is not a new bill
+                self.notifications.add(f'{recipe.label} ({name}) za {period.lower()}')
+            if leave:
+                self.run(recipe.close_bill, account)
+                self.run(recipe.leave_location, account)
+                if recipe.pause:
+                    time.sleep(recipe.pause)
+        elif leave:
+            self.run(recipe.leave_location, account)
+
+    def read_locations(self, count: int = 0) -> List[Dict[str, Any]]:
+        """
+        Wait for location list, with at least count rows, and read all rows in one call
+        Every row has click target, and route if recipe knows where it is
+        """
+        locations = self.recipe.locations
+        assert locations is not None and self.recipe.location_rows is not None
+        find_all_by_css(self.driver, locations['rows'], ready=locations['ready'], count=count,
+                        timeout=self.config.step_timeout(locations.get('timeout', 'locations')))
+        return extract(self.driver, self.recipe.location_rows)['rows']
+
+    def read_bills(self) -> List[Dict[str, Any]]:
+        """
+        Wait for bill list and read all rows in one call, newest first, without header rows
+        Raise ScraperError if there is no bill
+        """
+        recipe = self.recipe
+        find_first_by_css(self.driver, recipe.bills_ready, recipe.bills_condition,
+                          timeout=self.config.step_timeout(recipe.bills_timeout))
+        rows = [row for row in extract(self.driver, recipe.bill_rows)['rows'][recipe.header_rows:] if row['period']]
+        if not rows:
+            raise ScraperError("Can't find table with invoices")
+        return rows
+
+    def backfill_bills(self, storage: Storage, rows: List[Dict[str, Any]]) -> None:
+        """
+        Start download of every older bill missing from archive
+        Bill without PDF address in its row is opened in viewer, bill list is read again after every bill
+        """
+        assert self.backfill is not None
+        if not self.recipe.open_bill:
+            self.backfill.queue_missing(storage, {row['period'].strip(): row.get('pdf_url') for row in rows},
+                                        self.driver.get_cookies())
+            return
+        for period in self.backfill.missing(storage, [row['period'].strip() for row in rows]):
+            row = next((row for row in self.read_bills() if row['period'].strip() == period), None)
+            if row is None:
+                continue
+            self.run(self.recipe.open_bill, None, row['row'])
+            self.backfill.queue_missing(storage, {period: pdf_url(self.driver, self.recipe.viewer['pdf_link'])},
+                                        self.driver.get_cookies())
+            self.run(self.recipe.close_bill, None)
+
+    def download(self, storage: Storage, bill: Dict[str, Any]) -> Path:
+        """
+        Stream PDF straight to pdf folder, with browser cookies, as soon as its address is known
+        Fall back to browser download, into download folder of this account, and move it to pdf folder
+        Return archived PDF file
+        """
+        viewer = self.recipe.viewer
+        archived_pdf = None
+        if self.config.direct_download:
+            url = pdf_url(self.driver, viewer['pdf_link']) if 'pdf_link' in viewer else bill.get('pdf_url')
+            archived_pdf = download_direct(self.driver, http_session(self.config), url, storage.pdf_path,
+                                           self.config.step_timeout('download'))
+        if archived_pdf is None:
+            if 'rendered' in viewer:
+                # Wait until viewer shows the bill
+                find_first_by_css(self.driver, viewer['rendered'], timeout=self.config.step_timeout('pdf'))
+            if 'save_button' in viewer:
+                save_button = find_first_by_css(self.driver, viewer['save_button'], 'clickable',
+                                                timeout=self.config.step_timeout('download'))
+            else:
+                save_button = bill['save_button']
+            pdf_file = download_file(self.driver, save_button, storage.download_dir,
+                                     self.config.step_timeout('download'))
+            archived_pdf = storage.archive_pdf(pdf_file)
+        return archived_pdf
+
+    def run(self, steps: List[Step], account: Optional[Account], row: Any = None) -> None:
+        """
+        Run recipe steps, every wait has budget of its step, or default timeout
+        """
+        for step in steps:
+            timeout = self.config.step_timeout(step.timeout) if step.timeout else None
+            if step.action == 'row':
+                row.click()
+            elif step.action == 'remove':
+                remove_element_by_css(self.driver, step.target)
+            elif step.action == 'type':
+                assert account is not None and step.value is not None
+                find_first_by_css(self.driver, step.target, step.condition, timeout).send_keys(
+                    getattr(account, step.value))
+            elif step.action == 'click':
+                find_first_by_css(self.driver, step.target, step.condition, timeout).click()
+            else:
+                find_first_by_css(self.driver, step.target, step.condition, timeout)
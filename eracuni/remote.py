@@ -0,0 +1,151 @@
+"""
+Remote module, browsers on other machines, Selenium Grid or geckodriver servers
+
+With remote_webdrivers in config, browsers are started on remote WebDriver endpoints instead of local geckodriver,
+so scheduler host needs neither CPU nor memory for Firefox.
+Every endpoint is checked with GET /status before session is started there. Endpoint that does not answer,
+or is not ready, is skipped. Of the rest, the one with most free slots is used first.
+Selenium Grid reports slots of all its nodes, geckodriver server has one slot, free while it is ready.
+Browser downloads stay on remote node, they are fetched back with Selenium Grid managed downloads
+(se:downloadsEnabled). Direct download of PDF (direct_download) works with any endpoint.
+"""
+
+
+import io
+import time
+import base64
+import zipfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+
+
+class RemoteError(Exception):
+    """
+    No remote endpoint can be used, or remote download failed
+    """
+
+
+def free_slots(status: Dict[str, Any]) -> Optional[int]:
+    """
+    Return number of free browser slots from /status answer, None if endpoint is not ready
+    """
+    value = status.get('value') or {}
+    if not value.get('ready'):
+        return None
+    nodes = value.get('nodes')
+    if nodes is None:
+        # geckodriver, or Grid without node details
+        return 1
+    return sum(1 for node in nodes if node.get('availability', 'UP') == 'UP'
+               for slot in node.get('slots', []) if not slot.get('session'))
+
+
+class EndpointPool:
+    """
+    Remote WebDriver endpoints of this process, with number of sessions started on each
+    """
+    def __init__(self, urls: List[str], timeout: float = 3) -> None:
+        self.urls = [url.rstrip('/') for url in urls]
+        self.timeout = timeout
+        self.in_use: Dict[str, int] = {url: 0 for url in self.urls}
+        self.lock = threading.Lock()
+
+    def check(self, url: str) -> Optional[int]:
+        """
+        Return free slots of endpoint, None if it does not answer or is not ready
+        """
+        try:
+            response = requests.get(f'{url}/status', timeout=self.timeout)
+            return free_slots(response.json())
+        except (requests.RequestException, ValueError):
+            return None
+
+    def candidates(self) -> List[str]:
+        """
+        Return healthy endpoints, least loaded first
+        Raise RemoteError if none of them is ready
+        """
+        slots: List[Tuple[int, int, int, str]] = []
+        for order, url in enumerate(self.urls):
+            free = self.check(url)
+            if free is not None:
+                with self.lock:
+                    slots.append((-free, self.in_use[url], order, url))
+        if not slots:
+            raise RemoteError(f"None of remote WebDriver endpoints is ready: {', '.join(self.urls)}")
+        return [url for *_, url in sorted(slots)]
+
+    def acquire(self, url: str) -> None:
+        with self.lock:
+            self.in_use[url] += 1
+
+    def release(self, url: str) -> None:
+        with self.lock:
+            self.in_use[url] = max(self.in_use[url] - 1, 0)
+
+
+_pools: Dict[Tuple[str, ...], EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def endpoint_pool(urls: List[str], timeout: float = 3) -> EndpointPool:
+    """
+    Return shared EndpointPool of these endpoints, so every worker sees sessions of others
+    """
+    with _pools_lock:
+        key = tuple(urls)
+        if key not in _pools:
+            _pools[key] = EndpointPool(urls, timeout)
+        return _pools[key]
+
+
+class RemoteFiles:
+    """
+    Files downloaded by remote browser session, Selenium Grid managed downloads
+    """
+    def __init__(self, endpoint: str, session_id: str, timeout: float = 30) -> None:
+        self.url = f'{endpoint}/session/{session_id}/se/files'
+        self.timeout = timeout
+
+    def names(self) -> List[str]:
+        try:
+            response = requests.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise RemoteError(f"Remote node can't list downloads, is it Selenium Grid with downloads enabled? {e}")
+        return response.json()['value'].get('names', [])
+
+    def fetch(self, name: str, directory: str) -> Path:
+        """
+        Copy downloaded file from remote node to directory, return its local path
+        """
+        try:
+            response = requests.post(self.url, json={'name': name}, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise RemoteError(f"Can't fetch {name} from remote node: {e}")
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(response.json()['value']['contents']))) as archive:
+            content = archive.read(archive.namelist()[0])
+        path = Path(directory) / Path(name).name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(path.name + '.part')
+        part.write_bytes(content)
+        part.replace(path)
+        return path
+
+    def wait(self, known: List[str], timeout: float) -> str:
+        """
+        Wait for file that is not in known files, and is not partial download, nor has .part companion
+        Return its name, raise RemoteError after timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            names = self.names()
+            new = [name for name in names if name not in known and not name.endswith('.part')
+                   and name + '.part' not in names]
+            if new:
+                return new[0]
+            time.sleep(0.5)
+        raise RemoteError(f'Remote download not finished in {timeout} seconds')
@@ -0,0 +1,104 @@
+"""
+Sessions module, keep logged in browser sessions between runs
+
+Cookies and local storage of every account are saved encrypted in var/state.sqlite3, instead of logout.
+Next run restores them and checks if portal still accepts the session, full login is done only if it does not.
+Encryption needs cryptography package, without it session cache is disabled.
+"""
+
+
+import os
+import sys
+import json
+from typing import Optional
+from eracuni.data import Config
+from eracuni.state import state_store
+from eracuni.browser import webdriver, get_session_state, set_session_state, clear_session_state, \
+    is_present_by_css
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken  # type: ignore
+except ImportError:
+    Fernet = None
+
+
+KEY_PATH = 'var/session.key'
+
+
+def session_key(config: Config) -> bytes:
+    """
+    Return encryption key from config, or from var/session.key, created on first use
+    """
+    if config.session_key:
+        return config.session_key.encode()
+    if not os.path.isfile(KEY_PATH):
+        os.makedirs(os.path.dirname(KEY_PATH), exist_ok=True)
+        fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(Fernet.generate_key())
+    with open(KEY_PATH, 'rb') as fin:
+        return fin.read().strip()
+
+
+class SessionCache:
+    """
+    Save and restore browser sessions per account, counting hits and misses in state store
+    Does nothing if session_cache is disabled in config, or cryptography is not installed
+    """
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.enabled = config.session_cache
+        self.fernet: Optional[Fernet] = None
+        if self.enabled and Fernet is None:
+            print('Session cache needs cryptography package, sessions are not saved', file=sys.stderr)
+            self.enabled = False
+        if self.enabled:
+            self.fernet = Fernet(session_key(config))
+        self.store = state_store()
+
+    def restore(self, browser: webdriver, key: str, url: str, logged_in_css: str) -> bool:
+        """
+        Restore saved session of key and open page where it was saved
+        Return True if page shows logged_in_css element
+        Otherwise open url and clear session left on its site by previous account, for full login,
+        so with enabled session cache caller never loads url itself
+        Miss is counted only when saved session was tried
+        """
+        if not self.enabled:
+            return False
+        blob = self.store.load_session(key)
+        state = None
+        if blob is not None:
+            try:
+                state = json.loads(self.fernet.decrypt(blob))
+            except (InvalidToken, ValueError):
+                state = None
+                self.store.count_session(key, hit=False)
+
+        if state is not None:
+            # Cookies and local storage can be set only on a page of the same site
+            browser.get(state['url'])
+            set_session_state(browser, state)
+            browser.get(state['url'])
+            if is_present_by_css(browser, logged_in_css, self.config.session_check_timeout):
+                self.store.count_session(key, hit=True)
+                return True
+            self.store.count_session(key, hit=False)
+
+        # Session is missing or rejected
+        browser.get(url)
+        clear_session_state(browser)
+        return False
+
+    def save(self, browser: webdriver, key: str, url: Optional[str] = None) -> bool:
+        """
+        Save session for next run, next run will open url, or current page if url is None
+        Return False if session cache is disabled, so caller should logout
+        """
+        if not self.enabled:
+            return False
+        state = get_session_state(browser)
+        if url is not None:
+            state['url'] = url
+        self.store.save_session(key, self.fernet.encrypt(json.dumps(state).encode('utf8')))
+        return True
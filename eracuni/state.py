@@ -0,0 +1,441 @@
+"""
+State module, SQLite store for every downloaded bill
+
+One var/state.sqlite3 database replaces per-account var/storage_{infix}.yaml files.
+Every seen period is recorded with download time, PDF path, size and SHA-256 hash.
+Period found by another host of shared queue is recorded as remote, without PDF.
+Notifications wait in outbox table until they are delivered.
+Last account check, and last skip with its reason, is kept in checks table.
+Metadata read from archived PDF files is kept in archive table, by content hash.
+Old YAML files are imported once, on first open, and renamed to storage_{infix}.yaml.migrated
+"""
+
+
+import os
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import yaml
+
+
+STATE_PATH = 'var/state.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY,
+    infix TEXT NOT NULL,
+    period TEXT NOT NULL,
+    downloaded_at TEXT NOT NULL,
+    pdf_path TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    backfilled INTEGER NOT NULL DEFAULT 0,
+    remote INTEGER NOT NULL DEFAULT 0,
+    first_seen_at TEXT,
+    UNIQUE (infix, period)
+);
+CREATE INDEX IF NOT EXISTS bills_sha256 ON bills (sha256);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    blob BLOB NOT NULL,
+    saved_at TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (channel, sent_at);
+CREATE TABLE IF NOT EXISTS checks (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    checked_at TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS checks_key ON checks (key, outcome, checked_at);
+CREATE TABLE IF NOT EXISTS archive (
+    sha256 TEXT PRIMARY KEY,
+    infix TEXT,
+    period TEXT,
+    amount REAL,
+    due_date TEXT,
+    reference TEXT,
+    indexed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive_files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE VIEW IF NOT EXISTS last_saved AS
+    SELECT infix, period FROM bills AS b
+    WHERE id = (SELECT id FROM bills WHERE infix = b.infix AND backfilled = 0
+                ORDER BY downloaded_at DESC, id DESC LIMIT 1);
+"""
+
+# Columns added to existing databases, with views to create again after that
+COLUMNS = [
+    ('bills', 'backfilled', 'INTEGER NOT NULL DEFAULT 0', ['last_saved']),
+    ('bills', 'remote', 'INTEGER NOT NULL DEFAULT 0', []),
+    ('bills', 'first_seen_at', 'TEXT', []),
+]
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Return SHA-256 of file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Bill:
+    """
+    One row of bills table, first_seen_at is time of first record, download time if it is not known
+    """
+    def __init__(self, infix: str, period: str, downloaded_at: str, pdf_path: Optional[str],
+                 size: Optional[int], sha256: Optional[str], backfilled: int = 0, remote: int = 0,
+                 first_seen_at: Optional[str] = None) -> None:
+        self.infix = infix
+        self.period = period
+        self.downloaded_at = downloaded_at
+        self.first_seen_at = first_seen_at or downloaded_at
+        self.pdf_path = pdf_path
+        self.size = size
+        self.sha256 = sha256
+        self.backfilled = bool(backfilled)
+        self.remote = bool(remote)
+
+
+class ArchivedBill:
+    """
+    One row of archive table, metadata read from PDF file
+    """
+    def __init__(self, sha256: str, infix: Optional[str], period: Optional[str], amount: Optional[float],
+                 due_date: Optional[str], reference: Optional[str], path: Optional[str] = None) -> None:
+        self.sha256 = sha256
+        self.infix = infix
+        self.period = period
+        self.amount = amount
+        self.due_date = due_date
+        self.reference = reference
+        self.path = path
+
+
+class StateStore:
+    """
+    SQLite database in WAL mode, one connection per thread
+    Every write is one short transaction, not one per account: transaction open while account is checked
+    would hold write lock for minutes, and writes of other workers would time out.
+    Account has only a few writes, with synchronous=NORMAL their commits are not synced to disk
+    """
+    _local = threading.local()
+    _lock = threading.Lock()
+
+    def __init__(self, path: str = STATE_PATH) -> None:
+        self.path = os.path.abspath(path)
+        with self._lock:
+            self.migrate_yaml()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connections: Dict[str, sqlite3.Connection] = self._local.__dict__.setdefault('connections', {})
+        if self.path not in connections:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self.migrate_columns(connection)
+            connections[self.path] = connection
+        return connections[self.path]
+
+    @staticmethod
+    def migrate_columns(connection: sqlite3.Connection) -> None:
+        """
+        Add new columns to database made by older version, and create views that use them again
+        """
+        for table, column, definition, views in COLUMNS:
+            columns = [row[1] for row in connection.execute(f'PRAGMA table_info({table})')]
+            if column in columns:
+                continue
+            with connection:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                for view in views:
+                    connection.execute(f'DROP VIEW IF EXISTS {view}')
+            connection.executescript(SCHEMA)
+
+    def migrate_yaml(self) -> None:
+        """
+        Import last_saved from every var/storage_{infix}.yaml file, only once
+        """
+        with self.connection as connection:
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'yaml_migrated'").fetchone():
+                return
+            yaml_files = sorted(Path(os.path.dirname(self.path)).glob('storage_*.yaml'))
+            for yaml_path in yaml_files:
+                with open(yaml_path, encoding='utf8') as fin:
+                    my_storage = yaml.full_load(fin) or {}
+                if 'last_saved' not in my_storage:
+                    continue
+                infix = yaml_path.stem[len('storage_'):]
+                downloaded_at = datetime.fromtimestamp(yaml_path.stat().st_mtime).isoformat(timespec='seconds')
+                connection.execute('INSERT OR IGNORE INTO bills (infix, period, downloaded_at) VALUES (?, ?, ?)',
+                                   (infix, str(my_storage['last_saved']).strip(), downloaded_at))
+            connection.execute("INSERT INTO meta (key, value) VALUES ('yaml_migrated', ?)",
+                               (datetime.now().isoformat(timespec='seconds'),))
+        for yaml_path in yaml_files:
+            yaml_path.rename(yaml_path.with_name(yaml_path.name + '.migrated'))
+
+    def last_saved(self, infix: str) -> Optional[str]:
+        row = self.connection.execute('SELECT period FROM last_saved WHERE infix = ?', (infix,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, infix: str, period: str, pdf_path: Optional[Path] = None, backfilled: bool = False,
+               sha256: Optional[str] = None, remote: bool = False) -> None:
+        """
+        Record seen period, with size and hash of saved PDF file, hash is computed if not given
+        Period seen again is moved to the top, with new download time, but keeps time it was first seen
+        Backfilled period is older bill, it never becomes last_saved and keeps download time of first record
+        Remote period was downloaded by another host, it is last_saved here too, but stays remote
+        only until this host downloads it itself. Period this host already has is not touched by remote record
+        """
+        size = None
+        if pdf_path is not None:
+            size, sha256 = pdf_path.stat().st_size, sha256 or file_sha256(pdf_path)
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            if backfilled:
+                connection.execute(
+                    'INSERT INTO bills (infix, period, downloaded_at, pdf_path, size, sha256, backfilled, '
+                    'first_seen_at) VALUES (?, ?, ?, ?, ?, ?, 1, ?) ON CONFLICT (infix, period) DO UPDATE SET '
+                    'pdf_path = COALESCE(excluded.pdf_path, pdf_path), size = COALESCE(excluded.size, size), '
+                    'sha256 = COALESCE(excluded.sha256, sha256)',
+                    (infix, period, now, str(pdf_path) if pdf_path is not None else None, size, sha256, now))
+                return
+            if remote:
+                connection.execute('INSERT INTO bills (infix, period, downloaded_at, remote, first_seen_at) '
+                                   'VALUES (?, ?, ?, 1, ?) ON CONFLICT (infix, period) DO NOTHING',
+                                   (infix, period, now, now))
+                return
+            connection.execute(
+                'INSERT INTO bills (infix, period, downloaded_at, pdf_path, size, sha256, remote, first_seen_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (infix, period) DO UPDATE SET downloaded_at = excluded.downloaded_at, '
+                'first_seen_at = COALESCE(first_seen_at, downloaded_at), '
+                'pdf_path = COALESCE(excluded.pdf_path, pdf_path), size = COALESCE(excluded.size, size), '
+                'sha256 = COALESCE(excluded.sha256, sha256), backfilled = 0, remote = MIN(remote, excluded.remote)',
+                (infix, period, now, str(pdf_path) if pdf_path is not None else None, size, sha256, int(remote), now))
+
+    def move_infix(self, old: str, new: str) -> None:
+        """
+        Give bills of old infix to new one, only if new one has none, like location storage moved from position to id
+        """
+        if old == new:
+            return
+        with self.connection as connection:
+            if connection.execute('SELECT 1 FROM bills WHERE infix = ?', (new,)).fetchone() is None:
+                connection.execute('UPDATE bills SET infix = ? WHERE infix = ?', (new, old))
+
+    def history(self, infix: str) -> List[Bill]:
+        """
+        Return every recorded bill of infix, oldest first
+        """
+        rows = self.connection.execute(
+            'SELECT infix, period, downloaded_at, pdf_path, size, sha256, backfilled, remote, first_seen_at FROM bills '
+            'WHERE infix = ? ORDER BY downloaded_at, id', (infix,)).fetchall()
+        return [Bill(*row) for row in rows]
+
+    def periods(self, infix: str) -> Set[str]:
+        """
+        Return every recorded period of infix, downloaded or backfilled
+        """
+        rows = self.connection.execute('SELECT period FROM bills WHERE infix = ?', (infix,)).fetchall()
+        return {row[0] for row in rows}
+
+    def infixes(self, prefix: str) -> List[str]:
+        """
+        Return every infix that starts with prefix, like all locations of InfoStan account
+        """
+        rows = self.connection.execute("SELECT DISTINCT infix FROM bills WHERE substr(infix, 1, ?) = ? ORDER BY infix",
+                                       (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def bill_by_hash(self, sha256: str) -> Optional[Bill]:
+        """
+        Return recorded bill with PDF file of this content, None if file was not downloaded by scraper
+        """
+        row = self.connection.execute(
+            'SELECT infix, period, downloaded_at, pdf_path, size, sha256, backfilled, remote, first_seen_at FROM bills '
+            'WHERE sha256 = ? ORDER BY id LIMIT 1', (sha256,)).fetchone()
+        return Bill(*row) if row else None
+
+    def archived_path(self, sha256: str, exclude: Optional[Path] = None) -> Optional[Path]:
+        """
+        Return path of archived PDF file with this content, other than exclude, None if there is no such file
+        """
+        rows = self.connection.execute('SELECT DISTINCT pdf_path FROM bills WHERE sha256 = ? AND pdf_path IS NOT NULL '
+                                       'ORDER BY id', (sha256,)).fetchall()
+        for row in rows:
+            path = Path(row[0])
+            if path.is_file() and (exclude is None or path != exclude):
+                return path
+        return None
+
+    def move_pdf_path(self, old_path: Path, new_path: Path) -> None:
+        """
+        Point bills with old PDF file to new one, when old file is removed as duplicate
+        """
+        with self.connection as connection:
+            connection.execute('UPDATE bills SET pdf_path = ? WHERE pdf_path = ?', (str(new_path), str(old_path)))
+
+    def archive_files(self) -> Dict[str, Tuple[float, int, str]]:
+        """
+        Return modification time, size and hash of every indexed file, by path
+        """
+        rows = self.connection.execute('SELECT path, mtime, size, sha256 FROM archive_files').fetchall()
+        return {path: (mtime, size, sha256) for path, mtime, size, sha256 in rows}
+
+    def is_archived(self, sha256: str) -> bool:
+        return self.connection.execute('SELECT 1 FROM archive WHERE sha256 = ?', (sha256,)).fetchone() is not None
+
+    def record_archive(self, path: str, mtime: float, size: int, sha256: str,
+                       bill: Optional[ArchivedBill] = None) -> None:
+        """
+        Record indexed file, with metadata of its content if it was read now
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            if bill is not None:
+                connection.execute(
+                    'INSERT OR REPLACE INTO archive (sha256, infix, period, amount, due_date, reference, indexed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (sha256, bill.infix, bill.period, bill.amount, bill.due_date, bill.reference, now))
+            connection.execute('INSERT OR REPLACE INTO archive_files (path, mtime, size, sha256) VALUES (?, ?, ?, ?)',
+                               (path, mtime, size, sha256))
+
+    def forget_archive_files(self, paths: List[str]) -> None:
+        """
+        Forget files removed from archive, metadata of their content is kept
+        """
+        with self.connection as connection:
+            connection.executemany('DELETE FROM archive_files WHERE path = ?', [(path,) for path in paths])
+
+    def archived_bills(self) -> List[ArchivedBill]:
+        """
+        Return metadata of every indexed file, with one of its paths, ordered by period
+        """
+        rows = self.connection.execute(
+            'SELECT a.sha256, a.infix, a.period, a.amount, a.due_date, a.reference, MIN(f.path) '
+            'FROM archive AS a JOIN archive_files AS f ON f.sha256 = a.sha256 '
+            'GROUP BY a.sha256 ORDER BY a.period, a.infix').fetchall()
+        return [ArchivedBill(*row) for row in rows]
+
+    def record_check(self, key: str, outcome: str, reason: str = '') -> None:
+        """
+        Record account check, outcome is checked or skipped
+        Only last record of every outcome is kept, daemon would otherwise add a skip every few minutes
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            connection.execute('DELETE FROM checks WHERE key = ? AND outcome = ?', (key, outcome))
+            connection.execute('INSERT INTO checks (key, checked_at, outcome, reason) VALUES (?, ?, ?, ?)',
+                               (key, now, outcome, reason))
+
+    def last_check(self, key: str) -> Optional[str]:
+        """
+        Return time of last full check of account, None if it was never checked
+        """
+        row = self.connection.execute("SELECT MAX(checked_at) FROM checks WHERE key = ? AND outcome = 'checked'",
+                                      (key,)).fetchone()
+        return row[0] if row else None
+
+    def load_session(self, key: str) -> Optional[bytes]:
+        row = self.connection.execute('SELECT blob FROM sessions WHERE key = ?', (key,)).fetchone()
+        return row[0] if row and row[0] else None
+
+    def save_session(self, key: str, blob: bytes) -> None:
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            connection.execute('INSERT INTO sessions (key, blob, saved_at) VALUES (?, ?, ?) '
+                               'ON CONFLICT (key) DO UPDATE SET blob = excluded.blob, saved_at = excluded.saved_at',
+                               (key, blob, now))
+
+    def count_session(self, key: str, hit: bool) -> None:
+        """
+        Count restored (hit) or rejected and missing (miss) session, rejected session is forgotten
+        """
+        with self.connection as connection:
+            connection.execute("INSERT OR IGNORE INTO sessions (key, blob, saved_at) VALUES (?, x'', '')", (key,))
+            if hit:
+                connection.execute('UPDATE sessions SET hits = hits + 1 WHERE key = ?', (key,))
+            else:
+                connection.execute("UPDATE sessions SET misses = misses + 1, blob = x'' WHERE key = ?", (key,))
+
+    def session_counts(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Return hits and misses for every session key
+        """
+        rows = self.connection.execute('SELECT key, hits, misses FROM sessions ORDER BY key').fetchall()
+        return {key: (hits, misses) for key, hits, misses in rows}
+
+    def queue_message(self, channel: str, body: str) -> int:
+        """
+        Put message for channel in outbox, return its id
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            cursor = connection.execute('INSERT INTO outbox (channel, body, created_at) VALUES (?, ?, ?)',
+                                        (channel, body, now))
+        return cursor.lastrowid
+
+    def pending_messages(self, channel: str) -> List[Tuple[int, str]]:
+        """
+        Return id and body of every undelivered message for channel, oldest first
+        """
+        return self.connection.execute('SELECT id, body FROM outbox WHERE channel = ? AND sent_at IS NULL '
+                                       'ORDER BY id', (channel,)).fetchall()
+
+    def mark_sent(self, message_id: int) -> None:
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.connection as connection:
+            connection.execute('UPDATE outbox SET sent_at = ?, attempts = attempts + 1 WHERE id = ?',
+                               (now, message_id))
+
+    def mark_failed(self, message_id: int, attempts: int, error: str) -> None:
+        with self.connection as connection:
+            connection.execute('UPDATE outbox SET attempts = attempts + ?, last_error = ? WHERE id = ?',
+                               (attempts, error, message_id))
+
+
+_stores: Dict[str, StateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def state_store(path: str = STATE_PATH) -> StateStore:
+    """
+    Return shared StateStore for path, YAML files are migrated when it is opened first time
+    """
+    with _stores_lock:
+        key = os.path.abspath(path)
+        if key not in _stores:
+            _stores[key] = StateStore(path)
+        return _stores[key]
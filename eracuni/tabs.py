@@ -0,0 +1,238 @@
+"""
+Tabs module, many accounts at once in one Firefox
+
+Every account gets its own tab, in its own container, so cookies of accounts are kept apart.
+Tabs are used from worker threads. Every WebDriver command takes the browser lock and switches to
+window of its tab first, so while one tab waits for page load, commands of other tabs run.
+Navigation does not wait for page load, Tab.get() waits for new document without holding the lock.
+"""
+
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional, Tuple
+from selenium.common.exceptions import TimeoutException, WebDriverException  # type: ignore
+from selenium.webdriver.remote.webelement import WebElement  # type: ignore
+from eracuni.data import Config
+from eracuni.browser import LazyBrowser, process_tree_rss
+from eracuni.tracing import tracer
+
+
+# Open tab in new container, with its own cookies and local storage
+NEW_TAB_SCRIPT = """
+var identity = ContextualIdentityService.create('eracuni ' + arguments[0], 'fingerprint', 'blue');
+gBrowser.addTab('about:blank', {
+    userContextId: identity.userContextId,
+    triggeringPrincipal: Services.scriptSecurityManager.getSystemPrincipal()
+});
+return identity.userContextId;
+"""
+
+# Forget container of closed tab, with its cookies
+REMOVE_CONTAINER_SCRIPT = 'ContextualIdentityService.remove(arguments[0]);'
+
+# Mark current document, new document after navigation has no mark
+MARK_SCRIPT = 'window.eracuniOldPage = true;'
+LOADED_SCRIPT = "return !window.eracuniOldPage && document.readyState !== 'loading';"
+
+
+class TabBrowser:
+    """
+    Firefox shared by tabs, started on first use
+    First window stays open, so closing last account tab does not end browser session
+    """
+    def __init__(self, config: Config, download_dir: str = 'var') -> None:
+        self.config = config
+        self.browser = LazyBrowser(config, download_dir, tabs=True)
+        self.lock = threading.RLock()
+        self.download_lock = threading.Lock()
+        self.current: Optional[str] = None
+        self.containers = 0
+        # Incremented when browser quits, tabs of old browser open new ones
+        self.generation = 0
+
+    @property
+    def started(self) -> bool:
+        return self.browser.started
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.browser.pid
+
+    def open_tab(self, download_dir: str = 'var') -> 'Tab':
+        return Tab(self, download_dir)
+
+    @contextmanager
+    def focus(self, handle: str) -> Iterator[None]:
+        """
+        Hold browser for one command of tab, switch to tab window if other tab was used last
+        """
+        with self.lock:
+            if self.current != handle:
+                self.browser.switch_to.window(handle)
+                self.current = handle
+            yield
+
+    def new_tab(self) -> Tuple[str, int]:
+        """
+        Open tab in new container, return its window handle and container id
+        """
+        with self.lock:
+            before = set(self.browser.window_handles)
+            self.containers += 1
+            with self.browser.context(self.browser.CONTEXT_CHROME):
+                container = self.browser.execute_script(NEW_TAB_SCRIPT, self.containers)
+            [handle] = [handle for handle in self.browser.window_handles if handle not in before]
+            return handle, container
+
+    def close_tab(self, handle: str, container: int, generation: int) -> None:
+        """
+        Close tab and forget its container, quit whole browser if it does not respond
+        """
+        with self.lock:
+            if generation != self.generation or not self.browser.started:
+                return
+            try:
+                with self.focus(handle):
+                    self.browser.close()
+                self.current = None
+                with self.browser.context(self.browser.CONTEXT_CHROME):
+                    self.browser.execute_script(REMOVE_CONTAINER_SCRIPT, container)
+            except WebDriverException:
+                self.quit()
+
+    def quit(self) -> None:
+        with self.lock:
+            self.browser.quit()
+            self.current = None
+            self.generation += 1
+
+
+class Tab:
+    """
+    Webdriver of one account, in its own tab of shared browser
+    quit() closes tab with its cookies, next command opens a fresh one
+    """
+    def __init__(self, tabs: TabBrowser, download_dir: str = 'var') -> None:
+        self.tabs = tabs
+        self.download_dir = download_dir
+        self.download_lock = tabs.download_lock
+        self.handle: Optional[str] = None
+        self.container = 0
+        self.generation = 0
+
+    @property
+    def commands(self) -> int:
+        return getattr(self.tabs.browser, 'commands', 0)
+
+    @property
+    def default_timeout(self) -> float:
+        return self.tabs.config.timeout
+
+    @contextmanager
+    def focus(self) -> Iterator[None]:
+        with self.tabs.lock:
+            if self.handle is None or self.generation != self.tabs.generation or not self.tabs.browser.started:
+                self.handle, self.container = self.tabs.new_tab()
+                self.generation = self.tabs.generation
+            with self.tabs.focus(self.handle):
+                yield
+
+    def __getattr__(self, name: str) -> Any:
+        with self.focus():
+            value = getattr(self.tabs.browser, name)
+        if not callable(value):
+            return wrap(self, value)
+
+        def command(*args: Any, **kwargs: Any) -> Any:
+            with self.focus():
+                return wrap(self, value(*unwrap(args), **unwrap(kwargs)))
+        return command
+
+    @contextmanager
+    def context(self, name: str) -> Iterator[None]:
+        """
+        Chrome context is setting of whole browser, other tabs wait until it is over
+        """
+        with self.focus():
+            with self.tabs.browser.context(name):
+                yield
+
+    def get(self, url: str) -> None:
+        """
+        Start navigation and wait for new document, other tabs run commands meanwhile
+        Raise TimeoutException if it does not load in timeout seconds, like driver.get with page load timeout
+        """
+        with self.focus():
+            self.tabs.browser.execute_script(MARK_SCRIPT)
+            self.tabs.browser.get(url)
+        deadline = time.monotonic() + self.tabs.config.timeout
+        while time.monotonic() < deadline:
+            with self.focus():
+                if self.tabs.browser.execute_script(LOADED_SCRIPT):
+                    return
+            time.sleep(0.1)
+        raise TimeoutException(f'Page {url} not loaded in {self.tabs.config.timeout} seconds')
+
+    def account_checked(self) -> None:
+        """
+        In low memory mode, sample memory of shared browser, it is not restarted while other tabs use it
+        """
+        if self.tabs.config.low_memory and self.tabs.started:
+            tracer.memory(process_tree_rss(self.tabs.pid))
+
+    def quit(self) -> None:
+        if self.handle is not None:
+            self.tabs.close_tab(self.handle, self.container, self.generation)
+            self.handle = None
+
+
+class TabElement:
+    """
+    Web element of tab, every command switches to its tab first
+    """
+    def __init__(self, tab: Tab, element: WebElement) -> None:
+        self.tab = tab
+        self.element = element
+
+    @property
+    def default_timeout(self) -> float:
+        return self.tab.default_timeout
+
+    def __getattr__(self, name: str) -> Any:
+        with self.tab.focus():
+            value = getattr(self.element, name)
+        if not callable(value):
+            return wrap(self.tab, value)
+
+        def command(*args: Any, **kwargs: Any) -> Any:
+            with self.tab.focus():
+                return wrap(self.tab, value(*unwrap(args), **unwrap(kwargs)))
+        return command
+
+
+def wrap(tab: Tab, value: Any) -> Any:
+    """
+    Return value of command, with every web element in it bound to tab
+    """
+    if isinstance(value, WebElement):
+        return TabElement(tab, value)
+    if isinstance(value, list):
+        return [wrap(tab, item) for item in value]
+    if isinstance(value, dict):
+        return {key: wrap(tab, item) for key, item in value.items()}
+    return value
+
+
+def unwrap(value: Any) -> Any:
+    """
+    Return arguments of command, with web elements of tab as plain web elements
+    """
+    if isinstance(value, TabElement):
+        return value.element
+    if isinstance(value, (list, tuple)):
+        return type(value)(unwrap(item) for item in value)
+    if isinstance(value, dict):
+        return {key: unwrap(item) for key, item in value.items()}
+    return value
@@ -0,0 +1,231 @@
+"""
+Tracing module, time named steps of a run, per provider and account
+
+Spans are written at the end of run as JSON report (var/run_report.json)
+and as Prometheus textfile collector file, for node exporter
+"""
+
+
+import os
+import json
+import time
+import platform
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class Span:
+    """
+    One timed step
+
+    Span:
+        name:       startup, profile_clone, browser_launch, page_load, login, table_read, download, logout,
+                    notification_send, or circuit_open for account skipped because its portal looks down
+        provider:   edb_domacinstva, edb_merna_grupa, infostan, or empty for run-wide steps
+        account:    account alias, or empty
+        start:      wall clock time, seconds since epoch
+        duration:   seconds
+        ok:         False if step ended with exception
+    """
+    def __init__(self, name: str, provider: str, account: str, start: float, duration: float, ok: bool) -> None:
+        self.name = name
+        self.provider = provider
+        self.account = account
+        self.start = start
+        self.duration = duration
+        self.ok = ok
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'provider': self.provider, 'account': self.account,
+                'start': datetime.fromtimestamp(self.start).isoformat(timespec='milliseconds'),
+                'duration': round(self.duration, 4), 'ok': self.ok}
+
+
+class Tracer:
+    """
+    Collect spans from all threads of a run
+
+    Use span() context manager around one step, or mark() for sequential steps of an account:
+    every mark() closes span from previous mark() or start() of the same provider and account,
+    fail() closes it as failed step
+    In low memory mode, browser memory after every account is added with memory()
+    """
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+        self._marks: Dict[Tuple[str, str], float] = {}
+        self.rss: List[int] = []
+        self.restarts = 0
+
+    def reset(self) -> None:
+        """
+        Forget all spans and start new run, for daemon mode where every check is one run
+        """
+        with self.lock:
+            self.started = time.time()
+            self.spans = []
+            self._marks = {}
+            self.rss = []
+            self.restarts = 0
+
+    def add(self, name: str, provider: str, account: str, start: float, duration: float, ok: bool = True) -> None:
+        with self.lock:
+            self.spans.append(Span(name, provider, account, start, duration, ok))
+
+    @contextmanager
+    def span(self, name: str, provider: str = '', account: str = '') -> Iterator[None]:
+        start = time.time()
+        counter = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.add(name, provider, account, start, time.perf_counter() - counter, ok)
+
+    def start(self, provider: str, account: str) -> None:
+        with self.lock:
+            self._marks[(provider, account)] = time.time()
+
+    def mark(self, provider: str, account: str, name: str) -> None:
+        now = time.time()
+        with self.lock:
+            start = self._marks.get((provider, account), now)
+            self._marks[(provider, account)] = now
+        self.add(name, provider, account, start, now - start)
+
+    def fail(self, provider: str, account: str, name: str) -> None:
+        """
+        Close span from previous mark() or start() as failed step, when check of account fails in it
+        """
+        now = time.time()
+        with self.lock:
+            start = self._marks.pop((provider, account), now)
+        self.add(name, provider, account, start, now - start, ok=False)
+
+    def memory(self, rss: int, restarted: bool = False) -> None:
+        """
+        Add sample of browser memory, in MB, and if browser was restarted because of it
+        """
+        with self.lock:
+            self.rss.append(rss)
+            self.restarts += restarted
+
+    def memory_report(self) -> Optional[Dict[str, Any]]:
+        """
+        Return peak and average browser memory of run, None if memory was not sampled
+        """
+        with self.lock:
+            rss, restarts = list(self.rss), self.restarts
+        if not rss:
+            return None
+        return {'samples': len(rss), 'peak_rss_mb': max(rss), 'average_rss_mb': round(sum(rss) / len(rss)),
+                'browser_restarts': restarts}
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            spans = list(self.spans)
+        report = {
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            # Runs on PC (x86_64) and Raspberry Pi (armv7l) are told apart
+            'machine': platform.machine(),
+            'duration': round(time.time() - self.started, 4),
+            'spans': [span.as_dict() for span in spans],
+        }
+        memory = self.memory_report()
+        if memory is not None:
+            report['memory'] = memory
+        return report
+
+    def write_json(self, path: str) -> None:
+        write_atomic(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Write textfile collector file, with duration sum and count of every step, per provider and account
+        Percentiles across runs come from Prometheus, like quantile_over_time(0.95, ...)
+        """
+        with self.lock:
+            spans = list(self.spans)
+        steps: Dict[Tuple[str, str, str], List[float]] = {}
+        providers: Dict[str, float] = {}
+        errors: Dict[Tuple[str, str, str], int] = {}
+        for span in spans:
+            key = (span.provider, span.account, span.name)
+            steps.setdefault(key, []).append(span.duration)
+            if not span.ok:
+                errors[key] = errors.get(key, 0) + 1
+            if span.provider and span.name != 'page_load':
+                providers[span.provider] = providers.get(span.provider, 0.0) + span.duration
+
+        def labels(provider: str, account: str = '', step: str = '') -> str:
+            pairs = [('provider', provider), ('account', account), ('step', step)]
+            return ','.join(f'{name}="{escape(value)}"' for name, value in pairs if value or name == 'provider')
+
+        lines = [
+            '# HELP eracuni_step_duration_seconds Total duration of step in last run',
+            '# TYPE eracuni_step_duration_seconds gauge',
+        ]
+        lines += [f'eracuni_step_duration_seconds{{{labels(*key)}}} {sum(durations):.4f}'
+                  for key, durations in sorted(steps.items())]
+        lines += [
+            '# HELP eracuni_step_count Number of times step ran in last run',
+            '# TYPE eracuni_step_count gauge',
+        ]
+        lines += [f'eracuni_step_count{{{labels(*key)}}} {len(durations)}' for key, durations in sorted(steps.items())]
+        lines += [
+            '# HELP eracuni_step_errors Number of failed steps in last run',
+            '# TYPE eracuni_step_errors gauge',
+        ]
+        lines += [f'eracuni_step_errors{{{labels(*key)}}} {count}' for key, count in sorted(errors.items())]
+        lines += [
+            '# HELP eracuni_provider_duration_seconds Time spent on provider accounts in last run',
+            '# TYPE eracuni_provider_duration_seconds gauge',
+        ]
+        lines += [f'eracuni_provider_duration_seconds{{{labels(provider)}}} {duration:.4f}'
+                  for provider, duration in sorted(providers.items())]
+        lines += [
+            '# HELP eracuni_run_duration_seconds Duration of last run',
+            '# TYPE eracuni_run_duration_seconds gauge',
+            f'eracuni_run_duration_seconds {time.time() - self.started:.4f}',
+            '# HELP eracuni_run_timestamp_seconds Start of last run',
+            '# TYPE eracuni_run_timestamp_seconds gauge',
+            f'eracuni_run_timestamp_seconds {self.started:.0f}',
+        ]
+        memory = self.memory_report()
+        if memory is not None:
+            lines += [
+                '# HELP eracuni_browser_rss_peak_megabytes Peak browser memory after account in last run',
+                '# TYPE eracuni_browser_rss_peak_megabytes gauge',
+                f"eracuni_browser_rss_peak_megabytes {memory['peak_rss_mb']}",
+                '# HELP eracuni_browser_rss_average_megabytes Average browser memory after account in last run',
+                '# TYPE eracuni_browser_rss_average_megabytes gauge',
+                f"eracuni_browser_rss_average_megabytes {memory['average_rss_mb']}",
+                '# HELP eracuni_browser_restarts Browser restarts of low memory mode in last run',
+                '# TYPE eracuni_browser_restarts gauge',
+                f"eracuni_browser_restarts {memory['browser_restarts']}",
+            ]
+        write_atomic(path, '\n'.join(lines) + '\n')
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_atomic(path: str, text: str) -> None:
+    """
+    Write file through temporary file and rename, so readers never see half written file
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf8') as fout:
+        fout.write(text)
+    os.replace(temp_path, path)
+
+
+# Tracer of current run, shared by all modules and threads
+tracer = Tracer()
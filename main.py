@@ -10,40 +10,140 @@ Pronađi poslednje račune za:
 
 Ako nema novog računa, završi program.
 Ako ima, snimi račun u pdf folder i pošalji obaveštenje na eMail/Telegram.
-Zapamti koji je poslednji skinuti račun, u var/storage.yaml
-Ako je došlo do greške u parsiranju web stranice, ispiši problem na stderr i izađi sa statusnim kodom 1.
+Zapamti sve skinute račune, u var/state.sqlite3
+Ako je došlo do greške u parsiranju web stranice, ispiši problem na stderr, pokušaj ponovo sa novim browserom,
+proveri ostale naloge, i na kraju izađi sa statusnim kodom 1.
+Sa --workers N, nalozi se proveravaju paralelno u N nezavisnih browsera, a sa --tabs u N tabova jednog browsera.
+Sa --queue, više računara deli listu naloga preko zajedničkog reda poslova (python3 -m eracuni.jobs).
+Iznos, rok plaćanja, period i poziv na broj svakog novog računa upiši u indeks arhive (python3 -m eracuni.archive).
+Sa --backfill, preuzmi i sve starije račune kojih nema u arhivi.
+Sa --daemon, program radi stalno i proverava naloge po rasporedu, sa browserom koji ostaje otvoren.
 """
 
 
+import sys
+import logging
+import argparse
+from typing import List, Optional
+from eracuni.archive import index_archive
+from eracuni.backfill import Backfill
 from eracuni.data import Config
-from eracuni.browser import firefox
+from eracuni.browser import LazyBrowser
 from eracuni.edb import Domacinstva, MernaGrupa
 from eracuni.infostan import Infostan
+from eracuni.jobs import run_queue
+from eracuni.provider import new_run
 from eracuni.messages import Notifications
+from eracuni.pool import run_pool
+from eracuni.tracing import tracer
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Utility bills scraper (Serbian)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of parallel browser sessions, overrides workers from config.yaml')
+    parser.add_argument('--tabs', action='store_true', default=None,
+                        help='check parallel accounts in tabs of one browser, overrides tabs from config.yaml')
+    parser.add_argument('--queue', action='store_true', default=None,
+                        help='take account jobs from queue shared with other hosts, overrides queue from config.yaml')
+    parser.add_argument('--backfill', action='store_true',
+                        help='download every older bill missing from archive, for every account and location')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, check accounts on schedule from config.yaml with warm browser')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log time of every browser wait and reason of every skipped account to stderr')
+    return parser.parse_args()
+
+
+def check_accounts(config: Config, notifications: Notifications, workers: int,
+                   backfill: Optional[Backfill] = None) -> List[str]:
+    """
+    Check all accounts, return failed accounts, as "label (alias)"
+    With backfill, download older bills missing from archive too
+    """
+    new_run()
+    if config.queue:
+        # Other hosts take their share of accounts from the same queue
+        return run_queue(config, notifications, workers, backfill)
+    if workers > 1:
+        # Check all accounts with pool of browsers
+        return run_pool(config, notifications, workers, backfill)
+
+    # Browser is started on first use, http engine may not need it at all
+    browser = LazyBrowser(config)
+    failed: List[str] = []
+    try:
+        # Check EDB Domacinstva bills
+        failed += Domacinstva(browser, config, notifications, backfill=backfill).failed
+
+        # Check EDB Merna Grupa bills
+        failed += MernaGrupa(browser, config, notifications, backfill=backfill).failed
+
+        # Check InfoStan bills
+        failed += Infostan(browser, config, notifications, backfill=backfill).failed
+    finally:
+        # Quit browser, also after unexpected error
+        browser.quit()
+    return failed
+
+
+def write_run_report(config: Config) -> None:
+    """
+    Write timed steps of this run as JSON report and Prometheus textfile
+    """
+    if config.run_report:
+        tracer.write_json(config.run_report)
+    if config.metrics_textfile:
+        tracer.write_prometheus(config.metrics_textfile)
 
 
 def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(threadName)s %(message)s')
+
     # Read configuration file
-    config = Config()
-    notifications = Notifications(config)
+    with tracer.span('startup'):
+        config = Config()
+        notifications = Notifications(config)
+    workers = args.workers if args.workers is not None else config.workers
+    if args.tabs is not None:
+        config.tabs = args.tabs
+    if args.queue is not None:
+        config.queue = args.queue
 
-    # Start browser
-    browser = firefox(config)
+    if args.daemon:
+        # Imported here, one-shot runs don't need status server
+        from eracuni.daemon import Daemon
+        Daemon(config).run()
+        return
 
-    # Check EDB Domacinstva bills
-    Domacinstva(browser, config, notifications)
+    backfill = Backfill(config) if args.backfill else None
+    try:
+        failed = check_accounts(config, notifications, workers, backfill)
+        if backfill is not None:
+            backfill.close()
 
-    # Check EDB Merna Grupa bills
-    MernaGrupa(browser, config, notifications)
+        # Read amounts and due dates of new bills into archive index
+        if config.archive_index:
+            with tracer.span('archive_index'):
+                index_archive()
 
-    # Check InfoStan bills
-    Infostan(browser, config, notifications)
+        # Send notifications about new bills, also when some accounts failed
+        with tracer.span('notification_send'):
+            notifications.send()
+    finally:
+        # Report is written also when run fails
+        write_run_report(config)
 
-    # Quit browser
-    browser.quit()
+    memory = tracer.memory_report()
+    if memory is not None:
+        print(f"Browser memory: peak {memory['peak_rss_mb']} MB, average {memory['average_rss_mb']} MB, "
+              f"{memory['browser_restarts']} restarts")
 
-    # Send notifications about new bills
-    notifications.send()
+    if failed:
+        print(f"{len(failed)} accounts failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
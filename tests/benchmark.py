@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark, run all scrapers end to end against local stand-in portals (tests/mock_portal.py)
+
+For every account count, a new working folder gets config.yaml with that many EDB Domaćinstva,
+EDB Merna grupa and InfoStan accounts, all on MockPortal. Every count is run twice in the same folder:
+first run downloads every bill, next run finds nothing new, as a usual daily run does.
+Every run is a separate process, measured for wall time, WebDriver commands and peak RSS
+of its whole process tree (scraper, geckodriver and Firefox), RSS is read from /proc, Linux only.
+
+Results are saved as JSON, to compare them between versions:
+    python tests/benchmark.py --accounts 1 2 4 --locations 2 --latency 0.05 --output var/benchmark.json
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+import yaml
+from mock_portal import MockPortal, PortalAccount
+
+
+ROOT = Path(__file__).resolve().parent.parent
+# Benchmark runs from tests folder, eracuni package is imported from repository root
+sys.path.insert(0, str(ROOT))
+PERIODS = ['Jun 2022', 'Maj 2022', 'April 2022']
+RESULT_FILE = 'benchmark_result.json'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Offline benchmark against local stand-in portals')
+    parser.add_argument('--accounts', type=int, nargs='+', default=[1, 2, 4],
+                        help='account counts to run, per provider')
+    parser.add_argument('--locations', type=int, default=2, help='number of locations of every InfoStan account')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every portal response, in seconds')
+    parser.add_argument('--engine', choices=['selenium', 'http'], default='selenium', help='EDB engine')
+    parser.add_argument('--lean', action='store_true', help='run browser in lean mode')
+    parser.add_argument('--output', default='var/benchmark.json', help='JSON file with results')
+    parser.add_argument('--keep', action='store_true', help='keep working folders, for inspection')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def write_config(workdir: Path, portal: MockPortal, accounts: int, args: argparse.Namespace) -> None:
+    """
+    Write config.yaml for accounts per provider, options not set here keep their defaults
+    geckodriver is found through bin link to repository bin folder
+    """
+    config: Dict[str, Any] = {}
+    config['EDB_Domacinstva_Accounts'] = [{'user_id': f'dom_{i}', 'password': 'secret', 'alias': f'dom_{i}'}
+                                          for i in range(1, accounts + 1)]
+    config['EDB_Merna_Grupa_Accounts'] = [{'user_id': f'mg_{i}', 'password': 'secret', 'alias': f'mg_{i}'}
+                                          for i in range(1, accounts + 1)]
+    config['InfoStan_Accounts'] = [{'username': f'is_{i}', 'password': 'secret', 'alias': f'is_{i}'}
+                                   for i in range(1, accounts + 1)]
+    config['EDB_domacinstva_address'] = portal.edb_login_url('/domportal_js')
+    config['EDB_merna_grupa_address'] = portal.edb_login_url('/virmportaljs')
+    config['InfoStan_address'] = portal.infostan_login_url()
+    config['headless'] = True
+    config['user_agent'] = 'Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0'
+    config['timeout'] = 30
+    config['workers'] = 1
+    config['engine'] = args.engine
+    config['lean_mode'] = args.lean
+    config['page_metrics'] = False
+    config['session_cache'] = False
+    config['run_report'] = ''
+    config['metrics_textfile'] = ''
+    config.update({'email_enabled': False, 'email_address': '', 'email_password': '', 'receiver_email': '',
+                   'smtp_server': '', 'ssl_port': 465})
+    config.update({'telegram_enabled': False, 'telegram_bot_token': '', 'telegram_chat_id': ''})
+    with open(workdir / 'config.yaml', 'w', encoding='utf8') as fout:
+        yaml.safe_dump(config, fout, allow_unicode=True, sort_keys=False)
+    for folder in ('var', 'pdf'):
+        (workdir / folder).mkdir(exist_ok=True)
+    if not (workdir / 'bin').exists():
+        (workdir / 'bin').symlink_to(ROOT / 'bin', target_is_directory=True)
+
+
+def measure(workdir: Path, sample_time: float = 0.05) -> Dict[str, Any]:
+    """
+    Run one scraper run in child process, sample RSS of its process tree until it ends
+    """
+    from eracuni.browser import process_tree_rss
+
+    result_path = workdir / RESULT_FILE
+    if result_path.exists():
+        result_path.unlink()
+    start = time.perf_counter()
+    # Scrapers report new bills to stdout, keep it apart from benchmark output
+    child = subprocess.Popen([sys.executable, __file__, '--child', str(workdir)], stdout=sys.stderr)
+    peak_rss = 0
+    while child.poll() is None:
+        peak_rss = max(peak_rss, process_tree_rss(child.pid))
+        time.sleep(sample_time)
+    wall_time = time.perf_counter() - start
+
+    result: Dict[str, Any] = {'failed': True}
+    if result_path.exists():
+        with open(result_path, encoding='utf8') as fin:
+            result = json.load(fin)
+    result['process_time'] = round(wall_time, 3)
+    result['peak_rss_mb'] = peak_rss or None
+    result['exit_code'] = child.returncode
+    return result
+
+
+def run_child(workdir: str) -> None:
+    """
+    Check all accounts from workdir/config.yaml in one browser, as serial run of main.py
+    Write wall time, WebDriver commands, new bills and time per step to workdir/benchmark_result.json
+    """
+    os.chdir(workdir)
+    from eracuni.data import Config
+    from eracuni.browser import LazyBrowser
+    from eracuni.edb import Domacinstva, MernaGrupa
+    from eracuni.infostan import Infostan
+    from eracuni.messages import Notifications
+    from eracuni.tracing import tracer
+
+    config = Config()
+    notifications = Notifications(config)
+    browser = LazyBrowser(config)
+    error = None
+    start = time.perf_counter()
+    try:
+        failed = []
+        for scraper in (Domacinstva, MernaGrupa, Infostan):
+            failed += scraper(browser, config, notifications).failed
+        if failed:
+            error = f"failed accounts: {', '.join(failed)}"
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'.strip()
+    wall_time = time.perf_counter() - start
+    commands = browser.commands if browser.started else 0
+    browser.quit()
+
+    steps: Dict[str, float] = defaultdict(float)
+    for span in tracer.report()['spans']:
+        steps[span['name']] += span['duration']
+    result = {
+        'failed': error is not None,
+        'error': error,
+        'wall_time': round(wall_time, 3),
+        'commands': commands,
+        'new_bills': notifications.message_body.count('\n'),
+        'steps': {name: round(duration, 3) for name, duration in sorted(steps.items())},
+    }
+    with open(RESULT_FILE, 'w', encoding='utf8') as fout:
+        json.dump(result, fout, indent=2)
+
+
+def git_version() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    args = parse_args()
+    if args.child:
+        run_child(args.child)
+        return
+
+    most = max(args.accounts)
+    portal_accounts = [PortalAccount(f'{prefix}_{i}', 'secret', PERIODS, args.locations)
+                       for prefix in ('dom', 'mg', 'is') for i in range(1, most + 1)]
+    portal = MockPortal(portal_accounts, args.latency).start()
+    results = []
+    try:
+        for accounts in args.accounts:
+            workdir = Path(tempfile.mkdtemp(prefix=f'eracuni_bench_{accounts}_'))
+            write_config(workdir, portal, accounts, args)
+            for run in ('first_run', 'next_run'):
+                result = {'accounts': accounts, 'run': run, **measure(workdir)}
+                results.append(result)
+                print(f"{accounts:3} accounts {run:9}: {result.get('wall_time', '-')} s, "
+                      f"{result.get('commands', '-')} commands, {result['peak_rss_mb']} MB peak RSS"
+                      f"{', FAILED' if result['failed'] else ''}")
+            if args.keep:
+                print(f'Working folder: {workdir}')
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        portal.stop()
+
+    report = {
+        'version': git_version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'locations': args.locations, 'latency': args.latency, 'engine': args.engine,
+                     'lean_mode': args.lean, 'periods': len(PERIODS)},
+        'results': results,
+    }
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf8') as fout:
+        json.dump(report, fout, indent=2, ensure_ascii=False)
+    print(f'Results saved in {output}')
+
+    if any(result['failed'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
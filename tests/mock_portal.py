@@ -0,0 +1,255 @@
+"""
+Local stand-in for EDB and InfoStan portals, replays captured pages from tests/portal folder
+
+Serves both EDB applications, /domportal_js and /virmportaljs, with the same pages,
+and InfoStan (eSanduče) pages under /prijava and /infostan
+Start with MockPortal(accounts).start(), stop with .stop()
+"""
+
+
+import uuid
+import threading
+from pathlib import Path
+from string import Template
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, parse_qs
+
+
+PAGES = Path(__file__).parent / 'portal'
+EDB_APPS = ('/domportal_js', '/virmportaljs')
+
+
+def page(name: str, **values: str) -> str:
+    return Template((PAGES / name).read_text(encoding='utf8')).substitute(**values)
+
+
+def pdf_bytes(title: str) -> bytes:
+    """
+    Smallest valid one page PDF, with title in its body
+    """
+    body = f'BT /F1 12 Tf 72 720 Td ({title}) Tj ET'.encode('latin-1', 'replace')
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(body), body),
+    ]
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return out
+
+
+class PortalAccount:
+    """
+    Stand-in account, with list of invoice periods, newest first
+    InfoStan account has the same periods on every one of its locations
+    """
+    def __init__(self, user_id: str, password: str, periods: List[str], locations: int = 1) -> None:
+        self.user_id = user_id
+        self.password = password
+        self.periods = periods
+        self.locations = locations
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: 'PortalServer'
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def send_body(self, body: bytes, content_type: str = 'text/html; charset=utf-8', status: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_body(b'', status=303, headers={'Location': location, **(headers or {})})
+
+    def session_account(self, cookie_name: str = 'JSESSIONID') -> Optional[PortalAccount]:
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == cookie_name:
+                return self.server.sessions.get(value)
+        return None
+
+    def route(self) -> Optional[str]:
+        path = urlsplit(self.path).path
+        for app in EDB_APPS:
+            if path.startswith(app + '/'):
+                return path[len(app):]
+        return None
+
+    def app(self) -> str:
+        return '/' + urlsplit(self.path).path.split('/')[1]
+
+    def do_GET(self) -> None:
+        self.server.delay()
+        route = self.route()
+        if route is None:
+            self.infostan_get()
+            return
+        base = self.app()
+        account = self.session_account()
+        if route == '/faces/common/Login.jspx':
+            self.send_body(page('edb/login.html', base=base, view_state=uuid.uuid4().hex).encode('utf8'))
+        elif account is None:
+            self.send_body(b'Session expired', status=403)
+        elif route == '/faces/racuni/Pregled.jspx':
+            rows = ''.join(page('edb/invoice_row.html', base=base, number=str(number), period=period,
+                                amount=f'{1000 + number},00')
+                           for number, period in enumerate(account.periods, 1))
+            self.send_body(page('edb/invoices.html', base=base, rows=rows).encode('utf8'))
+        elif route == '/faces/racuni/Racun.pdf':
+            number = int(parse_qs(urlsplit(self.path).query).get('id', ['1'])[0])
+            self.send_body(pdf_bytes(f'{account.user_id} {account.periods[number - 1]}'), 'application/pdf',
+                           headers={'Content-Disposition': f'attachment; filename="racun_{number}.pdf"'})
+        elif route == '/faces/common/Logout.jspx':
+            self.server.logout(self.headers.get('Cookie', ''))
+            self.send_body(page('edb/login.html', base=base, view_state=uuid.uuid4().hex).encode('utf8'))
+        else:
+            self.send_body(b'Not found', status=404)
+
+    def do_POST(self) -> None:
+        self.server.delay()
+        length = int(self.headers.get('Content-Length', 0))
+        form = {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode('utf8')).items()}
+        if self.route() is None:
+            self.infostan_post(form)
+            return
+        account = self.server.accounts.get(form.get('j_username', ''))
+        if self.route() != '/faces/common/Login.jspx' or account is None \
+                or account.password != form.get('j_password'):
+            self.send_body(page('edb/login.html', base=self.app(), view_state=uuid.uuid4().hex).encode('utf8'))
+            return
+        session_id = self.server.login(account)
+        self.send_body(page('edb/home.html', base=self.app(), user_id=account.user_id).encode('utf8'),
+                       headers={'Set-Cookie': f'JSESSIONID={session_id}; Path={self.app()}'})
+
+
+    def infostan_page(self, name: str, **values: str) -> None:
+        content = page(f'infostan/{name}', **values)
+        self.send_body(page('infostan/layout.html', content=content).encode('utf8'))
+
+    def infostan_get(self) -> None:
+        """
+        InfoStan pages, bills of location are /infostan/{location}, with PDF viewer in the same page
+        """
+        path = urlsplit(self.path).path.rstrip('/')
+        account = self.session_account('SESSION')
+        if path == '/prijava':
+            self.send_body(page('infostan/login.html').encode('utf8'))
+            return
+        if path == '/odjava':
+            self.server.logout(self.headers.get('Cookie', ''))
+            self.redirect('/prijava', {'Set-Cookie': 'SESSION=; Path=/; Max-Age=0'})
+            return
+        if account is None:
+            self.redirect('/prijava')
+            return
+
+        parts = path.split('/')[1:]
+        if parts == ['pocetna']:
+            self.infostan_page('home.html')
+        elif parts == ['infostan']:
+            rows = ''.join(page('infostan/location_row.html', number=str(number), user_id=account.user_id)
+                           for number in range(1, account.locations + 1))
+            self.infostan_page('locations.html', user_id=account.user_id, rows=rows)
+        elif len(parts) >= 2 and parts[0] == 'infostan' and parts[1].isdigit() \
+                and 1 <= int(parts[1]) <= account.locations:
+            location = parts[1]
+            if len(parts) == 2:
+                rows = ''.join(page('infostan/bill_row.html', number=str(number), period=period,
+                                    amount=f'{2000 + number},00')
+                               for number, period in enumerate(account.periods, 1))
+                self.infostan_page('bills.html', location=location, rows=rows,
+                                   render_ms=str(int(self.server.render_time * 1000)))
+            elif parts[2:] == ['racun.pdf']:
+                number = int(parse_qs(urlsplit(self.path).query).get('bill', ['1'])[0])
+                self.send_body(pdf_bytes(f'{account.user_id} {location} {account.periods[number - 1]}'),
+                               'application/pdf',
+                               headers={'Content-Disposition': f'attachment; filename="infostan_{location}.pdf"'})
+            else:
+                self.send_body(b'Not found', status=404)
+        else:
+            self.send_body(b'Not found', status=404)
+
+    def infostan_post(self, form: Dict[str, str]) -> None:
+        account = self.server.accounts.get(form.get('username', ''))
+        if urlsplit(self.path).path != '/prijava' or account is None or account.password != form.get('password'):
+            self.send_body(page('infostan/login.html').encode('utf8'))
+            return
+        session_id = self.server.login(account)
+        self.redirect('/pocetna', {'Set-Cookie': f'SESSION={session_id}; Path=/'})
+
+
+class PortalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, accounts: List[PortalAccount], latency: float = 0.0, render_time: float = 0.5) -> None:
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.accounts = {account.user_id: account for account in accounts}
+        self.sessions: Dict[str, PortalAccount] = {}
+        self.latency = latency
+        self.render_time = render_time
+        self.lock = threading.Lock()
+
+    def delay(self) -> None:
+        if self.latency:
+            threading.Event().wait(self.latency)
+
+    def login(self, account: PortalAccount) -> str:
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = account
+        return session_id
+
+    def logout(self, cookies: str) -> None:
+        with self.lock:
+            for cookie in cookies.split(';'):
+                self.sessions.pop(cookie.strip().partition('=')[2], None)
+
+
+class MockPortal:
+    """
+    Portal server in background thread
+
+    MockPortal:
+        accounts: stand-in accounts
+        latency: delay of every response, in seconds
+        render_time: time InfoStan PDF viewer takes to show bill, in seconds
+    """
+    def __init__(self, accounts: List[PortalAccount], latency: float = 0.0, render_time: float = 0.5) -> None:
+        self.server = PortalServer(accounts, latency, render_time)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def edb_login_url(self, app: str = '/domportal_js') -> str:
+        return f'{self.url}{app}/faces/common/Login.jspx'
+
+    def infostan_login_url(self) -> str:
+        return f'{self.url}/prijava'
+
+    def start(self) -> 'MockPortal':
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
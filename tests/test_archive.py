@@ -0,0 +1,89 @@
+import os
+import pytest
+from eracuni.archive import ArchiveError, ArchiveIndex, parse_bill
+from eracuni.data import Storage
+
+
+BILL_TEXT = """JKP Infostan tehnologije
+Obračunski period: 01.05.2022 - 31.05.2022
+Poziv na broj: 97 12-3456-7890
+Rok plaćanja: 20.06.2022
+UKUPNO ZA UPLATU: 4.321,50 RSD
+"""
+
+
+def test_parse_bill():
+    assert parse_bill(BILL_TEXT) == {'amount': '4321.50', 'due_date': '2022-06-20', 'period': '2022-05',
+                                     'reference': '9712-3456-7890'}
+    assert parse_bill('Račun za mesec Maj 2022')['period'] == '2022-05'
+
+
+def test_archive_reads_only_new_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'pdf').mkdir()
+    downloaded = tmp_path / 'pdf' / 'infostan_home_1_2022-06_racun.pdf'
+    downloaded.write_bytes(b'%PDF-1.4 maj')
+    Storage('infostan_home_1').save('Maj 2022', downloaded)
+    (tmp_path / 'pdf' / 'edb_dom_work_2022-06_racun.pdf').write_bytes(b'%PDF-1.4 jun')
+
+    opened = []
+
+    def read_text(path):
+        opened.append(path.name)
+        return BILL_TEXT if b'maj' in path.read_bytes() else 'Za uplatu 1.000,00'
+
+    index = ArchiveIndex(read_text=read_text)
+    assert index.update() == (2, 0)
+    assert index.update() == (0, 0)
+    assert len(opened) == 2
+
+    [bill] = index.bills(alias='home', period='2022')
+    assert (bill.infix, bill.amount, bill.due_date) == ('infostan_home_1', 4321.5, '2022-06-20')
+    assert index.totals() == {('home', '2022'): 4321.5, ('work', '?'): 1000.0}
+
+
+def test_broken_file_is_skipped_but_missing_reader_stops_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'pdf').mkdir()
+    (tmp_path / 'pdf' / 'edb_dom_home_2022-05_racun.pdf').write_bytes(b'%PDF-1.4 maj')
+    (tmp_path / 'pdf' / 'edb_dom_home_2022-06_racun.pdf').write_bytes(b'truncated')
+
+    def read_text(path):
+        if path.read_bytes() == b'truncated':
+            raise ValueError('Stream has ended unexpectedly')
+        return 'Za uplatu 1.000,00'
+
+    assert ArchiveIndex(read_text=read_text).update() == (1, 1)
+
+    def no_reader(path):
+        raise ArchiveError('Archive index needs pypdf package or pdftotext program')
+
+    (tmp_path / 'pdf' / 'edb_dom_home_2022-07_racun.pdf').write_bytes(b'%PDF-1.4 jul')
+    with pytest.raises(ArchiveError):
+        ArchiveIndex(read_text=no_reader).update()
+
+
+def test_copy_of_archived_bill_is_linked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'pdf').mkdir()
+    first = tmp_path / 'pdf' / 'edb_dom_home_2022-06_racun.pdf'
+    first.write_bytes(b'%PDF-1.4 jun')
+    assert Storage('edb_dom_home').save('Jun 2022', first.relative_to(tmp_path))
+
+    # Period string changed on portal, the same bill is downloaded again
+    again = tmp_path / 'pdf' / 'edb_dom_home_2022-07_racun.pdf'
+    again.write_bytes(b'%PDF-1.4 jun')
+    assert not Storage('edb_dom_home').save('jun 2022', again.relative_to(tmp_path))
+    assert os.path.samefile(first, again)
+
+
+def test_dedupe_links_existing_copies(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'pdf').mkdir()
+    for name in ['a', 'b', 'c']:
+        (tmp_path / 'pdf' / f'edb_dom_home_2022-06_{name}.pdf').write_bytes(b'%PDF-1.4 jun')
+    (tmp_path / 'pdf' / 'edb_dom_home_2022-07_d.pdf').write_bytes(b'%PDF-1.4 jul')
+
+    assert ArchiveIndex().dedupe() == (2, 24)
+    assert ArchiveIndex().dedupe() == (0, 0)
+    assert os.stat(tmp_path / 'pdf' / 'edb_dom_home_2022-06_a.pdf').st_nlink == 3
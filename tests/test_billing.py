@@ -0,0 +1,73 @@
+from datetime import datetime
+from types import SimpleNamespace
+from eracuni.billing import BillingCalendar
+from eracuni.state import state_store
+
+
+def test_account_is_skipped_until_bill_window(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = state_store()
+    with store.connection as connection:
+        for period, downloaded_at in [('Mart 2022', '2022-04-05T08:00:00'), ('April 2022', '2022-05-04T08:00:00'),
+                                      ('Maj 2022', '2022-06-06T08:00:00')]:
+            connection.execute('INSERT INTO bills (infix, period, downloaded_at) VALUES (?, ?, ?)',
+                               ('edb_dom_home', period, downloaded_at))
+        connection.execute("INSERT INTO checks (key, checked_at, outcome) VALUES "
+                           "('edb_dom_home', '2022-06-10T08:00:00', 'checked')")
+    calendar = BillingCalendar(SimpleNamespace(billing_calendar=True, billing_window=5, billing_force_days=7))
+
+    # Median interval is 31 days, next bill around 2022-07-07, checked from 2022-07-02
+    assert calendar.expected('edb_dom_home') == datetime(2022, 7, 7, 8)
+    assert not calendar.due('edb_dom_home', ['edb_dom_home'], 'home', now=datetime(2022, 6, 12))
+    assert calendar.due('edb_dom_home', ['edb_dom_home'], 'home', now=datetime(2022, 6, 17, 9))
+    assert calendar.due('edb_dom_home', ['edb_dom_home'], 'home', now=datetime(2022, 7, 3))
+    assert calendar.due('edb_mg_work', ['edb_mg_work'], 'work', now=datetime(2022, 6, 12))
+
+
+def test_remote_bills_are_last_saved_but_not_learned_from(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = state_store()
+    with store.connection as connection:
+        for period, downloaded_at in [('April 2022', '2022-05-04T08:00:00'), ('Maj 2022', '2022-06-06T08:00:00')]:
+            connection.execute('INSERT INTO bills (infix, period, downloaded_at) VALUES (?, ?, ?)',
+                               ('edb_dom_home', period, downloaded_at))
+    calendar = BillingCalendar(SimpleNamespace(billing_calendar=True, billing_window=5, billing_force_days=7))
+    expected = calendar.expected('edb_dom_home')
+
+    # Another host of shared queue found June bill, this one learns about it today
+    store.record('edb_dom_home', 'Jun 2022', remote=True)
+
+    assert store.last_saved('edb_dom_home') == 'Jun 2022'
+    assert store.history('edb_dom_home')[-1].remote
+    assert calendar.expected('edb_dom_home') == expected
+
+
+def test_bill_downloaded_again_keeps_learned_interval(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = state_store()
+    with store.connection as connection:
+        for period, downloaded_at in [('April 2022', '2022-05-04T08:00:00'), ('Maj 2022', '2022-06-04T08:00:00')]:
+            connection.execute('INSERT INTO bills (infix, period, downloaded_at) VALUES (?, ?, ?)',
+                               ('edb_dom_home', period, downloaded_at))
+    calendar = BillingCalendar(SimpleNamespace(billing_calendar=True, billing_window=5, billing_force_days=7))
+    expected = calendar.expected('edb_dom_home')
+
+    # April bill is downloaded again today, it becomes last_saved but still came in May
+    store.record('edb_dom_home', 'April 2022')
+
+    assert store.last_saved('edb_dom_home') == 'April 2022'
+    assert calendar.expected('edb_dom_home') == expected
+
+
+def test_only_last_check_and_skip_are_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = state_store()
+    calendar = BillingCalendar(SimpleNamespace(billing_calendar=True, billing_window=5, billing_force_days=7))
+    calendar.checked('edb_dom_home')
+    for _ in range(3):
+        calendar.checked('edb_dom_home')
+        store.record_check('edb_dom_home', 'skipped', 'next bill expected around 2022-07-07')
+
+    rows = store.connection.execute('SELECT key, outcome FROM checks ORDER BY outcome').fetchall()
+    assert rows == [('edb_dom_home', 'checked'), ('edb_dom_home', 'skipped')]
+    assert store.last_check('edb_dom_home') is not None
@@ -0,0 +1,67 @@
+import time
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('selenium')
+from eracuni import browser  # noqa: E402
+from eracuni.browser import LazyBrowser, find_all_by_css, wait_for  # noqa: E402
+from eracuni.tracing import Tracer  # noqa: E402
+from selenium.common.exceptions import TimeoutException  # noqa: E402
+
+
+class FakeBrowser:
+    # Page with empty invoices table, rows show up only after `rows_after` lookups
+    def __init__(self, rows_after=None):
+        self.rows_after = rows_after
+        self.lookups = 0
+
+    def find_elements(self, by, target):
+        self.lookups += 1
+        if target == 'table.x2f':
+            return ['table']
+        if self.rows_after is not None and self.lookups > self.rows_after:
+            return ['header', 'row']
+        return []
+
+
+def test_empty_result_does_not_wait():
+    start = time.monotonic()
+    assert find_all_by_css(FakeBrowser(), 'table.x2f tbody tr', ready='table.x2f', timeout=30) == []
+    assert time.monotonic() - start < 1
+
+
+def test_wait_for_count():
+    assert wait_for(FakeBrowser(rows_after=2), 'table.x2f tbody tr', 'count', timeout=5, count=2) == ['header', 'row']
+    with pytest.raises(TimeoutException):
+        wait_for(FakeBrowser(), 'table.x2f tbody tr', 'count', timeout=0.3, count=1)
+
+
+def test_wait_uses_timeout_of_its_browser():
+    # Workers with different configs, each browser waits by its own timeout
+    quick = FakeBrowser()
+    quick.default_timeout = 0.3
+    start = time.monotonic()
+    with pytest.raises(TimeoutException):
+        wait_for(quick, 'table.x2f tbody tr', 'count', count=1)
+    assert time.monotonic() - start < 1
+    assert LazyBrowser(SimpleNamespace(timeout=5)).default_timeout == 5
+
+
+def test_low_memory_restarts_big_browser(monkeypatch):
+    tracer = Tracer()
+    monkeypatch.setattr(browser, 'tracer', tracer)
+    sizes = iter([150, 250, 450, 160])
+    monkeypatch.setattr(browser, 'process_tree_rss', lambda pid: next(sizes))
+    driver = SimpleNamespace(quit=lambda: None, service=SimpleNamespace(process=SimpleNamespace(pid=1)))
+    monkeypatch.setattr(browser, 'firefox', lambda config, download_dir, tabs: driver)
+    config = SimpleNamespace(low_memory=True, low_memory_max_rss=400, low_memory_accounts=3)
+    lazy = LazyBrowser(config)
+
+    for account in range(4):
+        lazy.service
+        lazy.account_checked()
+
+    # Third account used 450 MB, browser was restarted before fourth one
+    assert tracer.memory_report() == {'samples': 4, 'peak_rss_mb': 450, 'average_rss_mb': 252,
+                                      'browser_restarts': 1}
+    assert lazy.accounts == 1
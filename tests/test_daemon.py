@@ -0,0 +1,104 @@
+import time
+import socket
+import threading
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+import requests
+
+pytest.importorskip('selenium')
+from eracuni import daemon as daemon_module  # noqa: E402
+from eracuni.daemon import Daemon, status_handler  # noqa: E402
+
+
+class Checked:
+    # Stand-in scraper, records every check, its account fails when config says so
+    calls = []
+
+    def __init__(self, driver, config, notifications):
+        Checked.calls.append(type(self).__name__)
+        self.failed = [f'{type(self).__name__} (home)'] if config.fail else []
+
+
+class Edb(Checked):
+    pass
+
+
+class Infostan(Checked):
+    pass
+
+
+def make_config(**values):
+    config = dict(daemon_interval=3600, daemon_intervals={'infostan': 60}, daemon_jitter=10,
+                  daemon_recycle_checks=20, daemon_max_rss=1024, status_port=0, run_report='',
+                  metrics_textfile='', notify_immediately=False, email_enabled=False, telegram_enabled=False,
+                  fail=False)
+    config.update(values)
+    return SimpleNamespace(**config)
+
+
+def test_checks_are_planned_with_jitter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Checked.calls = []
+    daemon = Daemon(make_config(), providers={'edb_domacinstva': Edb, 'infostan': Infostan})
+    before = time.time()
+    assert daemon.check('edb_domacinstva') and daemon.check('infostan')
+    assert Checked.calls == ['Edb', 'Infostan']
+    assert before + 3600 <= daemon.states['edb_domacinstva'].next_due <= time.time() + 3610
+    assert before + 60 <= daemon.states['infostan'].next_due <= time.time() + 70
+
+
+def test_status_endpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    daemon = Daemon(make_config(fail=True), providers={'infostan': Infostan})
+    assert not daemon.check('infostan')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), status_handler(daemon))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        assert requests.get(f'{url}/health').status_code == 503
+        status = requests.get(f'{url}/status').json()
+        assert status['providers']['infostan']['failures'] == 1
+        assert requests.post(f'{url}/check').status_code == 202
+        assert daemon.states['infostan'].next_due == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_status_server_moves_to_new_port_on_reload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old_port, new_port = free_port(), free_port()
+    daemon = Daemon(make_config(status_port=old_port), providers={'infostan': Infostan})
+    daemon.start_server()
+    try:
+        monkeypatch.setattr(daemon_module, 'Config', lambda: make_config(status_port=new_port))
+        daemon.request_reload()
+        daemon.reload_config()
+
+        assert requests.get(f'http://127.0.0.1:{new_port}/health').status_code == 200
+        with pytest.raises(requests.ConnectionError):
+            requests.get(f'http://127.0.0.1:{old_port}/health', timeout=1)
+    finally:
+        daemon.stop_server()
+
+
+class Broken:
+    # Stand-in scraper with a bug
+    def __init__(self, driver, config, notifications):
+        raise AttributeError("'NoneType' object has no attribute 'click'")
+
+
+def test_unexpected_error_fails_check_not_daemon(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    daemon = Daemon(make_config(), providers={'infostan': Broken})
+    assert not daemon.check('infostan')
+    assert daemon.states['infostan'].failures == 1
+    assert daemon.states['infostan'].next_due > time.time()
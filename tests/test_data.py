@@ -1,6 +1,6 @@
 
 
-from eracuni.data import Account
+from eracuni.data import Account, Config
 import pytest
 
 
@@ -14,3 +14,12 @@ def test_account(blatruc):
     assert x.user_id == 'somename'
     assert x.password == 'somepassword'
     assert x.alias == 'somealias'
+
+
+def test_lean_hosts():
+    config = Config.__new__(Config)
+    config.edb_domacinstva_url = 'http://portal.edb.rs/domportal_js/faces/common/Login.jspx'
+    config.edb_merna_grupa_url = 'http://portal.edb.rs/virmportaljs/faces/common/Login.jspx'
+    config.infostan_url = 'https://esanduce.rs/prijava'
+    config.lean_allowlist = ['cdn.esanduce.rs']
+    assert config.lean_hosts() == ['cdn.esanduce.rs', 'esanduce.rs', 'portal.edb.rs']
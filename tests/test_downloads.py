@@ -0,0 +1,104 @@
+import threading
+from types import SimpleNamespace
+import pytest
+import requests
+from eracuni import downloads
+from eracuni.downloads import Download, DownloadTimeout, PdfError, fetch_pdf
+from mock_portal import MockPortal, PortalAccount
+
+
+def firefox_download(directory, name, delay=0.2):
+    # Firefox writes {name}.part, creates empty {name} and renames .part over it when done
+    def save():
+        part = directory / (name + '.part')
+        part.write_bytes(b'%PDF-1.4 half')
+        (directory / name).write_bytes(b'')
+        threading.Event().wait(delay)
+        part.write_bytes(b'%PDF-1.4 whole file')
+        part.replace(directory / name)
+    return threading.Thread(target=save)
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_download_waits_for_finished_file(tmp_path, monkeypatch, polling):
+    if polling:
+        monkeypatch.setattr(downloads, 'watch', lambda directory: downloads.Polling())
+    (tmp_path / 'leftover.pdf').write_bytes(b'%PDF-1.4 old')
+
+    with Download(str(tmp_path), timeout=5, stable_time=0.1) as download:
+        saving = firefox_download(tmp_path, 'racun.pdf')
+        saving.start()
+        pdf_file = download.wait()
+    saving.join()
+
+    assert pdf_file == tmp_path / 'racun.pdf'
+    assert pdf_file.read_bytes() == b'%PDF-1.4 whole file'
+
+
+def test_download_timeout(tmp_path):
+    (tmp_path / 'leftover.pdf').write_bytes(b'%PDF-1.4 old')
+    with Download(str(tmp_path), timeout=0.3) as download:
+        with pytest.raises(DownloadTimeout):
+            download.wait()
+
+
+def test_fetch_pdf_streams_and_verifies(tmp_path):
+    def target(name):
+        return tmp_path / 'pdf' / f'edb_dom_home_{name}'
+
+    portal = MockPortal([PortalAccount('1234', 'secret', ['Jun 2022'])]).start()
+    try:
+        session = requests.Session()
+        session.post(portal.edb_login_url(), data={'j_username': '1234', 'j_password': 'secret'})
+        pdf = fetch_pdf(session, f'{portal.url}/domportal_js/faces/racuni/Racun.pdf?id=1', target, 5)
+        assert pdf == tmp_path / 'pdf' / 'edb_dom_home_racun_1.pdf'
+        assert pdf.read_bytes().startswith(b'%PDF')
+
+        with pytest.raises(PdfError):
+            fetch_pdf(session, portal.edb_login_url(), target, 5)
+        assert sorted(path.name for path in (tmp_path / 'pdf').iterdir()) == ['edb_dom_home_racun_1.pdf']
+    finally:
+        portal.stop()
+
+
+class Response:
+    # Stand-in streamed response, body in chunks
+    def __init__(self, chunks, headers=None):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.url = 'https://portal/racun.pdf'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+
+def test_fetch_pdf_keeps_existing_file_and_rejects_truncated_one(tmp_path):
+    def target(name):
+        return tmp_path / f'edb_dom_home_2022-06_{name}'
+
+    session = SimpleNamespace(get=lambda url, timeout, stream: response)
+    archived = tmp_path / 'edb_dom_home_2022-06_racun.pdf'
+    archived.write_bytes(b'%PDF-1.4 maj\n%%EOF\n')
+
+    # Body cut off without Content-Length, archived bill stays as it was
+    response = Response([b'%PDF-1.4 ', b'jun'])
+    with pytest.raises(PdfError):
+        fetch_pdf(session, response.url, target, 5)
+
+    # Bill of another period with the same name is saved next to it
+    response = Response([b'%PDF-1.4 ', b'jun\n%%EOF\n'])
+    pdf = fetch_pdf(session, response.url, target, 5)
+
+    assert pdf == tmp_path / 'edb_dom_home_2022-06_racun_2.pdf'
+    assert pdf.read_bytes() == b'%PDF-1.4 jun\n%%EOF\n'
+    assert archived.read_bytes() == b'%PDF-1.4 maj\n%%EOF\n'
+    assert sorted(path.name for path in tmp_path.iterdir()) == [archived.name, pdf.name]
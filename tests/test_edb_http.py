@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+import pytest
+from eracuni.backfill import Backfill
+from eracuni.data import Account, Storage
+from eracuni.edb_http import EdbHttp, EdbHttpError
+from eracuni.messages import Notifications
+from mock_portal import MockPortal, PortalAccount
+
+
+@pytest.fixture
+def portal():
+    server = MockPortal([PortalAccount('1234', 'secret', ['Jun 2022', 'Maj 2022'])]).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    (tmp_path / 'var').mkdir()
+    (tmp_path / 'pdf').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_edb_http_saves_new_bill_once(portal, workdir):
+    config = SimpleNamespace(user_agent='test', timeout=5, workers=1, email_enabled=False, telegram_enabled=False,
+                             notify_immediately=False)
+    notifications = Notifications(config)
+    account = Account('1234', 'secret', 'home')
+
+    for run in range(2):
+        EdbHttp(config, notifications).check(
+            account, portal.edb_login_url(), Storage('edb_dom_home'), 'EDB Domaćinstva', 'edb_domacinstva')
+
+    assert notifications.message_body == 'EDB Domaćinstva (home) za jun 2022\n'
+    assert Storage('edb_dom_home').last_saved == 'Jun 2022'
+    [pdf] = (workdir / 'pdf').iterdir()
+    assert pdf.read_bytes().startswith(b'%PDF')
+
+
+def test_edb_http_wrong_password(portal, workdir):
+    config = SimpleNamespace(user_agent='test', timeout=5, workers=1, notify_immediately=False)
+    with pytest.raises(EdbHttpError):
+        EdbHttp(config, Notifications(config)).check(
+            Account('1234', 'wrong', 'home'), portal.edb_login_url(), Storage('edb_dom_home'), 'EDB Domaćinstva',
+            'edb_domacinstva')
+
+
+def test_edb_http_backfills_older_bills(workdir):
+    portal = MockPortal([PortalAccount('1234', 'secret', ['Jun 2022', 'Maj 2022', 'April 2022'])]).start()
+    config = SimpleNamespace(user_agent='test', timeout=5, workers=1, email_enabled=False, telegram_enabled=False,
+                             notify_immediately=False, backfill_workers=2, step_timeout=lambda step: 5)
+    notifications = Notifications(config)
+    try:
+        for run in range(2):
+            backfill = Backfill(config)
+            EdbHttp(config, notifications).check(
+                Account('1234', 'secret', 'home'), portal.edb_login_url(), Storage('edb_dom_home'),
+                'EDB Domaćinstva', 'edb_domacinstva', backfill=backfill)
+            backfill.close()
+    finally:
+        portal.stop()
+
+    # Only the newest bill is announced and remembered as last saved
+    assert notifications.message_body == 'EDB Domaćinstva (home) za jun 2022\n'
+    assert Storage('edb_dom_home').last_saved == 'Jun 2022'
+    assert backfill.downloaded == 0
+    assert len(list((workdir / 'pdf').iterdir())) == 3
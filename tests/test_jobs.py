@@ -0,0 +1,101 @@
+import threading
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+import requests
+
+pytest.importorskip('selenium')
+from eracuni.data import Account  # noqa: E402
+from eracuni.edb import Domacinstva  # noqa: E402
+from eracuni.jobs import HttpJobQueue, QueuePool, SqliteJobQueue, queue_handler  # noqa: E402
+from eracuni.messages import Notifications  # noqa: E402
+from eracuni.pool import Job  # noqa: E402
+from eracuni.state import state_store  # noqa: E402
+
+
+def test_job_is_done_once_by_lease_holder(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'queue.sqlite3'))
+    # Every host fills the same round, jobs are added once
+    queue.fill(1, ['edb_dom_home', 'infostan_home'])
+    queue.fill(1, ['edb_dom_home', 'infostan_home'])
+
+    first = queue.claim(1, 'pi', lease=60)
+    second = queue.claim(1, 'pc', lease=60)
+    assert (first.key, second.key) == ('edb_dom_home', 'infostan_home')
+    assert queue.claim(1, 'pc', lease=60) is None
+
+    # Host pi stopped, its lease expired, pc takes the job over
+    assert queue.heartbeat(first, -1)
+    taken_over = queue.claim(1, 'pc', lease=60)
+    assert taken_over.key == 'edb_dom_home'
+    assert not queue.heartbeat(first, 60)
+    assert queue.complete(taken_over, False, {'edb_dom_home': 'Jun 2022'})
+    assert not queue.complete(first, False, {'edb_dom_home': 'Jun 2022'})
+
+    assert queue.complete(second, False, {'infostan_home_1': 'Jun 2022', 'infostan_home_2': 'Maj 2022'})
+    assert [job['state'] for job in queue.status(1)] == ['done', 'done']
+
+    # Next round starts with periods found in the last one
+    queue.fill(2, ['edb_dom_home', 'infostan_home'])
+    assert queue.claim(2, 'pi', lease=60).periods == {'edb_dom_home': 'Jun 2022'}
+    assert queue.claim(2, 'pi', lease=60).periods == {'infostan_home_1': 'Jun 2022', 'infostan_home_2': 'Maj 2022'}
+
+
+def test_http_queue(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), queue_handler(SqliteJobQueue(str(tmp_path / 'queue.sqlite3'))))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        queue = HttpJobQueue(f'http://127.0.0.1:{server.server_port}')
+        queue.fill(1, ['edb_dom_home'])
+        lease = queue.claim(1, 'pi', lease=60)
+        assert lease.key == 'edb_dom_home' and lease.periods == {}
+        assert queue.heartbeat(lease, 60)
+        assert queue.complete(lease, False, {'edb_dom_home': 'Jun 2022'})
+        assert queue.claim(1, 'pc', lease=60) is None
+        assert queue.status(1)[0]['owner'] == 'pi'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class Unreachable(SqliteJobQueue):
+    # Queue server that went away after jobs were added
+    def claim(self, round_id, owner, lease):
+        raise requests.ConnectionError('Connection refused')
+
+
+def test_host_stops_when_queue_is_unreachable(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = SimpleNamespace(queue_round=3600, queue_lease=60, remote_webdrivers=None, low_memory=False)
+    jobs = [Job(Domacinstva, Account('1234', 'secret', 'home'))]
+
+    pool = QueuePool(config, Notifications(config), 2, Unreachable(str(tmp_path / 'queue.sqlite3')))
+
+    assert pool.run(jobs) == ['Job queue']
+
+
+class Seen:
+    # Stand-in scraper, remembers last saved period it found for its account
+    recipe = SimpleNamespace(prefix='bvk', label='Vodovod')
+    last_saved = []
+
+    def __init__(self, driver, config, notifications, accounts, backfill=None):
+        Seen.last_saved.append(state_store().last_saved(f'bvk_{accounts[0].alias}'))
+        self.failed = []
+
+
+def test_older_period_from_lease_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = SqliteJobQueue(str(tmp_path / 'queue.sqlite3'))
+    # Host that was behind reported May bill, this one already has June
+    queue.fill(0, ['bvk_home'])
+    queue.complete(queue.claim(0, 'pc', lease=60), False, {'bvk_home': 'Maj 2022'})
+    state_store().record('bvk_home', 'Jun 2022')
+    config = SimpleNamespace(queue_round=3600, queue_lease=60, remote_webdrivers=None, low_memory=False,
+                             notify_immediately=False, email_enabled=False, telegram_enabled=False)
+    Seen.last_saved = []
+
+    QueuePool(config, Notifications(config), 1, queue).run([Job(Seen, Account('1234', 'secret', 'home'))])
+
+    assert Seen.last_saved == ['Jun 2022']
+    assert 'Maj 2022' not in state_store().periods('bvk_home')
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+from eracuni.messages import Channel, Delivery, Notifications
+from eracuni.state import state_store
+
+
+class FlakyChannel(Channel):
+    # Fails first `failures` deliveries, then records every delivered body
+    name = 'flaky'
+
+    def __init__(self, config, failures):
+        super().__init__(config)
+        self.failures = failures
+        self.delivered = []
+
+    def deliver(self, body):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('no route to host')
+        self.delivered.append(body)
+
+
+def test_undelivered_message_waits_in_outbox(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = SimpleNamespace(notify_immediately=False, notify_retries=1, notify_backoff=0)
+
+    # Two attempts fail, message stays in outbox
+    channel = FlakyChannel(config, failures=2)
+    notifications = Notifications(config, Delivery(config, [channel]))
+    notifications.add('EDB Domaćinstva (home) za jun 2022')
+    notifications.send()
+    assert channel.delivered == []
+    assert len(state_store().pending_messages('flaky')) == 1
+
+    # Next run delivers it first, then its own message
+    channel = FlakyChannel(config, failures=1)
+    notifications = Notifications(config, Delivery(config, [channel]))
+    notifications.add('InfoStan (home 1) za jun 2022')
+    notifications.send()
+    assert channel.delivered == ['EDB Domaćinstva (home) za jun 2022\n', 'InfoStan (home 1) za jun 2022\n']
+    assert state_store().pending_messages('flaky') == []
+
+
+def test_immediate_delivery(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = SimpleNamespace(notify_immediately=True, notify_retries=0, notify_backoff=0)
+    channel = FlakyChannel(config, failures=0)
+    notifications = Notifications(config, Delivery(config, [channel]))
+    job = Notifications(config, notifications.delivery)
+    job.add('EDB Merna grupa (work) za jun 2022')
+    notifications.merge(job)
+    notifications.send()
+    assert channel.delivered == ['EDB Merna grupa (work) za jun 2022\n']
@@ -0,0 +1,49 @@
+import time
+import threading
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('selenium')
+from eracuni.data import Account  # noqa: E402
+from eracuni.messages import Notifications  # noqa: E402
+from eracuni.pool import Job, Pool  # noqa: E402
+
+
+class Checked:
+    # Stand-in scraper, first account is the slowest one, account 'bad' fails and 'bug' raises
+    recipe = SimpleNamespace(label='Vodovod')
+    download_dirs = {}
+
+    def __init__(self, driver, config, notifications, accounts, backfill=None):
+        [account] = accounts
+        Checked.download_dirs.setdefault(threading.current_thread().name, set()).add(driver.download_dir)
+        time.sleep(0.2 if account.alias == 'home0' else 0.01)
+        if account.alias == 'bug':
+            raise AttributeError("'NoneType' object has no attribute 'click'")
+        self.failed = [f'Vodovod ({account.alias})'] if account.alias == 'bad' else []
+        if not self.failed:
+            notifications.add(f'Vodovod ({account.alias}) za jun 2022')
+
+
+def make_config():
+    return SimpleNamespace(notify_immediately=False, email_enabled=False, telegram_enabled=False, low_memory=False)
+
+
+def test_results_are_merged_in_job_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Checked.download_dirs = {}
+    aliases = ['home0', 'home1', 'bad', 'home2', 'bug', 'home3']
+    jobs = [Job(Checked, Account(str(number), 'secret', alias)) for number, alias in enumerate(aliases)]
+    notifications = Notifications(make_config())
+
+    failed = Pool(make_config(), notifications, 3).run(jobs)
+
+    # Slow first account does not change order of notifications, unexpected error fails only its account
+    assert notifications.message_body == ''.join(f'Vodovod ({alias}) za jun 2022\n'
+                                                 for alias in ['home0', 'home1', 'home2', 'home3'])
+    assert sorted(failed) == ['Vodovod (bad)', 'Vodovod (bug)']
+
+    # Every worker downloads into its own folder
+    assert Checked.download_dirs == {
+        f'worker_{number}': {f'var/worker_{number}'} for number in range(1, 4)}
+    assert sorted(path.name for path in (tmp_path / 'var').glob('worker_*')) == ['worker_1', 'worker_2', 'worker_3']
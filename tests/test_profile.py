@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+from eracuni.profile import MARKER, clone_profile, remove_site_data, template_ready
+
+
+def test_clone_is_independent_of_template(tmp_path):
+    template = tmp_path / 'firefox_profile'
+    (template / 'cache2' / 'entries').mkdir(parents=True)
+    (template / 'cache2' / 'entries' / 'A1B2').write_bytes(b'portal.css')
+    (template / 'places.sqlite').write_bytes(b'places')
+    config = SimpleNamespace(profile_template=str(template))
+    assert not template_ready(config)
+    (template / MARKER).write_text('{}')
+    assert template_ready(config)
+    assert not template_ready(SimpleNamespace(profile_template=''))
+
+    clone = clone_profile(template)
+    assert clone.parent == tmp_path and clone.name.startswith('firefox_profile-')
+    assert (clone / 'cache2' / 'entries' / 'A1B2').read_bytes() == b'portal.css'
+    # Firefox writes profile files in place, template keeps its content
+    (clone / 'places.sqlite').write_bytes(b'visited')
+    assert (template / 'places.sqlite').read_bytes() == b'places'
+
+
+def test_site_data_is_removed(tmp_path):
+    (tmp_path / 'storage' / 'default').mkdir(parents=True)
+    for name in ('cookies.sqlite', 'prefs.js', 'xulstore.json'):
+        (tmp_path / name).write_text(name)
+    (tmp_path / 'lock').symlink_to('127.0.0.1:+1234')
+
+    remove_site_data(tmp_path)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['xulstore.json']
@@ -0,0 +1,223 @@
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('selenium')
+from selenium.common.exceptions import WebDriverException  # noqa: E402
+from eracuni.data import Account, Storage  # noqa: E402
+from eracuni.edb import Domacinstva  # noqa: E402
+from eracuni.messages import Notifications  # noqa: E402
+from eracuni import browser, provider  # noqa: E402
+from eracuni.provider import Recipe  # noqa: E402
+from eracuni.tracing import Tracer  # noqa: E402
+
+
+class Element:
+    def __init__(self, on_click=None):
+        self.on_click = on_click
+        self.typed = []
+
+    def click(self):
+        if self.on_click:
+            self.on_click()
+
+    def send_keys(self, value):
+        self.typed.append(value)
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+
+class Driver:
+    # Stand-in browser, every selector finds an element, invoice table has one bill
+    CONTEXT_CHROME = 'chrome'
+
+    def __init__(self, download_dir, period):
+        self.download_dir = str(download_dir)
+        self.current_url = 'http://portal/home'
+        self.clicked = []
+        self.quits = 0
+        save_button = Element(lambda: (download_dir / 'racun.pdf').write_bytes(b'%PDF-1.4 ' + period.encode()))
+        self.rows = [{'row': Element(), 'period': 'Period'},
+                     {'row': Element(), 'period': f' {period} ', 'pdf_url': None, 'save_button': save_button}]
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.quits += 1
+
+    def context(self, name):
+        raise WebDriverException('no chrome context')
+
+    def find_elements(self, by, target):
+        element = Element(lambda: self.clicked.append(target))
+        return [element]
+
+    def execute_script(self, script, spec, root=None):
+        return {'rows': self.rows}
+
+
+WATER = {'name': 'water', 'label': 'Vodovod', 'prefix': 'bvk', 'url': 'bvk_url', 'accounts': 'bvk_accounts',
+         'login': [{'type': '#user', 'value': 'user_id'}, {'click': '#login'}], 'logged_in': '#bills',
+         'menu': [{'click': '#bills'}], 'bills': {'ready': 'table', 'rows': 'tr', 'period': 'td', 'pdf_url': 'a'},
+         'logout': [{'click': '#logout'}]}
+
+
+def test_recipe_is_checked_when_compiled():
+    recipe = Recipe(WATER)
+    assert [step.action for step in recipe.login] == ['type', 'click']
+    assert recipe.bill_rows['rows']['fields']['pdf_url'] == {'css': 'a', 'attr': 'href'}
+    with pytest.raises(ValueError):
+        Recipe(dict(WATER, login=[{'press': '#login'}]))
+    with pytest.raises(ValueError):
+        Recipe(dict(WATER, login=[{'type': '#user', 'value': 'email'}]))
+    with pytest.raises(ValueError):
+        Recipe(dict(WATER, bills={'ready': 'table', 'rows': 'tr', 'period': 'td'}))
+
+
+def make_config(**values):
+    config = dict(session_cache=False, page_metrics=False, billing_calendar=False, billing_window=5,
+                  billing_force_days=7, engine='selenium', direct_download=False, timeout=5,
+                  edb_domacinstva_url='http://portal/', notify_immediately=False, email_enabled=False,
+                  telegram_enabled=False, step_timeout=lambda step: 5, retries=1, retry_backoff=0, retry_budget=5,
+                  circuit_failures=2, circuit_cooldown=60)
+    config.update(values)
+    return SimpleNamespace(**config)
+
+
+def test_scraper_runs_recipe(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, '_health', {})
+    (tmp_path / 'pdf').mkdir()
+    (tmp_path / 'downloads').mkdir()
+    config = make_config()
+    notifications = Notifications(config)
+    driver = Driver(tmp_path / 'downloads', 'Jun 2022')
+
+    for run in range(2):
+        Domacinstva(driver, config, notifications, accounts=[Account('1234', 'secret', 'home')])
+
+    assert notifications.message_body == 'EDB Domaćinstva (home) za jun 2022\n'
+    assert Storage('edb_dom_home').last_saved == 'Jun 2022'
+    assert driver.clicked.count('a[title="Odjavljivanje sa sistema"]') == 2
+    [pdf] = (tmp_path / 'pdf').iterdir()
+    assert pdf.read_bytes() == b'%PDF-1.4 Jun 2022'
+
+
+def test_failed_accounts_are_retried_until_circuit_opens(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, '_health', {})
+    driver = Driver(tmp_path, 'Jun 2022')
+    # Invoice table without rows
+    driver.rows = driver.rows[:1]
+    accounts = [Account(str(number), 'secret', f'home{number}') for number in range(3)]
+
+    scraper = Domacinstva(driver, make_config(), Notifications(make_config()), accounts=accounts)
+
+    # Two accounts tried twice each, then portal is taken as down and third one is skipped
+    assert scraper.failed == ['EDB Domaćinstva (home0)', 'EDB Domaćinstva (home1)', 'EDB Domaćinstva (home2)']
+    assert driver.quits == 4
+    assert not provider.provider_health('edb_domacinstva').allow()
+
+
+def test_failed_steps_are_traced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, '_health', {})
+    tracer = Tracer()
+    monkeypatch.setattr(provider, 'tracer', tracer)
+    monkeypatch.setattr(browser, 'tracer', tracer)
+    driver = Driver(tmp_path, 'Jun 2022')
+    driver.rows = driver.rows[:1]
+    accounts = [Account(str(number), 'secret', f'home{number}') for number in range(3)]
+
+    Domacinstva(driver, make_config(), Notifications(make_config()), accounts=accounts)
+
+    # Login went fine, invoice table failed, third account was not tried
+    failed = [(span.account, span.name) for span in tracer.spans if not span.ok]
+    assert failed == [('home0', 'table_read'), ('home0', 'table_read'), ('home1', 'table_read'),
+                      ('home1', 'table_read'), ('home2', 'circuit_open')]
+    tracer.write_prometheus(str(tmp_path / 'eracuni.prom'))
+    lines = (tmp_path / 'eracuni.prom').read_text(encoding='utf8').splitlines()
+    assert 'eracuni_step_errors{provider="edb_domacinstva",account="home1",step="table_read"} 2' in lines
+    assert 'eracuni_step_errors{provider="edb_domacinstva",account="home2",step="circuit_open"} 1' in lines
+
+
+class LocationsDriver(Driver):
+    # Location list, rows as read by extract
+    def __init__(self, download_dir, period, locations):
+        super().__init__(download_dir, period)
+        self.locations = locations
+        self.visited = []
+
+    def get(self, url):
+        self.visited.append(url)
+
+    def execute_script(self, script, spec, root=None):
+        if 'button' in spec['rows']['fields']:
+            return {'rows': self.locations}
+        return super().execute_script(script, spec, root)
+
+
+def location_scraper():
+    recipe = Recipe(dict(WATER, bills={'ready': 'table', 'rows': 'tr', 'period': 'td', 'header': 1,
+                                       'pdf_url': 'a', 'save_button': 'a'},
+                         locations={'rows': '.location', 'ready': '#list', 'button': 'div', 'route': 'div',
+                                    'last_bill': '.date'},
+                         leave_location=[{'click': '#back'}]))
+    return type('Water', (provider.Scraper,), {'recipe': recipe})
+
+
+def test_locations_are_opened_by_onclick_route(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, '_health', {})
+    (tmp_path / 'pdf').mkdir()
+    (tmp_path / 'downloads').mkdir()
+    locations = [{'button': Element(), 'route': {'href': None, 'onclick': f"location.href = '/location/{number}'"}}
+                 for number in (1, 2)]
+    driver = LocationsDriver(tmp_path / 'downloads', 'Jun 2022', locations)
+    config = make_config(bvk_url='http://portal/')
+    notifications = Notifications(config)
+
+    location_scraper()(driver, config, notifications, accounts=[Account('1234', 'secret', 'home')])
+
+    # Every location is opened by its route, relative to location list, and never left by Back button
+    assert driver.visited == ['http://portal/', 'http://portal/location/1', 'http://portal/location/2']
+    assert '#back' not in driver.clicked
+    assert Storage('bvk_home_1').last_saved == Storage('bvk_home_2').last_saved == 'Jun 2022'
+
+
+def test_location_without_route_or_button_fails_account(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, '_health', {})
+    driver = LocationsDriver(tmp_path, 'Jun 2022', [{'button': None, 'route': None}])
+    config = make_config(bvk_url='http://portal/', retries=0)
+
+    scraper = location_scraper()(driver, config, Notifications(config), accounts=[Account('1234', 'secret', 'home')])
+
+    assert scraper.failed == ['Vodovod (home)']
+
+
+def test_saved_location_is_not_opened_and_keeps_its_storage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(provider, '_health', {})
+    (tmp_path / 'pdf').mkdir()
+    (tmp_path / 'downloads').mkdir()
+    # Older version kept first location by its position
+    Storage('bvk_home_1').save('Jun 2022')
+    clicked = []
+    locations = [{'button': Element(lambda number=number: clicked.append(number)), 'last_bill': 'Jun 2022',
+                  'route': {'href': f'/location/{number}', 'onclick': None}} for number in ('a7', 'b9')]
+    driver = LocationsDriver(tmp_path / 'downloads', 'Jun 2022', locations)
+    config = make_config(bvk_url='http://portal/')
+
+    location_scraper()(driver, config, Notifications(config), accounts=[Account('1234', 'secret', 'home')])
+
+    # First location is up to date, it is neither visited nor clicked, its storage is moved to its route
+    assert driver.visited == ['http://portal/', 'http://portal/location/b9']
+    assert clicked == []
+    assert Storage('bvk_home_a7').last_saved == 'Jun 2022'
+    assert Storage('bvk_home_1').last_saved == 'none'
+    assert Storage('bvk_home_b9').last_saved == 'Jun 2022'
@@ -0,0 +1,80 @@
+import io
+import json
+import base64
+import zipfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from eracuni.remote import EndpointPool, RemoteError, RemoteFiles
+
+
+class Grid(BaseHTTPRequestHandler):
+    # Stand-in Selenium Grid, with slots from server and files of one session
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, value):
+        body = json.dumps({'value': value}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json({'ready': True, 'nodes': [{'availability': 'UP', 'slots': self.server.slots}]})
+        else:
+            self.send_json({'names': list(self.server.files)})
+
+    def do_POST(self):
+        name = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['name']
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr(name, self.server.files[name])
+        self.send_json({'filename': name, 'contents': base64.b64encode(buffer.getvalue()).decode()})
+
+
+@pytest.fixture
+def grids():
+    servers = []
+    for busy in (2, 1):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Grid)
+        server.slots = [{'session': {'id': 'x'}}] * busy + [{'session': None}] * (3 - busy)
+        server.files = {}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_least_loaded_ready_endpoint_is_first(grids):
+    busy, free = (f'http://127.0.0.1:{server.server_port}' for server in grids)
+    pool = EndpointPool(['http://127.0.0.1:9', busy, free], timeout=1)
+    assert pool.candidates() == [free, busy]
+
+    # Both have one free slot, endpoint with fewer sessions of this process goes first
+    grids[1].slots = [{'session': {'id': 'x'}}] * 3 + [{'session': None}]
+    grids[0].slots = [{'session': None}]
+    pool.acquire(busy)
+    assert pool.candidates() == [free, busy]
+
+    with pytest.raises(RemoteError):
+        EndpointPool(['http://127.0.0.1:9'], timeout=1).candidates()
+
+
+def test_remote_download_is_fetched(grids, tmp_path):
+    grids[0].files = {'old.pdf': b'%PDF old'}
+    files = RemoteFiles(f'http://127.0.0.1:{grids[0].server_port}', 'x', timeout=2)
+    known = files.names()
+    # Firefox creates empty file and writes to its .part companion until download is finished
+    grids[0].files.update({'racun.pdf.part': b'%PDF', 'racun.pdf': b''})
+    with pytest.raises(RemoteError):
+        files.wait(known, 1)
+
+    grids[0].files = {'old.pdf': b'%PDF old', 'racun.pdf': b'%PDF-1.4 Jun 2022'}
+    path = files.fetch(files.wait(known, 2), str(tmp_path / 'downloads'))
+
+    assert path == tmp_path / 'downloads' / 'racun.pdf'
+    assert path.read_bytes() == b'%PDF-1.4 Jun 2022'
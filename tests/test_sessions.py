@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+import pytest
+from eracuni.state import state_store
+
+pytest.importorskip('cryptography')
+pytest.importorskip('selenium')
+from eracuni.sessions import SessionCache  # noqa: E402
+
+
+class FakeBrowser:
+    # Portal accepts only session cookie saved by previous run
+    def __init__(self, valid_token):
+        self.valid_token = valid_token
+        self.cookies = []
+        self.current_url = 'https://portal/home'
+        self.loads = []
+
+    def get(self, url):
+        self.current_url = url
+        self.loads.append(url)
+
+    def get_cookies(self):
+        return self.cookies
+
+    def add_cookie(self, cookie):
+        self.cookies.append(cookie)
+
+    def delete_all_cookies(self):
+        self.cookies = []
+
+    def execute_script(self, script, *args):
+        return {}
+
+    @property
+    def timeouts(self):
+        return SimpleNamespace(implicit_wait=0)
+
+    def implicitly_wait(self, timeout):
+        pass
+
+    def find_elements(self, by, target):
+        return [cookie for cookie in self.cookies if cookie['value'] == self.valid_token]
+
+
+def test_session_cache_hit_and_miss(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = SimpleNamespace(session_cache=True, session_key='', session_check_timeout=0)
+    browser = FakeBrowser('token')
+
+    # First run has no session to try, login page is loaded once and no miss is counted
+    assert not SessionCache(config).restore(browser, 'edb_dom_home', 'https://portal/login', 'a')
+    assert browser.loads == ['https://portal/login']
+    assert state_store().session_counts() == {}
+    # Full login
+    browser.cookies = [{'name': 'JSESSIONID', 'value': 'token'}]
+    assert SessionCache(config).save(browser, 'edb_dom_home')
+    assert SessionCache(config).restore(browser, 'edb_dom_home', 'https://portal/login', 'a')
+    assert b'token' not in state_store().load_session('edb_dom_home')
+
+    browser.valid_token = 'expired'
+    assert not SessionCache(config).restore(browser, 'edb_dom_home', 'https://portal/login', 'a')
+    assert browser.cookies == []
+    assert state_store().session_counts() == {'edb_dom_home': (1, 1)}
@@ -0,0 +1,22 @@
+from eracuni.data import Storage
+from eracuni.state import state_store
+
+
+def test_storage_migrates_yaml_and_records_bills(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'var').mkdir()
+    (tmp_path / 'var' / 'storage_edb_dom_home.yaml').write_text('last_saved: Maj 2022\n', encoding='utf8')
+
+    assert Storage('edb_dom_home').last_saved == 'Maj 2022'
+    assert Storage('edb_mg_work').last_saved == 'none'
+    assert (tmp_path / 'var' / 'storage_edb_dom_home.yaml.migrated').exists()
+
+    pdf = tmp_path / 'racun.pdf'
+    pdf.write_bytes(b'%PDF-1.4 jun')
+    Storage('edb_dom_home').save('Jun 2022 ', pdf)
+
+    assert Storage('edb_dom_home').last_saved == 'Jun 2022'
+    [old, new] = state_store().history('edb_dom_home')
+    assert (old.period, old.pdf_path) == ('Maj 2022', None)
+    assert (new.period, new.size) == ('Jun 2022', 12)
+    assert len(new.sha256) == 64
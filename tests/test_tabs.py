@@ -0,0 +1,106 @@
+import threading
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('selenium')
+from selenium.common.exceptions import TimeoutException  # noqa: E402
+from selenium.webdriver.remote.webelement import WebElement  # noqa: E402
+from eracuni.tabs import Tab, TabBrowser  # noqa: E402
+
+
+class Element(WebElement):
+    def __init__(self, driver, name):
+        super().__init__(driver, name)
+        self.name = name
+
+    def click(self):
+        self.parent.log.append((self.parent.window, 'click', self.name))
+
+
+class SwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        self.driver.window = handle
+
+
+class Driver:
+    # Stand-in Firefox, new tab script opens window, every command is logged with its window
+    CONTEXT_CHROME = 'chrome'
+
+    def __init__(self):
+        self.window_handles = ['main']
+        self.window = 'main'
+        self.switch_to = SwitchTo(self)
+        self.log = []
+        self.started = True
+        self.opened = 0
+
+    def context(self, name):
+        return Context()
+
+    def execute_script(self, script, *args):
+        if 'addTab' in script:
+            self.opened += 1
+            self.window_handles.append(f'tab{self.opened}')
+            return self.opened
+        return None
+
+    def find_element(self, by, target):
+        self.log.append((self.window, 'find', target))
+        return Element(self, f'{target}@{self.window}')
+
+    def close(self):
+        self.window_handles.remove(self.window)
+
+    def get(self, url):
+        self.log.append((self.window, 'get', url))
+
+    def quit(self):
+        self.started = False
+
+
+class Context:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+def test_tabs_switch_window_for_every_command():
+    tabs = TabBrowser(SimpleNamespace(timeout=1))
+    tabs.browser = Driver()
+
+    def account(tab, number):
+        for step in range(20):
+            tab.find_element('css selector', f'#step{step}').click()
+
+    threads = [threading.Thread(target=account, args=(Tab(tabs), number)) for number in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    log = tabs.browser.log
+    assert len(log) == 120
+    # Element is clicked in window where it was found
+    assert all(name.endswith(f'@{window}') for window, action, name in log if action == 'click')
+    assert {window for window, action, name in log} == {'tab1', 'tab2', 'tab3'}
+
+    tab = Tab(tabs)
+    tab.find_element('css selector', '#login')
+    handle = tab.handle
+    tab.quit()
+    assert handle not in tabs.browser.window_handles
+    tab.find_element('css selector', '#login')
+    assert tab.handle != handle
+
+
+def test_page_that_does_not_load_times_out():
+    tabs = TabBrowser(SimpleNamespace(timeout=0.3))
+    tabs.browser = Driver()
+    # New document never shows up
+    with pytest.raises(TimeoutException):
+        Tab(tabs).get('http://portal/')
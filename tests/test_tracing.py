@@ -0,0 +1,23 @@
+import json
+from eracuni.tracing import Tracer
+
+
+def test_tracer_reports(tmp_path):
+    tracer = Tracer()
+    with tracer.span('startup'):
+        pass
+    tracer.start('infostan', 'home')
+    tracer.mark('infostan', 'home', 'login')
+    tracer.mark('infostan', 'home', 'table_read')
+    tracer.mark('infostan', 'home', 'table_read')
+    tracer.mark('infostan', 'home', 'logout')
+
+    tracer.write_json(str(tmp_path / 'run_report.json'))
+    report = json.loads((tmp_path / 'run_report.json').read_text(encoding='utf8'))
+    assert [span['name'] for span in report['spans']] == ['startup', 'login', 'table_read', 'table_read', 'logout']
+
+    tracer.write_prometheus(str(tmp_path / 'eracuni.prom'))
+    lines = (tmp_path / 'eracuni.prom').read_text(encoding='utf8').splitlines()
+    assert 'eracuni_step_count{provider="infostan",account="home",step="table_read"} 2' in lines
+    assert any(line.startswith('eracuni_step_duration_seconds{provider="",step="startup"} ') for line in lines)
+    assert any(line.startswith('eracuni_provider_duration_seconds{provider="infostan"} ') for line in lines)